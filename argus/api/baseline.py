@@ -8,6 +8,7 @@ import math
 from api import response
 from api.routes import api
 from constants import MAX_PER_PAGE
+from engine import RULES, ANALYTICS
 from models.core import BaselineSettings, Datasource
 from models.asset import Asset
 from models.alert import BaselineAlert
@@ -97,6 +98,7 @@ def baseline_update():
             app.baseline.create_high_dataflows_rules()
         else:
             app.baseline.delete_high_dataflows_rules()
+        app.scheduler.registry.bump(RULES)
     # update rules thresholds
     elif high_asset_pct_ch:
         app.baseline.update_high_dataflows_rules(
@@ -104,6 +106,7 @@ def baseline_update():
             pct=new_settings.high_asset_connections_pct,
             time_range=app.settings.baseline.baseline_time_range,
         )
+        app.scheduler.registry.bump(RULES)
 
     try:
         app.settings.update(baseline=new_settings)
@@ -187,6 +190,18 @@ def create_analytic():
                 active_assets = Asset.get_by_ids(data.get("asset_control"))
                 analytic.asset_control = active_assets
         analytic.validate()
+        costs = app.scheduler.costs
+        estimate = costs.estimate_analytic(analytic) if costs.enabled else None
+        if estimate and estimate.rejected:
+            return (
+                jsonify(
+                    {
+                        "message": "Analytic query exceeds the cost budget.",
+                        "cost": estimate.to_dict(),
+                    }
+                ),
+                HTTPStatus.BAD_REQUEST,
+            )
         analytic.save()
     except FieldDoesNotExist:
         return response("Invalid parameters"), HTTPStatus.BAD_REQUEST
@@ -195,6 +210,9 @@ def create_analytic():
     except Exception:
         return response("An error occured"), HTTPStatus.BAD_REQUEST
 
+    app.scheduler.registry.bump(ANALYTICS)
+    if estimate and estimate.warnings:
+        return jsonify({"message": "Analytic created.", "cost": estimate.to_dict()})
     return response("Analytic created.")
 
 
@@ -236,6 +254,7 @@ def update_analytic(code):
     except Exception:
         return response("An error occured"), HTTPStatus.BAD_REQUEST
 
+    app.scheduler.registry.bump(ANALYTICS)
     return response("Analytic updated.")
 
 
@@ -259,6 +278,7 @@ def update_analytic_status(code):
     except:
         return response("Error on state update"), HTTPStatus.BAD_REQUEST
 
+    app.scheduler.registry.bump(ANALYTICS)
     if active_status:
         app.scheduler.load_analytic(analytic)
     else:
@@ -281,6 +301,7 @@ def delete_analytic(code):
     except:
         return response("Error on deletion"), HTTPStatus.BAD_REQUEST
 
+    app.scheduler.registry.bump(ANALYTICS)
     return response("Analytic deleted.")
 
 
@@ -325,6 +346,19 @@ def run_analytic(code):
     return response("Analytic executed.")
 
 
+@api.route("/baseline/analytics/<code>/performance")
+def get_analytic_performance(code):
+    """Execution telemetry of an analytic over the given hours (1 day by default)"""
+    analytic = BaselineAnalytic.by_code(code)
+    if not analytic:
+        return response("Analytic not found."), HTTPStatus.NOT_FOUND
+
+    hours = request.args.get("hours", type=int, default=24)
+    if hours <= 0 or hours > 720:
+        return response("Invalid hours"), HTTPStatus.BAD_REQUEST
+    return jsonify(app.scheduler.telemetry.get_performance("analytic", code, hours))
+
+
 ############## Local Analytics ##############
 @api.route("/baseline/analytics/native")
 def get_native_analytics():
@@ -363,6 +397,7 @@ def import_native_analytics():
                 app.scheduler.load_analytic(analytic)
             except:
                 pass
+        app.scheduler.registry.bump(ANALYTICS)
         return response("Imported all analytics.")
 
     for code in codes:
@@ -375,4 +410,5 @@ def import_native_analytics():
         except:
             print("Error on native analytic import.")
 
+    app.scheduler.registry.bump(ANALYTICS)
     return response("Import completed.")
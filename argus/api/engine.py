@@ -0,0 +1,68 @@
+from flask import request, jsonify
+from flask import current_app as app
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+from api import response
+from api.routes import api
+from engine.telemetry import ROLLUP_FIELDS
+from models.engine import RulePerformance
+
+
+@api.route("/engine/load")
+def get_engine_load():
+    """
+    Projected number of scheduled rule and analytic runs per second,
+    over the given window of seconds (10 minutes by default, 1 day at most)
+    """
+    window = request.args.get("window", type=int, default=600)
+    if window <= 0 or window > 86400:
+        return response("Invalid window"), HTTPStatus.BAD_REQUEST
+    return jsonify(app.scheduler.get_load(window))
+
+
+@api.route("/engine/pressure")
+def get_engine_pressure():
+    """Current state of the engine query concurrency controller"""
+    return jsonify(app.elastic.pressure.state())
+
+
+@api.route("/engine/alerts")
+def get_engine_alerts():
+    """Alerts queued, written, failed and dropped by the engine alert sink"""
+    return jsonify(app.scheduler.alerts.stats())
+
+
+@api.route("/engine/cluster")
+def get_engine_cluster():
+    """Engine processes sharing the scheduled rules, when sharding is enabled"""
+    if not app.scheduler.cluster:
+        return jsonify({"sharding": False})
+    return jsonify({"sharding": True, **app.scheduler.cluster.state()})
+
+
+@api.route("/engine/stream")
+def get_engine_stream():
+    """Streamed rules and the read position of each datasource, when streaming is enabled"""
+    if not app.scheduler.stream:
+        return jsonify({"streaming": False})
+    return jsonify({"streaming": True, **app.scheduler.stream.state()})
+
+
+@api.route("/engine/performance")
+def get_engine_performance():
+    """
+    Rules and analytics that cost the most over the given hours (1 day by
+    default), sorted by elasticsearch time or any other rollup total
+    """
+    hours = request.args.get("hours", type=int, default=24)
+    limit = request.args.get("limit", type=int, default=20)
+    sort = request.args.get("sort", default="took")
+    if hours <= 0 or hours > 720 or limit <= 0:
+        return response("Invalid parameters"), HTTPStatus.BAD_REQUEST
+    if sort not in ROLLUP_FIELDS + ("runs", "errors", "max_duration"):
+        return response("Invalid sort"), HTTPStatus.BAD_REQUEST
+
+    app.scheduler.telemetry.flush()
+    since = datetime.utcnow() - timedelta(hours=hours)
+    return jsonify(RulePerformance.get_totals(since, sort, limit))
@@ -9,6 +9,7 @@ import yaml
 
 from api import response
 from constants import MAX_PER_PAGE
+from engine import DATASOURCES
 from extensions import rule_feed
 from models.core import Datasource, Roles
 from models.management import SigmaRepository, SigmaRuleMetadata
@@ -68,6 +69,7 @@ def create_datasource():
     except:
         return response("Invalid parameters"), HTTPStatus.BAD_REQUEST
 
+    app.scheduler.registry.bump(DATASOURCES)
     return response("Datasource created.")
 
 
@@ -95,6 +97,7 @@ def update_datasource(name):
     except Exception as e:
         return response("Invalid parameters"), HTTPStatus.FORBIDDEN
 
+    app.scheduler.registry.bump(DATASOURCES)
     return response("Datasource updated.")
 
 
@@ -114,6 +117,7 @@ def delete_datasource(name):
         datasource.delete()
     except:
         return response("Error on datasource deletion"), HTTPStatus.BAD_REQUEST
+    app.scheduler.registry.bump(DATASOURCES)
     return response("Datasource deleted.")
 
 
@@ -134,6 +138,8 @@ def automatic_datasource_resolver():
             ds = Datasource(name=module, indices=[indice], module=module)
             ds.save()
             count += 1
+    if count:
+        app.scheduler.registry.bump(DATASOURCES)
     return response(f"{count} datasources were found.")
 
 
@@ -40,3 +40,6 @@ from .fields import *
 
 ################## Statistics Endpoints ##################
 from .stats import *
+
+################## Engine Endpoints ##################
+from .engine import *
@@ -4,10 +4,19 @@ from elasticsearch.exceptions import BadRequestError
 from mongoengine import ValidationError
 from http import HTTPStatus
 import math
+import orjson
 
 from api.routes import api
 from api import response
 from constants import MAX_PER_PAGE, RISK_LOOKUP
+from engine import RULES, find_cycle
+from engine.offline import (
+    OfflineError,
+    evaluate_offline,
+    get_samples,
+    load_ndjson,
+    load_sample,
+)
 from models.core import Datasource
 from models.rule import (
     Rule,
@@ -28,9 +37,9 @@ from utils import parse_str_bool, to_dict
 from utils.extractor import (
     extract_sigma_rule_data,
     convert_sigma_to_eql_query,
-    get_event_day_count,
 )
 from utils.filter import clean_attrs
+from utils.time import to_epoch_millis
 
 base_attrs = [
     "name",
@@ -43,10 +52,18 @@ base_attrs = [
     "intelligence",
     "type",
 ]
-threshold_attrs = ["group_by", "filters", "conditions"]
+threshold_attrs = ["group_by", "filters", "conditions", "evidence_size"]
 eql_attrs = ["query", "type_alert"]
 
 
+def get_trigger_cycle(rule_uuid: str, trigger: dict | None) -> list[str] | None:
+    """Dependency cycle the trigger of a rule would create, if any"""
+    if not trigger or trigger.get("type") != RuleTriggerType.RULE.value:
+        return None
+    graph = app.scheduler.registry.get_graph()
+    return find_cycle(graph, trigger.get("value"), rule_uuid)
+
+
 @api.route("/rules")
 def get_rules():
     page = request.args.get("page", type=int, default=None)
@@ -126,9 +143,35 @@ def create_rule():
         else:
             return response("Invalid rule type"), HTTPStatus.BAD_REQUEST
 
+        cycle = get_trigger_cycle(str(rule.uuid), rule.trigger.to_mongo().to_dict())
+        if cycle:
+            return (
+                response(f"Rule trigger creates a cycle: {' -> '.join(cycle)}"),
+                HTTPStatus.BAD_REQUEST,
+            )
+
+        costs = app.scheduler.costs
+        estimate = costs.estimate_rule(rule) if costs.enabled else None
+        if estimate and estimate.rejected:
+            return (
+                jsonify(
+                    {
+                        "message": "Rule query exceeds the cost budget.",
+                        "cost": estimate.to_dict(),
+                    }
+                ),
+                HTTPStatus.BAD_REQUEST,
+            )
+
         rule.save()
+        app.scheduler.registry.bump(RULES)
         app.scheduler.load_rule(rule)
 
+        if estimate and estimate.warnings:
+            return (
+                jsonify({"message": "Rule created.", "cost": estimate.to_dict()}),
+                HTTPStatus.CREATED,
+            )
         return response("Rule created."), HTTPStatus.CREATED
     except:
         return response("An error occured."), HTTPStatus.BAD_REQUEST
@@ -142,6 +185,19 @@ def get_rule_by_uuid(rule_uuid):
     return jsonify(to_dict(rule))
 
 
+@api.route("/rules/<rule_uuid>/performance")
+def get_rule_performance(rule_uuid):
+    """Execution telemetry of a rule over the given hours (1 day by default)"""
+    rule = Rule.by_uuid(uuid=rule_uuid)
+    if not rule:
+        return response("Rule not found"), HTTPStatus.NOT_FOUND
+
+    hours = request.args.get("hours", type=int, default=24)
+    if hours <= 0 or hours > 720:
+        return response("Invalid hours"), HTTPStatus.BAD_REQUEST
+    return jsonify(app.scheduler.telemetry.get_performance("rule", rule_uuid, hours))
+
+
 @api.route("/rules/<rule_uuid>", methods=["PUT"])
 def update_rule_by_uuid(rule_uuid):
     rule = Rule.by_uuid(uuid=rule_uuid)
@@ -183,6 +239,13 @@ def update_rule_by_uuid(rule_uuid):
         tactics=rule_attack_tactics, techniques=rule_attack_techniques
     )
 
+    cycle = get_trigger_cycle(rule_uuid, data.get("trigger"))
+    if cycle:
+        return (
+            response(f"Rule trigger creates a cycle: {' -> '.join(cycle)}"),
+            HTTPStatus.BAD_REQUEST,
+        )
+
     try:
         data.pop("attack")
         if rule_type is RuleType.SEARCH_QUERY:
@@ -195,6 +258,10 @@ def update_rule_by_uuid(rule_uuid):
     except:
         return response("Invalid parameters"), HTTPStatus.BAD_REQUEST
 
+    app.scheduler.registry.bump(RULES)
+    # alerts of the previous version of the rule don't suppress the new one
+    if app.scheduler.suppression:
+        app.scheduler.suppression.discard(rule_uuid)
     return response("Rule updated.")
 
 
@@ -218,6 +285,7 @@ def update_rule_status_by_uuid(rule_uuid):
     except:
         return response("Error on state update"), HTTPStatus.BAD_REQUEST
 
+    app.scheduler.registry.bump(RULES)
     if active_status:
         app.scheduler.load_rule(rule)
     else:
@@ -235,6 +303,9 @@ def remove_rule_by_uuid(rule_uuid):
         rule.delete()
     except:
         return response("Error on rule deletion"), HTTPStatus.BAD_REQUEST
+
+    app.scheduler.registry.bump(RULES)
+    app.scheduler.remove_job_by_id(rule_uuid)
     return response("Rule removed.")
 
 
@@ -258,30 +329,20 @@ def run_rule(rule_uuid):
     return response("Rule executed.")
 
 
-@api.route("/rules/preview", methods=["POST"])
-def preview_rule():
-    if not request.is_json:
-        return response("Invalid JSON!"), HTTPStatus.BAD_REQUEST
-    rule = None
-
-    data = request.get_json()
-
+def build_preview_rule(data: dict, trigger: RuleTrigger) -> tuple[Rule | None, str]:
+    """Unsaved rule of the supplied attributes, or the error of the attributes"""
     # General rule attribute check
     if not all(attr in data.keys() for attr in ["timeframe", "datasources", "type"]):
-        return response("Missing rule preview paramaters"), HTTPStatus.BAD_REQUEST
+        return None, "Missing rule preview paramaters"
 
     rule_type = data.get("type")
-    trigger = RuleTrigger(type=RuleTriggerType.PERIODIC, value="0")
 
     # Specific rule type check
     if RuleType(rule_type) is RuleType.SEARCH_QUERY:
         if not all(
             attr in data.keys() for attr in ["group_by", "filters", "conditions"]
         ):
-            return (
-                response("Invalid Threshould rule paramaters"),
-                HTTPStatus.BAD_REQUEST,
-            )
+            return None, "Invalid Threshould rule paramaters"
         rule = ThresholdRule(
             name="preview",
             description="preview",
@@ -295,7 +356,7 @@ def preview_rule():
         )
     elif RuleType(rule_type) is RuleType.EQL_QUERY:
         if not all(attr in data.keys() for attr in ["query"]):
-            return response("Invalid EQL rule paramaters"), HTTPStatus.BAD_REQUEST
+            return None, "Invalid EQL rule paramaters"
         rule = EQLRule(
             name="preview",
             description="preview",
@@ -307,7 +368,24 @@ def preview_rule():
             query=data.get("query"),
         )
     else:
-        return response("Invalid rule type"), HTTPStatus.BAD_REQUEST
+        return None, "Invalid rule type"
+    return rule, ""
+
+
+@api.route("/rules/preview", methods=["POST"])
+def preview_rule():
+    if "sample" in request.files:
+        return preview_rule_offline()
+    if not request.is_json:
+        return response("Invalid JSON!"), HTTPStatus.BAD_REQUEST
+
+    data = request.get_json()
+    if data.get("sample"):
+        return preview_rule_offline()
+    trigger = RuleTrigger(type=RuleTriggerType.PERIODIC, value="0")
+    rule, error = build_preview_rule(data, trigger)
+    if not rule:
+        return response(error), HTTPStatus.BAD_REQUEST
 
     try:
         query_output, result = rule.run(app.elastic, None, preview=True)
@@ -318,6 +396,119 @@ def preview_rule():
         return response("Query error"), HTTPStatus.BAD_REQUEST
 
 
+def preview_rule_offline():
+    """
+    Preview of a threshold rule evaluated in-process over a sample of logs,
+    without elasticsearch. The sample is either an uploaded NDJSON file, along
+    with the rule attributes as a JSON form field, or the name of a sample
+    stored on disk. The timeframe ends at the latest log of the sample.
+    """
+    if "sample" in request.files:
+        try:
+            data = orjson.loads(request.form.get("rule", ""))
+            documents = load_ndjson(request.files["sample"].read())
+        except orjson.JSONDecodeError:
+            return response("Invalid rule JSON"), HTTPStatus.BAD_REQUEST
+        except OfflineError as e:
+            return response(str(e)), HTTPStatus.BAD_REQUEST
+    else:
+        data = request.get_json()
+        try:
+            documents = load_sample(str(data["sample"]))
+        except OfflineError as e:
+            return response(str(e)), HTTPStatus.BAD_REQUEST
+
+    if not isinstance(data, dict):
+        return response("Invalid rule JSON"), HTTPStatus.BAD_REQUEST
+    if len(documents) > app.config["ENGINE_OFFLINE_MAX_DOCUMENTS"]:
+        return response("Sample too large"), HTTPStatus.BAD_REQUEST
+
+    trigger = RuleTrigger(type=RuleTriggerType.PERIODIC, value="0")
+    rule, error = build_preview_rule(data, trigger)
+    if not rule:
+        return response(error), HTTPStatus.BAD_REQUEST
+
+    try:
+        rule.validate()
+        query_output, result, sample = evaluate_offline(rule, documents)
+    except (OfflineError, ValidationError) as e:
+        return response(str(e)), HTTPStatus.BAD_REQUEST
+    return jsonify({"result": result, "output": query_output, "sample": sample})
+
+
+@api.route("/rules/preview/samples")
+def get_preview_samples():
+    """Samples stored on disk that offline previews can evaluate"""
+    return jsonify(get_samples())
+
+
+@api.route("/rules/cost", methods=["POST"])
+def estimate_rule_cost():
+    """
+    Estimated elasticsearch cost of a rule, supplied as in a preview along
+    with its trigger, and whether it fits the budget of new rules
+    """
+    if not request.is_json:
+        return response("Invalid JSON!"), HTTPStatus.BAD_REQUEST
+
+    data = request.get_json()
+    trigger = RuleTrigger(
+        type=RuleTriggerType.PERIODIC, value=str(data.get("trigger", "0"))
+    )
+    rule, error = build_preview_rule(data, trigger)
+    if not rule:
+        return response(error), HTTPStatus.BAD_REQUEST
+    return jsonify(app.scheduler.costs.estimate_rule(rule).to_dict())
+
+
+@api.route("/rules/backtest", methods=["POST"])
+def backtest_rule():
+    """
+    Replays a rule, saved (uuid) or supplied as in a preview along with its
+    trigger, over a past date range. Returns the alerts it would have raised
+    on each run, the metrics of each window and the cost of the searches.
+    """
+    if not request.is_json:
+        return response("Invalid JSON!"), HTTPStatus.BAD_REQUEST
+
+    data = request.get_json()
+    start = to_epoch_millis(data.get("start"))
+    end = to_epoch_millis(data.get("end"))
+    if start is None or end is None or start >= end:
+        return response("Invalid backtest date range"), HTTPStatus.BAD_REQUEST
+
+    if "uuid" in data:
+        rule = Rule.by_uuid(uuid=data.get("uuid"))
+        if not rule:
+            return response("Rule not found"), HTTPStatus.NOT_FOUND
+    else:
+        trigger = RuleTrigger(
+            type=RuleTriggerType.PERIODIC, value=str(data.get("trigger", ""))
+        )
+        rule, error = build_preview_rule(data, trigger)
+        if not rule:
+            return response(error), HTTPStatus.BAD_REQUEST
+
+    try:
+        interval = rule.trigger.get_sleep_time()
+    except (KeyError, ValueError):
+        interval = -1
+    if interval <= 0:
+        return response("Rule isn't triggered periodically"), HTTPStatus.BAD_REQUEST
+
+    backtests = app.scheduler.backtests
+    if (end - start) // (interval * 1000) > backtests.max_windows:
+        return (
+            response(f"Date range exceeds {backtests.max_windows} rule runs"),
+            HTTPStatus.BAD_REQUEST,
+        )
+
+    try:
+        return jsonify(backtests.run(rule, start, end))
+    except Exception:
+        return response("Query error"), HTTPStatus.BAD_REQUEST
+
+
 @api.route("/rules/eql-lookup", methods=["POST"])
 def eql_lookup():
     if not request.is_json:
@@ -342,13 +533,23 @@ def eql_lookup():
         query=data.get("query"),
     )
 
-    prev_alerts = rule.run(app.elastic, None, lookup=True)
+    job = app.scheduler.lookups.start(rule)
+    if data.get("async"):
+        return jsonify(job.to_dict()), HTTPStatus.ACCEPTED
+
+    job.wait()
+    if job.status == "failed":
+        return response("Lookup failed"), HTTPStatus.INTERNAL_SERVER_ERROR
+    return jsonify(job.get_days())
 
-    if prev_alerts is None or len(prev_alerts) == 0:
-        return jsonify([])
 
-    prev_alerts_by_day = get_event_day_count(prev_alerts)
-    return jsonify(prev_alerts_by_day)
+@api.route("/rules/eql-lookup/<job_id>")
+def get_eql_lookup(job_id):
+    """Progress and the per-day counts found so far of an asynchronous lookup"""
+    job = app.scheduler.lookups.get_job(job_id)
+    if not job:
+        return response("Lookup not found"), HTTPStatus.NOT_FOUND
+    return jsonify(job.to_dict())
 
 
 @api.route("/rules/sigma", methods=["POST"])
@@ -400,6 +601,9 @@ def import_external_rules():
     success_count = 0
     error_count = 0
     skipped_count = 0
+    rejected_count = 0
+    warnings = {}
+    costs = app.scheduler.costs
 
     if not request.is_json:
         return response("Invalid JSON!"), HTTPStatus.BAD_REQUEST
@@ -410,6 +614,10 @@ def import_external_rules():
         return response("Missing external rule ids"), HTTPStatus.NOT_FOUND
 
     ids = list(set(ids))
+    # each estimate runs sample searches, so bulk imports opt in to them
+    estimate_costs = costs.enabled and bool(
+        data.get("estimate", app.config["ENGINE_COST_ON_IMPORT"])
+    )
     trigger = RuleTrigger(type=RuleTriggerType.PERIODIC, value="10m")
 
     for uuid in ids:
@@ -444,11 +652,20 @@ def import_external_rules():
                 origin=RuleOrigin.EXTERNAL,
                 alert_type=AlertType.ALERT,
             )
+            estimate = costs.estimate_rule(rule) if estimate_costs else None
+            if estimate and estimate.rejected:
+                rejected_count += 1
+                continue
+            if estimate and estimate.warnings:
+                warnings[str(rule.uuid)] = estimate.warnings
             rule.save()
             success_count += 1
         except:
             error_count += 1
 
+    if success_count > 0:
+        app.scheduler.registry.bump(RULES)
+
     return jsonify(
         {
             "message": "Import done.",
@@ -456,6 +673,8 @@ def import_external_rules():
                 "success": success_count,
                 "skipped": skipped_count,
                 "error": error_count,
+                "rejected": rejected_count,
             },
+            "warnings": warnings,
         }
     )
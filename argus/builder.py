@@ -1,8 +1,7 @@
 from typing import Any, Optional
 
 from models.core import TimeRange
-from models.rule import Condition, ConditionOperator, ConditionFunction
-
+from models.rule import Condition, ConditionFunction, ConditionLogic, ConditionOperator
 
 operation_lookup = {
     ConditionFunction.AVG: "avg",
@@ -39,11 +38,11 @@ def build_search_query(query: dict, cond: Condition):
     if "aggs" in query.keys() and "groupby" in query["aggs"].keys():
         if not "aggs" in query["aggs"]["groupby"].keys():
             query["aggs"]["groupby"]["aggs"] = {}
-        query["aggs"]["groupby"]["aggs"][f"{cond.function.value}-{cond.field}"] = {
+        query["aggs"]["groupby"]["aggs"][cond.get_key()] = {
             operation_lookup[cond.function]: {"field": cond.field}
         }
     elif "aggs" in query.keys():
-        query["aggs"][f"{cond.function.value}-{cond.field}"] = {
+        query["aggs"][cond.get_key()] = {
             operation_lookup[cond.function]: {"field": cond.field}
         }
     # else:
@@ -51,13 +50,46 @@ def build_search_query(query: dict, cond: Condition):
     #        f"{agg.function}-{agg.field}": {operation_lookup[agg.function].value: {"field": agg.field}}}
 
 
-def set_groupby(query, groupings):
-    if len(groupings) > 1:
-        query["aggs"] = {"groupby": {"multi_terms": {"terms": []}}}
-        for field in groupings:
-            query["aggs"]["groupby"]["multi_terms"]["terms"].append({"field": field})
-    else:
-        query["aggs"] = {"groupby": {"terms": {"field": groupings[0]}}}
+def build_bucket_selector(condition_lists: list[list[Condition]]) -> Optional[dict]:
+    """
+    Compiles condition chains into a bucket_selector pipeline aggregation,
+    keeping only the buckets where any of the chains is met
+    """
+    paths = {}
+    chains = []
+    for conditions in condition_lists:
+        chain = None
+        for cond in conditions:
+            var = paths.setdefault(cond.get_key(), f"v{len(paths)}")
+            expr = f"params.{var} {cond.operator.value} {int(cond.limit)}"
+            if chain is None:
+                chain = expr
+            elif cond.logic is ConditionLogic.ALL:
+                chain = f"({chain} && {expr})"
+            else:
+                chain = f"({chain} || {expr})"
+        if chain:
+            chains.append(chain)
+
+    if not chains:
+        return None
+    return {
+        "bucket_selector": {
+            "buckets_path": {var: key for key, var in paths.items()},
+            "script": " || ".join(chains),
+        }
+    }
+
+
+def set_composite_groupby(query, groupings, size, after=None, interval=None):
+    sources = [{field: {"terms": {"field": field}}} for field in groupings]
+    if interval:
+        # fixed time buckets (ms wide) of each group, keyed by their start
+        histogram = {"field": "@timestamp", "fixed_interval": f"{interval}ms"}
+        sources.insert(0, {"@timestamp": {"date_histogram": histogram}})
+    query["aggs"] = {"groupby": {"composite": {"sources": sources, "size": size}}}
+    if after:
+        query["aggs"]["groupby"]["composite"]["after"] = after
 
 
 def get_base_query() -> dict[str, Any]:
@@ -5,6 +5,7 @@ from typing import Optional
 
 from constants import SEARCH_LIMIT, WINDOW_SIZE
 from config import Config
+from engine.pressure import PressureController, is_rejection
 from models.core import Datasource, TimeRange
 from models.rule import Filter, FilterType
 import builder
@@ -24,6 +25,17 @@ class ElasticClient:
         else:
             raise ConnectionError("Invalid authentication information.")
         self._pipelines: IngestClient = IngestClient(client=self._es)
+        # concurrent engine queries allowed against the cluster, adapted to
+        # its latency and rejections
+        max_queries = config.ENGINE_MAX_CONCURRENT_QUERIES
+        if max_queries <= 0:
+            max_queries = config.SCHEDULER_EXECUTORS["default"]["max_workers"]
+        self.pressure = PressureController(
+            max_queries,
+            min_limit=config.ENGINE_MIN_CONCURRENT_QUERIES,
+            target_latency=config.ENGINE_TARGET_LATENCY_MS / 1000,
+            defer_risk=config.ENGINE_DEFER_RISK,
+        )
         self.check_indices()
 
     def get_all_data_streams(self):
@@ -71,6 +83,21 @@ class ElasticClient:
     def search(self, *args, **kwargs):
         return self._es.search(*args, **kwargs)
 
+    def msearch(self, searches: list[tuple[str | list[str], dict]]) -> list[dict]:
+        """
+        Sends several searches in a single _msearch round trip.
+        Returns one response (or error) entry per search, in order.
+        """
+        body = []
+        for index, query in searches:
+            body.append({"index": index})
+            body.append(query)
+        r = self._es.msearch(searches=body)
+        for response in r["responses"]:
+            if "error" in response and is_rejection(response):
+                self.pressure.observe_rejection()
+        return r["responses"]
+
     # TODO - move to utils
     def cal_iter(self, page, size):
         import math
@@ -121,14 +148,13 @@ class ElasticClient:
         except:
             return None
 
-    def search_by_fields2(
+    def build_fields_query(
         self,
         fields: list[str],
-        index: Optional[str | list[str]] = "*",
         filters: Optional[list[Filter]] = None,
         rel_range: Optional[str] = None,
         time_range: Optional[TimeRange] = None,
-    ):
+    ) -> dict:
         if len(fields) == 1:
             terms = {"terms": {"field": fields[0], "size": SEARCH_LIMIT}}
         else:
@@ -156,7 +182,17 @@ class ElasticClient:
             builder.set_timeframe(query, rel_range)
         if filters:
             builder.set_filters(query, filters)
+        return query
 
+    def search_by_fields2(
+        self,
+        fields: list[str],
+        index: Optional[str | list[str]] = "*",
+        filters: Optional[list[Filter]] = None,
+        rel_range: Optional[str] = None,
+        time_range: Optional[TimeRange] = None,
+    ):
+        query = self.build_fields_query(fields, filters, rel_range, time_range)
         result = self._es.search(index=index, body=query, request_timeout=60)
         data = result["aggregations"]["values"]["buckets"]
 
@@ -187,16 +223,40 @@ class ElasticClient:
         r_id = r["hits"]["hits"][0]["_id"]
         self._es.delete(index=index, id=r_id)
 
-    def eql_search(self, *args, **kwargs):
+    def eql_search(self, *args, raise_errors: bool = False, **kwargs):
         try:
             return self._es.eql.search(*args, **kwargs)
         except Exception as e:
+            if raise_errors:
+                raise
             return
 
+    def validate_query(self, index: str | list[str], query: dict):
+        return self._es.indices.validate_query(index=index, query=query, explain=True)
+
+    def count_range(self, index: str | list[str], start: int, end: int) -> int:
+        """Number of documents of the indices between two epoch ms timestamps"""
+        time_range = {"gte": start, "lte": end, "format": "epoch_millis"}
+        r = self._es.count(index=index, query={"range": {"@timestamp": time_range}})
+        return r["count"]
+
     def indice_field_mapping(self, index: str, fields: str = "*"):
         r = self._es.indices.get_field_mapping(index=index, fields=fields)
         return r
 
+    def get_field_types(
+        self, index: str | list[str], fields: list[str]
+    ) -> dict[str, set[str]]:
+        """Types each field is mapped to across the indices"""
+        r = self._es.field_caps(index=index, fields=fields)
+        return {name: set(types.keys()) for name, types in r["fields"].items()}
+
+    def open_point_in_time(self, index: str | list[str], keep_alive: str) -> str:
+        return self._es.open_point_in_time(index=index, keep_alive=keep_alive)["id"]
+
+    def close_point_in_time(self, pit_id: str):
+        self._es.close_point_in_time(id=pit_id)
+
     def indice_count(self, index: str, q=None):
         try:
             r = self._es.count(index=index, q=q)
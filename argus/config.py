@@ -2,7 +2,7 @@ from dotenv import load_dotenv, set_key, find_dotenv, dotenv_values
 import secrets
 import os
 
-from utils import get_config_path
+from utils import get_config_path, parse_str_bool
 
 env_file = find_dotenv(os.path.join(get_config_path(), f".env"))
 env_values = dotenv_values(env_file)
@@ -47,6 +47,111 @@ class Config:
     WTF_CSRF_CHECK_DEFAULT = False
     WTF_CSRF_TIME_LIMIT = None
     ATTACK_MITRE_VERSION = os.environ.get("ATTACK_MITRE_VERSION", "15.1")
+    # rule engine
+    # "job" runs each rule on its own scheduler job, "batch" gathers the rules
+    # due on every tick and coalesces their searches
+    ENGINE_EXECUTION_MODE = os.environ.get("ENGINE_EXECUTION_MODE", "job")
+    # "async" starts the due rules of every tick on an asyncio event loop, with
+    # limits of in flight searches per datasource and in total
+    ENGINE_ASYNC_DATASOURCE_CONCURRENCY = int(
+        os.environ.get("ENGINE_ASYNC_DATASOURCE_CONCURRENCY", 20)
+    )
+    ENGINE_ASYNC_MAX_IN_FLIGHT = int(os.environ.get("ENGINE_ASYNC_MAX_IN_FLIGHT", 1000))
+    ENGINE_TICK_SECONDS = int(os.environ.get("ENGINE_TICK_SECONDS", 5))
+    ENGINE_MSEARCH_SIZE = int(os.environ.get("ENGINE_MSEARCH_SIZE", 100))
+    # batched rules with the same datasources, filters and timeframe share a search
+    ENGINE_SHARED_SCANS = parse_str_bool(os.environ.get("ENGINE_SHARED_SCANS", "true"))
+    ENGINE_EQL_WORKERS = int(os.environ.get("ENGINE_EQL_WORKERS", 8))
+    # seconds between checks of the rule and analytic collection versions
+    ENGINE_REGISTRY_REFRESH_SECONDS = int(
+        os.environ.get("ENGINE_REGISTRY_REFRESH_SECONDS", 5)
+    )
+    ENGINE_COMPOSITE_PAGE_SIZE = int(os.environ.get("ENGINE_COMPOSITE_PAGE_SIZE", 1000))
+    # evaluate group by conditions in elasticsearch with a bucket selector
+    ENGINE_CONDITION_PUSHDOWN = parse_str_bool(
+        os.environ.get("ENGINE_CONDITION_PUSHDOWN", "true")
+    )
+    # "lazy" fetches sample logs only for firing buckets, "eager" requests
+    # them along with every search
+    ENGINE_EVIDENCE_MODE = os.environ.get("ENGINE_EVIDENCE_MODE", "lazy")
+    ENGINE_EVIDENCE_SIZE = int(os.environ.get("ENGINE_EVIDENCE_SIZE", 10))
+    # engine queries sent to elasticsearch at once, 0 for the scheduler threads
+    ENGINE_MAX_CONCURRENT_QUERIES = int(
+        os.environ.get("ENGINE_MAX_CONCURRENT_QUERIES", 10)
+    )
+    ENGINE_MIN_CONCURRENT_QUERIES = int(
+        os.environ.get("ENGINE_MIN_CONCURRENT_QUERIES", 1)
+    )
+    # query latency average over which the engine reduces its concurrency
+    ENGINE_TARGET_LATENCY_MS = int(os.environ.get("ENGINE_TARGET_LATENCY_MS", 2000))
+    # rules under this risk are deferred while the cluster is under stress
+    ENGINE_DEFER_RISK = int(os.environ.get("ENGINE_DEFER_RISK", 5))
+    # split scheduled rules and analytics between engine processes
+    ENGINE_SHARDING = parse_str_bool(os.environ.get("ENGINE_SHARDING"))
+    ENGINE_HEARTBEAT_SECONDS = int(os.environ.get("ENGINE_HEARTBEAT_SECONDS", 10))
+    # seconds without heartbeat after which a node's jobs move to the others
+    ENGINE_NODE_TIMEOUT = int(os.environ.get("ENGINE_NODE_TIMEOUT", 30))
+    # processes running the CPU bound stage of executions, 0 runs it inline
+    ENGINE_CPU_WORKERS = int(os.environ.get("ENGINE_CPU_WORKERS", 0))
+    # smaller stages run inline, larger payloads go through shared memory
+    ENGINE_CPU_MIN_ITEMS = int(os.environ.get("ENGINE_CPU_MIN_ITEMS", 1000))
+    ENGINE_CPU_SHM_BYTES = int(os.environ.get("ENGINE_CPU_SHM_BYTES", 1 << 20))
+    # matches returned to scheduled EQL searches, which only alert the first new one
+    ENGINE_EQL_SIZE = int(os.environ.get("ENGINE_EQL_SIZE", 10))
+    # pages of those matches read until a new one is found
+    ENGINE_EQL_MAX_PAGES = int(os.environ.get("ENGINE_EQL_MAX_PAGES", 10))
+    # seconds scheduled EQL searches stay behind now, for events still being ingested
+    ENGINE_EQL_LAG_SECONDS = int(os.environ.get("ENGINE_EQL_LAG_SECONDS", 5))
+    # EQL lookups search history in slices of these seconds, on this many threads
+    ENGINE_LOOKUP_SLICE_SECONDS = int(
+        os.environ.get("ENGINE_LOOKUP_SLICE_SECONDS", 86400)
+    )
+    ENGINE_LOOKUP_WORKERS = int(os.environ.get("ENGINE_LOOKUP_WORKERS", 4))
+    # threads evaluating the windows of a backtest, and the most windows it can have
+    ENGINE_BACKTEST_WORKERS = int(os.environ.get("ENGINE_BACKTEST_WORKERS", 4))
+    ENGINE_BACKTEST_MAX_WINDOWS = int(
+        os.environ.get("ENGINE_BACKTEST_MAX_WINDOWS", 2000)
+    )
+    # latest runs kept per rule, and seconds between writes of the hourly rollups
+    ENGINE_TELEMETRY_SIZE = int(os.environ.get("ENGINE_TELEMETRY_SIZE", 100))
+    ENGINE_TELEMETRY_FLUSH_SECONDS = int(
+        os.environ.get("ENGINE_TELEMETRY_FLUSH_SECONDS", 60)
+    )
+    # estimate the query cost of new rules and analytics: off, warn or reject
+    # those over the milliseconds per run or per second of schedule budgets
+    ENGINE_COST_MODE = os.environ.get("ENGINE_COST_MODE", "warn")
+    ENGINE_COST_SAMPLE_SECONDS = int(os.environ.get("ENGINE_COST_SAMPLE_SECONDS", 300))
+    ENGINE_COST_MAX_RUN_MS = int(os.environ.get("ENGINE_COST_MAX_RUN_MS", 30000))
+    ENGINE_COST_MAX_LOAD = float(os.environ.get("ENGINE_COST_MAX_LOAD", 50))
+    # imports of external rules only estimate their cost when asked to
+    ENGINE_COST_ON_IMPORT = parse_str_bool(
+        os.environ.get("ENGINE_COST_ON_IMPORT", "false")
+    )
+    # simple filter count rules are evaluated from one tail of each datasource
+    ENGINE_STREAMING = parse_str_bool(os.environ.get("ENGINE_STREAMING", "false"))
+    ENGINE_STREAM_POLL_SECONDS = int(os.environ.get("ENGINE_STREAM_POLL_SECONDS", 5))
+    ENGINE_STREAM_PAGE_SIZE = int(os.environ.get("ENGINE_STREAM_PAGE_SIZE", 1000))
+    ENGINE_STREAM_MAX_PAGES = int(os.environ.get("ENGINE_STREAM_MAX_PAGES", 10))
+    # seconds the tail stays behind now, for documents still being indexed
+    ENGINE_STREAM_LAG_SECONDS = int(os.environ.get("ENGINE_STREAM_LAG_SECONDS", 5))
+    # documents of a sample evaluated by an offline rule preview
+    ENGINE_OFFLINE_MAX_DOCUMENTS = int(
+        os.environ.get("ENGINE_OFFLINE_MAX_DOCUMENTS", 100000)
+    )
+    # threads running the rules triggered by other rules
+    ENGINE_DEPENDENCY_WORKERS = int(os.environ.get("ENGINE_DEPENDENCY_WORKERS", 4))
+    # alerts are written in batches by a background thread
+    ENGINE_ALERT_BATCH_SIZE = int(os.environ.get("ENGINE_ALERT_BATCH_SIZE", 500))
+    ENGINE_ALERT_FLUSH_SECONDS = float(os.environ.get("ENGINE_ALERT_FLUSH_SECONDS", 2))
+    ENGINE_ALERT_QUEUE_SIZE = int(os.environ.get("ENGINE_ALERT_QUEUE_SIZE", 10000))
+    # seconds an alert waits for room in a full queue before it is dropped
+    ENGINE_ALERT_QUEUE_TIMEOUT = float(os.environ.get("ENGINE_ALERT_QUEUE_TIMEOUT", 5))
+    # seconds repeats of an alert only increase its hit count, 0 disables it
+    ENGINE_SUPPRESSION_WINDOW = int(os.environ.get("ENGINE_SUPPRESSION_WINDOW", 3600))
+    # keep threshold rule aggregates in time buckets and only query new data
+    ENGINE_INCREMENTAL_WINDOWS = parse_str_bool(
+        os.environ.get("ENGINE_INCREMENTAL_WINDOWS")
+    )
 
 
 config = Config()
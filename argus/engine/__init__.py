@@ -0,0 +1,19 @@
+from .search import SearchRequest, SearchError, drive
+from .batch import BatchExecutor
+from .window import IncrementalWindows
+from .plan import QueryPlan, QueryPlanCache, compile_plan, get_time_range
+from .dag import DependencyExecutor, build_graph, find_cycle
+from .schedule import next_run, phase_offset, phase_start, project_load
+from .pressure import PressureController, ThrottledClient
+from .cluster import EngineCluster
+from .cpu import CPUPool
+from .aio import AsyncEngine
+from .lookup import EQLLookup, LookupJob
+from .backtest import Backtest, CostMeter, get_evaluations
+from .telemetry import RunStats, Telemetry
+from .cost import CostEstimate, CostEstimator
+from .stream import StreamEngine, StreamRule, is_streamable
+from .registry import RuleRegistry, RULES, ANALYTICS, DATASOURCES
+from .evaluate import evaluate_conditions
+from .sink import AlertSink
+from .suppress import SuppressionCache, fingerprint
@@ -0,0 +1,153 @@
+from __future__ import annotations
+from threading import Lock, Thread
+from typing import Any
+import asyncio
+import time
+import traceback
+
+from elasticsearch.exceptions import ApiError
+
+from engine.search import RuleExecution, SearchError, SearchRequest
+
+
+def step(method, value) -> tuple[bool, Any]:
+    """Advances an execution, returns whether it finished along with its output"""
+    try:
+        return False, method(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+class AsyncEngine:
+    """
+    Runs rule executions on an asyncio event loop with AsyncElasticsearch, so
+    many searches can be in flight from a single thread. Executions are the
+    same generators the threaded engine drives; they are advanced on the
+    loop's default executor, keeping database writes and CPU work off the loop.
+    Every search in flight holds a query slot of the pressure controller,
+    shared with the threaded engine; searches wait for one on the loop,
+    woken by the controller when a slot frees up.
+    """
+
+    def __init__(
+        self, config, pressure, datasource_concurrency: int, max_in_flight: int
+    ):
+        self._config = config
+        self._pressure = pressure
+        self._datasource_concurrency = datasource_concurrency
+        self._max_in_flight = max_in_flight
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._running: set[str] = set()
+        self._lock = Lock()
+        self._loop = asyncio.new_event_loop()
+        self._es = None
+        self._in_flight = None
+        self._released = asyncio.Event()
+        pressure.subscribe(lambda: self._loop.call_soon_threadsafe(self._released.set))
+        Thread(target=self._loop.run_forever, name="engine-async", daemon=True).start()
+
+    def _client(self):
+        # created on the loop, the client is bound to it
+        if not self._es:
+            from elasticsearch import AsyncElasticsearch
+
+            config = self._config
+            if config.ELASTIC_API_KEY:
+                auth = {"api_key": config.ELASTIC_API_KEY}
+            else:
+                auth = {"basic_auth": (config.ELASTIC_USER, config.ELASTIC_PASS)}
+            self._es = AsyncElasticsearch(config.ELASTIC_HOST, **auth)
+            self._in_flight = asyncio.Semaphore(self._max_in_flight)
+        return self._es
+
+    def _semaphore(self, index: list[str] | str) -> asyncio.Semaphore:
+        key = index if isinstance(index, str) else ",".join(index)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self._datasource_concurrency)
+        return self._semaphores[key]
+
+    async def _acquire(self):
+        """Waits on the loop for a query slot of the pressure controller"""
+        while not self._pressure.try_acquire():
+            self._released.clear()
+            # a slot freed before the clear wouldn't wake this wait
+            if self._pressure.try_acquire():
+                return
+            await self._released.wait()
+
+    async def _search(self, request: SearchRequest):
+        es = self._client()
+        async with self._in_flight, self._semaphore(request.index):
+            await self._acquire()
+            start = time.monotonic()
+            try:
+                if request.eql:
+                    response = await es.eql.search(index=request.index, **request.body)
+                else:
+                    response = await es.search(index=request.index, body=request.body)
+            except Exception as e:
+                self._pressure.observe(time.monotonic() - start, e)
+                if request.eql:
+                    # same as the synchronous client, failed EQL searches are empty
+                    return None
+                raise
+            finally:
+                self._pressure.release()
+            self._pressure.observe(time.monotonic() - start)
+            return response
+
+    async def _multi_search(self, requests: list[SearchRequest]) -> list:
+        responses = await asyncio.gather(
+            *[self._search(r) for r in requests], return_exceptions=True
+        )
+        return [
+            SearchError(r.body, r.meta.status) if isinstance(r, ApiError) else r
+            for r in responses
+        ]
+
+    async def drive(self, execution: RuleExecution) -> Any:
+        """Runs a rule execution to completion, awaiting each of its searches"""
+        loop = asyncio.get_running_loop()
+        method, value = execution.send, None
+        while True:
+            done, request = await loop.run_in_executor(None, step, method, value)
+            if done:
+                return request
+
+            if isinstance(request, list):
+                method, value = execution.send, await self._multi_search(request)
+                continue
+            try:
+                method, value = execution.send, await self._search(request)
+            except Exception as e:
+                method, value = execution.throw, e
+
+    async def _run(self, key: str, execution: RuleExecution):
+        try:
+            await self.drive(execution)
+        except Exception:
+            print(f"[Engine] Execution {key} failed")
+            print(traceback.format_exc())
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+    def submit(self, executions: dict[str, RuleExecution]) -> list[str]:
+        """
+        Schedules executions on the loop without waiting for them. Keys still
+        running from a previous submit are skipped. Returns the keys started.
+        """
+        started = []
+        with self._lock:
+            for key, execution in executions.items():
+                if key in self._running:
+                    execution.close()
+                    continue
+                self._running.add(key)
+                started.append(key)
+                asyncio.run_coroutine_threadsafe(self._run(key, execution), self._loop)
+        return started
+
+    def state(self) -> dict:
+        with self._lock:
+            return {"running": len(self._running)}
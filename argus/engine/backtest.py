@@ -0,0 +1,221 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import Lock
+import time
+import traceback
+
+from engine.plan import compile_plan
+from engine.search import drive
+from engine.window import IncrementalWindows, merge_groups
+from models.rule import EQLRule, Rule, ThresholdRule
+from utils.time import get_timeframe_seconds
+
+# Histogram buckets aggregated by each search of a shared backtest
+BUCKETS_PER_SEARCH = 100
+
+
+class CostMeter:
+    """Elastic client wrapper recording the cost of the searches sent through it"""
+
+    def __init__(self, elastic):
+        self._es = elastic
+        self.requests = 0
+        self.searches = 0
+        self.took = 0
+        self.errors = 0
+        self._lock = Lock()
+
+    def _record(self, responses: list, requests: int = 1):
+        with self._lock:
+            self.requests += requests
+            for response in responses:
+                self.searches += 1
+                # client responses wrap their body
+                response = getattr(response, "body", response)
+                if not response or "error" in response:
+                    self.errors += 1
+                    continue
+                self.took += response.get("took", 0)
+
+    def search(self, index, body):
+        try:
+            response = self._es.search(index=index, body=body)
+        except Exception:
+            self._record([None])
+            raise
+        self._record([response])
+        return response
+
+    def msearch(self, searches: list) -> list[dict]:
+        try:
+            responses = self._es.msearch(searches)
+        except Exception:
+            self._record([None] * len(searches))
+            raise
+        self._record(responses)
+        return responses
+
+    def eql_search(self, index, **body):
+        response = self._es.eql_search(index=index, **body)
+        self._record([response])
+        return response
+
+    def cost(self) -> dict:
+        return {
+            "requests": self.requests,
+            "searches": self.searches,
+            "took": self.took,
+            "errors": self.errors,
+        }
+
+
+def get_evaluations(start: int, end: int, interval: int) -> list[int]:
+    """Times (epoch ms) a rule running every interval is evaluated between start and end"""
+    first = start + (-start % interval)
+    return list(range(first, end + 1, interval))
+
+
+def to_iso(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).isoformat()
+
+
+class Backtest:
+    """
+    Replays a rule over a past date range, evaluating it at each of its
+    trigger intervals as a preview, so no alert is written. Windows are
+    evaluated concurrently on a bounded pool. Threshold rules with mergeable
+    metrics share the partial aggregates of interval wide buckets between
+    their windows, searching each bucket once.
+    """
+
+    def __init__(self, elastic, workers: int, max_windows: int):
+        self._es = elastic
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="backtest"
+        )
+        self._windows = IncrementalWindows()
+        self.max_windows = max_windows
+
+    def is_shared(self, rule: Rule) -> bool:
+        return (
+            isinstance(rule, ThresholdRule)
+            and self._windows.supports(rule)
+            and get_timeframe_seconds(rule.timeframe) is not None
+        )
+
+    def run(self, rule: Rule, start: int, end: int) -> dict:
+        interval = rule.trigger.get_sleep_time() * 1000
+        evaluations = get_evaluations(start, end, interval)
+        meter = CostMeter(self._es)
+        shared = self.is_shared(rule)
+
+        started = time.monotonic()
+        if shared:
+            windows = self._run_shared(rule, evaluations, interval, meter)
+        else:
+            windows = self._run_each(rule, evaluations, meter)
+        duration = time.monotonic() - started
+
+        alerts = {}
+        for window in windows:
+            for alert_type, window_alerts in window["alerts"].items():
+                alerts[alert_type] = alerts.get(alert_type, 0) + len(window_alerts)
+        return {
+            "shared": shared,
+            "alerts": alerts,
+            "firing": sum(1 for w in windows if any(w["alerts"].values())),
+            "windows": windows,
+            "cost": {**meter.cost(), "duration": duration},
+        }
+
+    def _run_each(self, rule: Rule, evaluations: list[int], meter: CostMeter):
+        """Runs the rule preview of each window, as its own searches"""
+
+        def evaluate(end: int) -> dict:
+            window = {"end": to_iso(end), "alerts": {}, "metrics": {}}
+            try:
+                output = rule.run(meter, None, preview=True, end=end)
+            except Exception:
+                traceback.print_exc()
+                output = None
+            if output is None:
+                window["error"] = "Query error"
+                return window
+
+            result, window["alerts"] = output
+            if isinstance(rule, EQLRule):
+                window["metrics"] = {"matches": result["total"]["value"]}
+            else:
+                window["metrics"] = self.describe(rule, result)
+            return window
+
+        return list(self._pool.map(evaluate, evaluations))
+
+    def _search_buckets(self, rule, index, start: int, end: int, interval: int, meter):
+        """Partial aggregates of the interval buckets between start and end"""
+        windows, _ = drive(
+            self._windows.search_groups(rule, index, start, end - 1, interval=interval),
+            meter,
+        )
+        return windows
+
+    def _run_shared(self, rule, evaluations: list[int], interval: int, meter):
+        """Searches every bucket once and evaluates each window from its buckets"""
+        _, metrics = self._windows.metric_aggs(rule)
+        timeframe = get_timeframe_seconds(rule.timeframe) * 1000
+        if not evaluations:
+            return []
+
+        def window_start(end: int) -> int:
+            start = end - timeframe
+            return start - start % interval
+
+        first = window_start(evaluations[0])
+        span = BUCKETS_PER_SEARCH * interval
+        chunks = [
+            (s, min(s + span, evaluations[-1]))
+            for s in range(first, evaluations[-1], span)
+        ]
+        # the datasources are resolved once for all the chunks
+        index = compile_plan(rule).index
+        buckets = {}
+        for chunk in self._pool.map(
+            lambda c: self._search_buckets(rule, index, *c, interval, meter), chunks
+        ):
+            buckets.update(chunk)
+
+        windows = []
+        for end in evaluations:
+            groups = {}
+            for key in range(window_start(end), end, interval):
+                if key in buckets:
+                    merge_groups(groups, buckets[key], metrics)
+            aggregations = self._windows.to_aggregations(rule, groups)
+
+            alerts = {"alert": [], "alarm": []}
+            drive(
+                rule.process(None, aggregations, None, None, None, alerts, True), None
+            )
+            windows.append(
+                {
+                    "end": to_iso(end),
+                    "alerts": alerts,
+                    "metrics": self.describe(rule, aggregations),
+                }
+            )
+        return windows
+
+    def describe(self, rule: ThresholdRule, aggregations: dict) -> dict:
+        """Number of groups and the highest value of each condition metric"""
+        if len(rule.group_by) == 0:
+            buckets = [aggregations]
+        else:
+            buckets = aggregations["groupby"]["buckets"]
+
+        metrics = {"groups": len(buckets)}
+        for cond in rule.get_conditions():
+            key = cond.get_key()
+            values = [b[key]["value"] for b in buckets if b[key]["value"] is not None]
+            metrics[key] = max(values) if values else None
+        return metrics
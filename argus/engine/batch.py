@@ -0,0 +1,102 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+import traceback
+
+from engine.search import RuleExecution, SearchRequest, multi_search
+from engine.shared import merge_requests, split_response
+
+
+class BatchExecutor:
+    """
+    Runs several rule executions together. On every round the pending
+    searches of all executions are coalesced into _msearch calls and the
+    responses are fanned back out to each execution. EQL has no multi-search
+    API, so EQL searches of the same round are sent concurrently instead.
+    Aggregation searches of a round that scan the same documents, like rules
+    differing only in conditions or group by, can be shared as one search.
+    """
+
+    def __init__(
+        self,
+        elastic,
+        msearch_size: int = 100,
+        eql_workers: int = 8,
+        shared_scans: bool = False,
+    ):
+        self._es = elastic
+        self._msearch_size = msearch_size
+        self._eql_workers = eql_workers
+        self._shared_scans = shared_scans
+        self.shared = 0
+
+    def _advance(self, pending: dict, results: dict, key: str, execution, value):
+        try:
+            if isinstance(value, Exception):
+                request = execution.throw(value)
+            else:
+                request = execution.send(value)
+            pending[key] = (execution, request)
+        except StopIteration as stop:
+            pending.pop(key, None)
+            results[key] = stop.value
+        except Exception as e:
+            pending.pop(key, None)
+            results[key] = e
+            print(f"[Engine] Execution {key} failed")
+            print(traceback.format_exc())
+
+    def _eql_search(self, request: SearchRequest):
+        """EQL response, or the error thrown into the execution that needs it"""
+        try:
+            return self._es.eql_search(index=request.index, **request.body)
+        except Exception as e:
+            return e
+
+    def run(self, executions: dict[str, RuleExecution]) -> dict[str, Any]:
+        """Runs all executions to completion, returns their results by key"""
+        pending = {}
+        results = {}
+        for key, execution in executions.items():
+            # Priming a generator is the same as sending it None
+            self._advance(pending, results, key, execution, None)
+
+        while pending:
+            searches = []
+            eql_searches = []
+            for key, (_, request) in pending.items():
+                if isinstance(request, list):
+                    searches.extend((key, r) for r in request)
+                elif request.eql:
+                    eql_searches.append((key, request))
+                else:
+                    searches.append((key, request))
+
+            responses = {key: [] for key in pending.keys()}
+            requests = [r for _, r in searches]
+            routes = [(i, None) for i in range(len(requests))]
+            if self._shared_scans:
+                requests, routes = merge_requests(requests)
+                self.shared += len(searches) - len(requests)
+
+            answers = []
+            for i in range(0, len(requests), self._msearch_size):
+                batch = requests[i : i + self._msearch_size]
+                answers.extend(multi_search(self._es, batch))
+            for (key, _), (position, namespace) in zip(searches, routes):
+                responses[key].append(split_response(answers[position], namespace))
+
+            if eql_searches:
+                with ThreadPoolExecutor(max_workers=self._eql_workers) as pool:
+                    eql_responses = pool.map(
+                        self._eql_search, [r for _, r in eql_searches]
+                    )
+                    for (key, _), response in zip(eql_searches, eql_responses):
+                        responses[key].append(response)
+
+            for key, key_responses in responses.items():
+                execution, request = pending[key]
+                value = key_responses if isinstance(request, list) else key_responses[0]
+                self._advance(pending, results, key, execution, value)
+
+        return results
@@ -0,0 +1,121 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+from mongoengine.errors import NotUniqueError
+from threading import Lock
+import atexit
+import hashlib
+import os
+import socket
+import time
+import uuid
+
+from models.engine import EngineNode, JobLease
+
+
+def rendezvous_owner(job: str, nodes: list[str]) -> str | None:
+    """Node with the highest hash score for a job, stable while the node set is"""
+    if not nodes:
+        return None
+    return max(nodes, key=lambda node: hashlib.sha1(f"{node}:{job}".encode()).digest())
+
+
+class EngineCluster:
+    """
+    Splits scheduled jobs between the engine processes sharing the database.
+    Processes heartbeat an EngineNode entry; each job belongs to one of the
+    live nodes by rendezvous hashing, so the jobs of a dead node move to the
+    others once its heartbeat times out. Owners hold a JobLease and claim
+    each interval slot once, fenced by the lease token.
+    """
+
+    def __init__(self, heartbeat: int, timeout: int):
+        self.node = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.heartbeat_interval = heartbeat
+        self.timeout = timedelta(seconds=timeout)
+        self._nodes: list[str] = []
+        self._nodes_at = 0.0
+        self._lock = Lock()
+        atexit.register(self.leave)
+
+    def heartbeat(self):
+        EngineNode.beat(self.node, datetime.utcnow())
+        self._nodes_at = 0.0
+
+    def leave(self):
+        """Removes the node, its jobs move to the others on their next run"""
+        EngineNode.objects(node=self.node).delete()
+        JobLease.objects(owner=self.node).update(set__expires_at=datetime.utcnow())
+
+    def get_nodes(self) -> list[str]:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._nodes_at >= self.heartbeat_interval:
+                alive = EngineNode.get_alive(datetime.utcnow() - self.timeout)
+                if self.node not in alive:
+                    self.heartbeat()
+                    alive.append(self.node)
+                self._nodes = sorted(alive)
+                self._nodes_at = now
+            return self._nodes
+
+    def owns(self, job: str) -> bool:
+        return rendezvous_owner(job, self.get_nodes()) == self.node
+
+    def acquire(self, job: str) -> int | None:
+        """Renews or takes over the lease of a job, returns its fencing token"""
+        now = datetime.utcnow()
+        expires_at = now + self.timeout
+        try:
+            JobLease.objects(job=job).update_one(
+                upsert=True,
+                set_on_insert__owner="",
+                set_on_insert__token=0,
+                set_on_insert__last_slot=-1,
+                set_on_insert__expires_at=now,
+            )
+        except NotUniqueError:
+            # created at the same time by another node
+            pass
+
+        lease = JobLease.objects(job=job, owner=self.node).modify(
+            new=True, set__expires_at=expires_at
+        )
+        if not lease:
+            lease = JobLease.objects(job=job, expires_at__lte=now).modify(
+                new=True, set__owner=self.node, set__expires_at=expires_at, inc__token=1
+            )
+        if not lease:
+            return None
+        return lease.token
+
+    def claim_slot(self, job: str, interval: int, phase: float = 0) -> int | None:
+        """
+        Claims the current interval slot of a job for this node, returns the
+        slot or None when another node runs it. Succeeds once per slot across
+        all nodes.
+        """
+        if not self.owns(job):
+            return None
+        token = self.acquire(job)
+        if token is None:
+            return None
+
+        slot = round((time.time() - phase) / interval)
+        claimed = JobLease.objects(
+            job=job, owner=self.node, token=token, last_slot__lt=slot
+        ).update_one(set__last_slot=slot)
+        return slot if claimed == 1 else None
+
+    def claim(self, job: str, interval: int, phase: float = 0) -> bool:
+        """Whether this node should run the current interval slot of a job"""
+        if interval <= 0:
+            return True
+        return self.claim_slot(job, interval, phase) is not None
+
+    def state(self) -> dict:
+        nodes = self.get_nodes()
+        return {
+            "node": self.node,
+            "nodes": nodes,
+            "leases": JobLease.objects(owner=self.node).count(),
+        }
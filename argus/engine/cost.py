@@ -0,0 +1,280 @@
+from __future__ import annotations
+from dataclasses import asdict, dataclass, field
+import re
+import time
+import traceback
+
+from constants import SEARCH_LIMIT
+from engine.plan import compile_plan
+from engine.telemetry import count_buckets
+from models.baseline import AnalyticType, BaselineAnalytic
+from models.rule import EQLRule, Rule, ThresholdRule
+from utils.time import get_timeframe_seconds
+
+# query_string terms starting with a wildcard, which scan the whole term index
+LEADING_WILDCARD = re.compile(r"(^|[\s(:\"])[*?][^\s)]")
+
+
+@dataclass
+class CostEstimate:
+    """
+    Estimated elasticsearch cost of a rule or analytic, extrapolated from
+    a search over a sample window. Run time is the milliseconds elasticsearch
+    spends on each run, load the milliseconds per second of the schedule.
+    """
+
+    verdict: str = "ok"
+    valid: bool = True
+    error: str | None = None
+    warnings: list[str] = field(default_factory=list)
+    sample_seconds: int = 0
+    sample_took: int = 0
+    sample_docs: int = 0
+    sample_buckets: int = 0
+    searched_docs: int = 0
+    run_ms: float = 0
+    interval: int | None = None
+    load: float | None = None
+    profile: list[dict] = field(default_factory=list)
+
+    @property
+    def rejected(self) -> bool:
+        return self.verdict == "reject"
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def find_clauses(node, name: str) -> list:
+    """All the values of a clause in a (nested) search body"""
+    if isinstance(node, list):
+        return [c for n in node for c in find_clauses(n, name)]
+    if not isinstance(node, dict):
+        return []
+    found = [node[name]] if name in node else []
+    return found + [c for v in node.values() for c in find_clauses(v, name)]
+
+
+def top_clauses(response: dict, limit: int = 3) -> list[dict]:
+    """Most expensive query clauses of a profiled search, summed over its shards"""
+    clauses = {}
+    for shard in response.get("profile", {}).get("shards", []):
+        for search in shard.get("searches", []):
+            stack = list(search.get("query", []))
+            while stack:
+                clause = stack.pop()
+                key = (clause["type"], clause["description"][:256])
+                clauses[key] = clauses.get(key, 0) + clause["time_in_nanos"]
+                stack.extend(clause.get("children", []))
+    top = sorted(clauses.items(), key=lambda c: c[1], reverse=True)[:limit]
+    return [
+        {"type": t, "description": d, "time_ms": nanos / 1e6} for (t, d), nanos in top
+    ]
+
+
+class CostEstimator:
+    """
+    Estimates what a rule or analytic will cost before it's scheduled. The
+    compiled query is validated and profiled over a short sample window;
+    the sample time is then scaled by the documents each run searches, and
+    by the runs of the trigger interval. Over budget rules are warned about
+    or rejected, depending on the mode.
+    """
+
+    def __init__(
+        self,
+        elastic,
+        settings,
+        sample_seconds: int,
+        max_run_ms: int,
+        max_load: float,
+        mode: str,
+        page_size: int,
+        incremental: bool,
+    ):
+        self._es = elastic
+        self._settings = settings
+        self.sample_seconds = sample_seconds
+        self.max_run_ms = max_run_ms
+        self.max_load = max_load
+        self.mode = mode
+        self.page_size = page_size
+        self.incremental = incremental
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("warn", "reject")
+
+    def _searched_range(self, rule: Rule, now: int) -> int:
+        """Start (epoch ms) of the data searched by a scheduled run of a rule"""
+        from engine.window import IncrementalWindows
+
+        interval = rule.trigger.get_sleep_time()
+        timeframe = get_timeframe_seconds(rule.timeframe)
+        span = timeframe * 1000 if timeframe else None
+        if isinstance(rule, EQLRule) and interval > 0:
+            # scheduled runs only search from their checkpoint
+            searched = interval * 1000 + rule.get_maxspan()
+            span = min(span, searched) if span else searched
+        elif self.incremental and interval > 0 and IncrementalWindows().supports(rule):
+            span = interval * 1000
+        return now - span if span else 0
+
+    def _lint_rule(self, rule: Rule, body: dict) -> list[str]:
+        warnings = []
+        for query_string in find_clauses(body.get("query"), "query_string"):
+            if LEADING_WILDCARD.search(query_string.get("query", "")):
+                warnings.append("Filter with a leading wildcard")
+                break
+        if rule.timeframe == "always" and find_clauses(body.get("query"), "script"):
+            warnings.append("Painless script filter over the whole history")
+        return warnings
+
+    def _finish(self, estimate: CostEstimate, scale: float, searches: int):
+        estimate.run_ms = estimate.sample_took * scale * searches
+        if estimate.interval:
+            estimate.load = estimate.run_ms / estimate.interval
+
+        over = []
+        if estimate.run_ms > self.max_run_ms:
+            over.append(f"Estimated {estimate.run_ms:.0f}ms per run")
+        if estimate.load is not None and estimate.load > self.max_load:
+            over.append(f"Estimated {estimate.load:.1f}ms of search per second")
+        estimate.warnings.extend(over)
+
+        if (over or not estimate.valid) and self.mode == "reject":
+            estimate.verdict = "reject"
+        elif over or estimate.warnings or not estimate.valid:
+            estimate.verdict = "warn"
+        return estimate
+
+    def _scale(self, index, sample_start: int, searched_start: int, now: int):
+        """Searched documents of a run, relative to the ones of the sample"""
+        sample_docs = self._es.count_range(index, sample_start, now)
+        searched_docs = self._es.count_range(index, searched_start, now)
+        if sample_docs > 0:
+            return sample_docs, searched_docs, searched_docs / sample_docs
+        seconds = (now - searched_start) / 1000
+        return sample_docs, searched_docs, max(seconds / self.sample_seconds, 1)
+
+    def estimate_rule(self, rule: Rule) -> CostEstimate:
+        estimate = CostEstimate(sample_seconds=self.sample_seconds)
+        interval = rule.trigger.get_sleep_time()
+        estimate.interval = interval if interval > 0 else None
+        now = int(time.time() * 1000)
+        sample_start = now - self.sample_seconds * 1000
+
+        try:
+            plan = compile_plan(rule)
+            body = plan.stamp(sample_start, now)
+            estimate.warnings = self._lint_rule(rule, body)
+
+            if isinstance(rule, ThresholdRule):
+                validation = self._es.validate_query(plan.index, body["query"])
+                if not validation["valid"]:
+                    estimate.valid = False
+                    errors = [
+                        e.get("error") for e in validation.get("explanations", [])
+                    ]
+                    estimate.error = "; ".join(e for e in errors if e) or "Invalid"
+                    return self._finish(estimate, 0, 0)
+                # the composite group by is paged, the sample only needs a page
+                body["profile"] = True
+                response = self._es.search(index=plan.index, body=body)
+                response = getattr(response, "body", response)
+                estimate.profile = top_clauses(response)
+                estimate.sample_buckets = count_buckets(response.get("aggregations"))
+                if len(rule.group_by) > 1 and estimate.sample_buckets >= self.page_size:
+                    estimate.warnings.append(
+                        "Group by of many fields with a large number of groups"
+                    )
+            else:
+                response = self._es.eql_search(
+                    index=plan.index, raise_errors=True, **body
+                )
+                response = getattr(response, "body", response)
+            estimate.sample_took = response.get("took", 0)
+
+            estimate.sample_docs, estimate.searched_docs, scale = self._scale(
+                plan.index, sample_start, self._searched_range(rule, now), now
+            )
+        except Exception as e:
+            if getattr(e, "status_code", None) == 400:
+                # elasticsearch refused the query itself
+                estimate.valid = False
+                estimate.error = str(e)
+                return self._finish(estimate, 0, 0)
+            traceback.print_exc()
+            estimate.verdict = "unknown"
+            estimate.error = "Couldn't estimate the query cost"
+            return estimate
+        return self._finish(estimate, scale, 1)
+
+    def estimate_analytic(self, analytic: BaselineAnalytic) -> CostEstimate:
+        estimate = CostEstimate(sample_seconds=self.sample_seconds)
+        estimate.interval = analytic.get_sleep_time()
+        now = int(time.time() * 1000)
+        sample_start = now - self.sample_seconds * 1000
+        index = analytic.get_datasources()
+
+        try:
+            from builder import init_bool_query
+
+            body = self._es.build_fields_query(analytic.fields, analytic.filters)
+            init_bool_query(body)
+            body["query"]["bool"]["must"].append(
+                {
+                    "range": {
+                        "@timestamp": {
+                            "gte": sample_start,
+                            "lte": now,
+                            "format": "epoch_millis",
+                        }
+                    }
+                }
+            )
+            body["size"] = 0
+            validation = self._es.validate_query(index, body["query"])
+            if not validation["valid"]:
+                estimate.valid = False
+                errors = [e.get("error") for e in validation.get("explanations", [])]
+                estimate.error = "; ".join(e for e in errors if e) or "Invalid"
+                return self._finish(estimate, 0, 0)
+
+            body["profile"] = True
+            response = self._es.search(index=index, body=body)
+            response = getattr(response, "body", response)
+            estimate.profile = top_clauses(response)
+            estimate.sample_took = response.get("took", 0)
+            estimate.sample_buckets = count_buckets(response.get("aggregations"))
+            if estimate.sample_buckets >= SEARCH_LIMIT:
+                estimate.warnings.append("Fields with more values than are searched")
+
+            # every run searches the latest timeframe and the baseline range
+            timeframe = get_timeframe_seconds(analytic.timeframe) or estimate.interval
+            self._settings.reload()
+            base_range = self._settings.baseline.baseline_time_range
+            sample_docs = self._es.count_range(index, sample_start, now)
+            searched_docs = self._es.count_range(index, now - timeframe * 1000, now)
+            searched_docs += self._es.count_range(
+                index,
+                int(base_range.start.timestamp() * 1000),
+                int(base_range.end.timestamp() * 1000),
+            )
+        except Exception as e:
+            if getattr(e, "status_code", None) == 400:
+                estimate.valid = False
+                estimate.error = str(e)
+                return self._finish(estimate, 0, 0)
+            traceback.print_exc()
+            estimate.verdict = "unknown"
+            estimate.error = "Couldn't estimate the query cost"
+            return estimate
+
+        estimate.sample_docs, estimate.searched_docs = sample_docs, searched_docs
+        scale = searched_docs / sample_docs if sample_docs > 0 else 1
+        # asset analytics search once per asset
+        searches = 1
+        if analytic.category is AnalyticType.ASSET:
+            searches = max(len(analytic.asset_control), 1)
+        return self._finish(estimate, scale, searches)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from threading import Lock
+import atexit
+import orjson
+
+
+def extract_ips(logs_list: list[list[dict]]) -> list[list[str]]:
+    """Related IPv4 addresses of each list of logs"""
+    from utils.extractor import extract_ips_from_logs
+
+    return [extract_ips_from_logs(logs) for logs in logs_list]
+
+
+def freeze(value):
+    """
+    Hashable form of a JSON value, equal for equal values: dict keys are
+    unordered and numbers compare by value, as with ==
+    """
+    if isinstance(value, dict):
+        return frozenset((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def deviations(data: dict) -> list:
+    """Latest values missing from the baseline values, in their original order"""
+    base = {freeze(e) for e in data["base"]}
+    return [e for e in data["latest"] if freeze(e) not in base]
+
+
+TASKS = {
+    "extract_ips": extract_ips,
+    "deviations": deviations,
+}
+# tasks mapping over a list payload, one result per item
+MAP_TASKS = {"extract_ips"}
+
+
+def run_task(task: str, data: bytes | None, shm_name: str | None, size: int):
+    """Worker side of an offloaded task, reading its payload inline or from shared memory"""
+    if shm_name:
+        shm = SharedMemory(name=shm_name)
+        try:
+            data = bytes(shm.buf[:size])
+        finally:
+            # the parent owns the segment and unlinks it
+            shm.close()
+    return TASKS[task](orjson.loads(data))
+
+
+class CPUPool:
+    """
+    Runs the CPU bound stage of rule and analytic executions on a process pool,
+    out of the scheduler threads doing the elasticsearch I/O. Payloads are
+    serialized with orjson, and passed through shared memory when large.
+    Small payloads, or a pool of 0 workers, run inline.
+    """
+
+    def __init__(self, workers: int, shm_threshold: int, min_items: int):
+        self.workers = workers
+        self.shm_threshold = shm_threshold
+        self.min_items = min_items
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = Lock()
+        atexit.register(self.close)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if not self._pool:
+                # forking the threaded scheduler process isn't safe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=get_context("spawn")
+                )
+            return self._pool
+
+    def run(self, task: str, payload, items: int):
+        """Runs a task over a payload of the given number of items"""
+        if self.workers <= 0 or items < self.min_items:
+            return TASKS[task](payload)
+
+        if task not in MAP_TASKS:
+            return self._submit(task, payload)
+
+        # list tasks are split between the workers
+        size = -(-len(payload) // self.workers)
+        chunks = [payload[i : i + size] for i in range(0, len(payload), size)]
+        segments = []
+        try:
+            futures = [self._submit(task, chunk, segments) for chunk in chunks]
+            return [r for future in futures for r in future.result()]
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+    def _submit(self, task: str, payload, segments: list | None = None):
+        """
+        Submits a task to the pool. Without a list of segments to release, waits
+        for its result.
+        """
+        data = orjson.dumps(payload)
+        if len(data) < self.shm_threshold:
+            future = self._get_pool().submit(run_task, task, data, None, 0)
+            return future if segments is not None else future.result()
+
+        shm = SharedMemory(create=True, size=len(data))
+        shm.buf[: len(data)] = data
+        future = self._get_pool().submit(run_task, task, None, shm.name, len(data))
+        if segments is not None:
+            segments.append(shm)
+            return future
+        try:
+            return future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,97 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock, local
+import traceback
+import networkx as nx
+
+from models.rule import Rule, RuleTriggerType
+
+
+def build_graph(rules: list[Rule]) -> nx.DiGraph:
+    """Dependency graph of the rules, with an edge from each rule to the ones it triggers"""
+    graph = nx.DiGraph()
+    for rule in rules:
+        graph.add_node(str(rule.uuid))
+        if rule.trigger.type is RuleTriggerType.RULE:
+            graph.add_edge(rule.trigger.value, str(rule.uuid))
+    return graph
+
+
+def find_cycle(graph: nx.DiGraph, parent: str, child: str) -> list[str] | None:
+    """
+    Returns the cycle closed by making the child rule triggered by the parent,
+    as a list of rule uuids, or None if the trigger is safe
+    """
+    if parent == child:
+        return [child, child]
+    if child not in graph or parent not in graph:
+        return None
+    if not nx.has_path(graph, child, parent):
+        return None
+    return nx.shortest_path(graph, child, parent) + [child]
+
+
+class TickContext:
+    """Rules executed by one tick, along with the rules they triggered"""
+
+    def __init__(self):
+        self._executed: set[str] = set()
+        self._lock = Lock()
+
+    def claim(self, rule_uuid: str) -> bool:
+        """Marks a rule as executed, returns False if it already was"""
+        with self._lock:
+            if rule_uuid in self._executed:
+                return False
+            self._executed.add(rule_uuid)
+            return True
+
+
+class DependencyExecutor:
+    """
+    Runs the rules triggered by other rules on a bounded pool. Dependents of a
+    rule run in parallel, and every rule runs at most once per tick, which
+    also stops cycles the save time checks didn't catch.
+    """
+
+    def __init__(self, workers: int):
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="rule-dependents"
+        )
+        self._local = local()
+
+    def _context(self) -> TickContext | None:
+        return getattr(self._local, "context", None)
+
+    @contextmanager
+    def tick(self):
+        """Shares a tick context with every rule finished inside the block"""
+        previous = self._context()
+        self._local.context = previous or TickContext()
+        try:
+            yield self._local.context
+        finally:
+            self._local.context = previous
+
+    def trigger(self, scheduler, rule: Rule):
+        """Schedules the dependents of a finished rule"""
+        context = self._context() or TickContext()
+        context.claim(str(rule.uuid))
+
+        for dependent in scheduler.registry.get_dependents(str(rule.uuid)):
+            if not context.claim(str(dependent.uuid)):
+                print(
+                    f"[Engine] Skipping rule already run by this tick: {dependent.name}"
+                )
+                continue
+            self._pool.submit(self._run, scheduler, dependent, context)
+
+    def _run(self, scheduler, rule: Rule, context: TickContext):
+        self._local.context = context
+        try:
+            scheduler.handle_rule_task(rule)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._local.context = None
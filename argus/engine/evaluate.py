@@ -0,0 +1,36 @@
+from __future__ import annotations
+import numpy as np
+
+from models.rule import Condition, ConditionLogic, comparison_lookup
+
+logic_lookup = {
+    ConditionLogic.ALL: np.logical_and,
+    ConditionLogic.ANY: np.logical_or,
+}
+
+
+def metric_column(buckets: list[dict], key: str) -> np.ndarray:
+    """Values of a metric aggregation across buckets, NaN where missing"""
+    values = [bucket[key]["value"] for bucket in buckets]
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def evaluate_conditions(conditions: list[Condition], buckets: list[dict]) -> np.ndarray:
+    """
+    Evaluates a condition chain over every bucket at once. Conditions are
+    chained left to right by the logic of the following condition, the
+    comparison operators work element-wise on the metric columns.
+    Returns the indices of the buckets meeting the chain.
+    """
+    if len(conditions) == 0 or len(buckets) == 0:
+        return np.empty(0, dtype=np.intp)
+
+    columns = {}
+    result = None
+    for cond in conditions:
+        key = cond.get_key()
+        if key not in columns:
+            columns[key] = metric_column(buckets, key)
+        met = comparison_lookup[cond.operator](columns[key], int(cond.limit))
+        result = met if result is None else logic_lookup[cond.logic](result, met)
+    return np.flatnonzero(result)
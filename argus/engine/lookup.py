@@ -0,0 +1,183 @@
+from __future__ import annotations
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+import time
+import traceback
+import uuid
+
+from engine.plan import compile_plan
+from models.rule import EQLRule
+from utils.time import gen_day_from_date
+
+# Largest result of an EQL search
+EQL_LIMIT = 10000
+
+
+class LookupJob:
+    """Progress and per-day match counts of a historical EQL lookup"""
+
+    def __init__(self):
+        self.id = str(uuid.uuid4())
+        self.status = "running"
+        self.slices = 0
+        self.done = 0
+        self.failed = 0
+        self.truncated = 0
+        self.total = 0
+        self.counts: Counter = Counter()
+        self.started_at = time.time()
+        self.finished_at = None
+        self._lock = Lock()
+        self._finished = Event()
+
+    def add_slices(self, count: int):
+        with self._lock:
+            self.slices += count
+
+    def is_complete(self) -> bool:
+        with self._lock:
+            return self.done >= self.slices
+
+    def split(self):
+        """A slice was replaced by its two halves"""
+        with self._lock:
+            self.slices += 2
+            self.done += 1
+
+    def add(self, timestamps: list[str] | None, truncated: bool = False):
+        with self._lock:
+            self.done += 1
+            if timestamps is None:
+                self.failed += 1
+                return
+            self.truncated += int(truncated)
+            self.total += len(timestamps)
+            self.counts.update(t.split("T")[0] for t in timestamps)
+
+    def finish(self, status: str = "done"):
+        self.status = status
+        self.finished_at = time.time()
+        self._finished.set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def get_days(self) -> list[dict]:
+        with self._lock:
+            if not self.counts:
+                return []
+            days = gen_day_from_date(min(self.counts.keys()))
+            for day in days:
+                day["value"] = self.counts.get(day["date"], 0)
+            return days
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "slices": self.slices,
+            "done": self.done,
+            "failed": self.failed,
+            "truncated": self.truncated,
+            "total": self.total,
+            "days": self.get_days(),
+        }
+
+
+class EQLLookup:
+    """
+    Counts the historical matches of an EQL query per day. History is split in
+    time slices searched concurrently; slices filling a whole EQL result are
+    bisected until they don't, so counts aren't capped by the result size.
+    """
+
+    def __init__(self, elastic, workers: int, slice_ms: int, keep: int = 20):
+        self._es = elastic
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="eql-lookup"
+        )
+        self._slice_ms = max(slice_ms, 1000)
+        self._keep = keep
+        self._jobs: OrderedDict[str, LookupJob] = OrderedDict()
+        self._lock = Lock()
+
+    def get_job(self, job_id: str) -> LookupJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _get_start(self, index: str) -> int | None:
+        """Timestamp (epoch ms) of the oldest event of the indices"""
+        r = self._es.search(
+            index=index,
+            body={"size": 0, "aggs": {"start": {"min": {"field": "@timestamp"}}}},
+        )
+        start = r["aggregations"]["start"]["value"]
+        return int(start) if start is not None else None
+
+    def start(self, rule: EQLRule) -> LookupJob:
+        """Starts a lookup of the rule query over all the indexed history"""
+        job = LookupJob()
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._keep:
+                self._jobs.popitem(last=False)
+
+        plan = compile_plan(rule)
+        try:
+            start = self._get_start(plan.index)
+        except Exception:
+            traceback.print_exc()
+            job.finish("failed")
+            return job
+
+        end = int(time.time() * 1000)
+        if start is None:
+            start = end
+        slices = [
+            (s, min(s + self._slice_ms, end)) for s in range(start, end, self._slice_ms)
+        ]
+        if not slices:
+            job.finish()
+            return job
+
+        job.add_slices(len(slices))
+        for s, e in slices:
+            self._pool.submit(self._run, job, rule, plan, s, e)
+        return job
+
+    def _run(self, job: LookupJob, rule: EQLRule, plan, start: int, end: int):
+        self._search(job, rule, plan, start, end)
+        # bisected halves are searched within their parent slice
+        if job.is_complete():
+            job.finish("done" if job.failed == 0 else "partial")
+
+    def _search(self, job: LookupJob, rule: EQLRule, plan, start: int, end: int):
+        # slices are half open, and overlap the previous one by the maxspan so
+        # sequences crossing their start are found: each is counted by the
+        # slice it ends in
+        body = plan.stamp(start - rule.get_maxspan(), end - 1)
+        body["size"] = EQL_LIMIT
+        try:
+            result = self._es.eql_search(index=plan.index, **body)
+            matches = rule.get_matches(result) if result else None
+        except Exception:
+            traceback.print_exc()
+            matches = None
+
+        timestamps = None
+        if matches is not None:
+            timestamps = [
+                events[0]["_source"]["@timestamp"]
+                for events in matches
+                if (rule.get_event_time(events[-1]) or start) >= start
+            ]
+        full = matches is not None and len(matches) >= EQL_LIMIT
+        if full and end - start > 1000:
+            # too many matches, count each half instead
+            middle = start + (end - start) // 2
+            job.split()
+            self._search(job, rule, plan, start, middle)
+            self._search(job, rule, plan, middle, end)
+            return
+        job.add(timestamps, truncated=full)
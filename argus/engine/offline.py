@@ -0,0 +1,285 @@
+from __future__ import annotations
+from fnmatch import fnmatchcase
+from itertools import product
+from typing import Callable
+import os
+import re
+import time
+
+import numpy as np
+import orjson
+
+from engine.plan import get_time_range
+from engine.search import drive
+from engine.stream import get_values
+from models.rule import (
+    ConditionFunction,
+    ConditionOperator,
+    Filter,
+    FilterType,
+    ThresholdRule,
+)
+from utils import get_samples_path
+from utils.time import to_epoch_millis
+
+# query_string range terms, e.g. >=10 or [1 TO 5}
+COMPARISON = re.compile(r"^(>=|<=|>|<)\s*(-?\d+(?:\.\d+)?)$")
+RANGE = re.compile(r"^([\[{])\s*(\S+)\s+TO\s+(\S+)\s*([\]}])$")
+# query_string syntax outside of the compiled subset
+UNSUPPORTED = re.compile(r"[\s()~^/:!&|+]")
+
+
+class OfflineError(Exception):
+    """Raised when a rule or a sample can't be evaluated offline"""
+
+
+def _parse_bound(value: str) -> float | None:
+    if value == "*":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise OfflineError(f"Unsupported range bound: {value}")
+
+
+def _to_number(value: str) -> float | None:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def compile_term(term: str) -> Callable[[list[str]], bool]:
+    """Predicate over the values of a field matching a single query_string term"""
+    term = term.strip()
+    if len(term) > 1 and term[0] == term[-1] == '"':
+        phrase = term[1:-1]
+        return lambda values: phrase in values
+    if term == "*":
+        return lambda values: len(values) > 0
+
+    comparison = COMPARISON.match(term)
+    if comparison:
+        operator, limit = comparison.group(1), float(comparison.group(2))
+        compare = {
+            ">": lambda v: v > limit,
+            ">=": lambda v: v >= limit,
+            "<": lambda v: v < limit,
+            "<=": lambda v: v <= limit,
+        }[operator]
+        return lambda values: any(
+            n is not None and compare(n) for n in map(_to_number, values)
+        )
+
+    bounds = RANGE.match(term)
+    if bounds:
+        low, high = _parse_bound(bounds.group(2)), _parse_bound(bounds.group(3))
+        low_inclusive, high_inclusive = bounds.group(1) == "[", bounds.group(4) == "]"
+
+        def in_range(n: float | None) -> bool:
+            if n is None:
+                return False
+            if low is not None and (n < low or (n == low and not low_inclusive)):
+                return False
+            if high is not None and (n > high or (n == high and not high_inclusive)):
+                return False
+            return True
+
+        return lambda values: any(in_range(n) for n in map(_to_number, values))
+
+    if "\\" in term:
+        literal = re.sub(r"\\(.)", r"\1", term)
+        return lambda values: literal in values
+    if not term or UNSUPPORTED.search(term) or term[0] == "-":
+        raise OfflineError(f"Unsupported filter value: {term}")
+    if "*" in term or "?" in term:
+        return lambda values: any(fnmatchcase(v, term) for v in values)
+    return lambda values: term in values
+
+
+def compile_filter(rule_filter: Filter) -> Callable[[dict], bool]:
+    """
+    Predicate of a document matching a simple filter, as the query_string
+    set_filters builds from it: its comma separated values are alternatives
+    and the NE operator negates the match
+    """
+    if rule_filter.type is not FilterType.SIMPLE:
+        raise OfflineError("Painless script filters can't be evaluated offline")
+    terms = [compile_term(term) for term in rule_filter.value.split(",")]
+    field_name = rule_filter.field
+    negate = rule_filter.operator is ConditionOperator.NE
+
+    def predicate(doc: dict) -> bool:
+        values = get_values(doc, field_name)
+        return any(term(values) for term in terms) != negate
+
+    return predicate
+
+
+def load_ndjson(data: bytes | str) -> list[dict]:
+    """Documents of a NDJSON sample, either sources or search hits"""
+    if isinstance(data, str):
+        data = data.encode()
+    documents = []
+    for number, line in enumerate(data.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            doc = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            raise OfflineError(f"Invalid JSON on line {number}")
+        if not isinstance(doc, dict):
+            raise OfflineError(f"Line {number} isn't a JSON object")
+        documents.append(doc.get("_source", doc))
+    return documents
+
+
+def get_samples() -> list[str]:
+    """Names of the samples stored on disk"""
+    path = get_samples_path()
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        f[: -len(".ndjson")] for f in os.listdir(path) if f.endswith(".ndjson")
+    )
+
+
+def load_sample(name: str) -> list[dict]:
+    """Documents of a sample stored on disk"""
+    if name not in get_samples():
+        raise OfflineError(f"Unknown sample: {name}")
+    with open(os.path.join(get_samples_path(), f"{name}.ndjson"), "rb") as f:
+        return load_ndjson(f.read())
+
+
+def _metric_values(
+    function: ConditionFunction, codes: np.ndarray, values: list[str], groups: int
+) -> np.ndarray:
+    """Value of a metric aggregation in each group, NaN where it has none"""
+    if function is ConditionFunction.COUNT:
+        return np.bincount(codes, minlength=groups).astype(np.float64)
+
+    if function is ConditionFunction.UNIQ:
+        if len(values) == 0:
+            return np.zeros(groups)
+        _, value_codes = np.unique(np.array(values), return_inverse=True)
+        distinct = int(value_codes.max()) + 1
+        pairs = np.unique(codes * distinct + value_codes)
+        return np.bincount(pairs // distinct, minlength=groups).astype(np.float64)
+
+    numbers = np.array([_to_number(v) for v in values], dtype=np.float64)
+    numeric = ~np.isnan(numbers)
+    codes, numbers = codes[numeric], numbers[numeric]
+    counts = np.bincount(codes, minlength=groups)
+    if function is ConditionFunction.SUM:
+        return np.bincount(codes, weights=numbers, minlength=groups)
+    if function is ConditionFunction.AVG:
+        sums = np.bincount(codes, weights=numbers, minlength=groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    reduce, initial = {
+        ConditionFunction.MIN: (np.minimum, np.inf),
+        ConditionFunction.MAX: (np.maximum, -np.inf),
+    }[function]
+    result = np.full(groups, initial)
+    reduce.at(result, codes, numbers)
+    return np.where(counts > 0, result, np.nan)
+
+
+def aggregate(rule: ThresholdRule, documents: list[dict]) -> dict:
+    """
+    Search-like aggregations of the rule group by and condition metrics over
+    the documents. Documents with several values of a group by field belong
+    to each of their groups, the ones missing a group by field to none.
+    """
+    group_by = list(rule.group_by)
+    rows, keys = [], {}
+    if len(group_by) == 0:
+        # without group by, even an empty sample has the metrics of a search
+        keys[()] = 0
+    for i, doc in enumerate(documents):
+        for key in product(*(get_values(doc, f) for f in group_by)):
+            rows.append((i, keys.setdefault(key, len(keys))))
+    doc_index = np.array([i for i, _ in rows], dtype=np.intp)
+    row_codes = np.array([code for _, code in rows], dtype=np.intp)
+    groups = len(keys)
+
+    metrics = {}
+    for cond in rule.get_conditions():
+        name = cond.get_key()
+        if name in metrics:
+            continue
+        # every document has a single @timestamp, counted by the "ALL" field
+        if cond.field == "@timestamp" and cond.function is ConditionFunction.COUNT:
+            codes, values = row_codes, ["" for _ in rows]
+        else:
+            doc_values = [get_values(doc, cond.field) for doc in documents]
+            codes = np.repeat(row_codes, [len(doc_values[i]) for i in doc_index])
+            values = [v for i in doc_index for v in doc_values[i]]
+        column = _metric_values(cond.function, codes, values, groups)
+        if cond.function in (ConditionFunction.COUNT, ConditionFunction.UNIQ):
+            metrics[name] = column.astype(np.int64).tolist()
+        else:
+            metrics[name] = [None if np.isnan(v) else v for v in column.tolist()]
+
+    counts = np.bincount(row_codes, minlength=groups).tolist()
+    if len(group_by) == 0:
+        return {name: {"value": column[0]} for name, column in metrics.items()}
+
+    buckets = []
+    for key, code in keys.items():
+        bucket = {"key": key[0] if len(key) == 1 else list(key)}
+        bucket["doc_count"] = counts[code]
+        for name, column in metrics.items():
+            bucket[name] = {"value": column[code]}
+        buckets.append(bucket)
+    return {"groupby": {"buckets": buckets}}
+
+
+def evaluate_offline(
+    rule: ThresholdRule, documents: list[dict], end: int | None = None
+) -> tuple[dict, dict, dict]:
+    """
+    Preview of a threshold rule over sample documents, evaluated in-process
+    with the filters compiled to predicates. The timeframe ends at end (epoch
+    ms), or at the latest document of the sample. Returns the aggregations,
+    the preview alerts and stats of the sample.
+    """
+    if not isinstance(rule, ThresholdRule):
+        raise OfflineError("Only threshold rules can be evaluated offline")
+    started = time.perf_counter()
+    predicates = [compile_filter(f) for f in rule.filters]
+
+    timestamps = np.array(
+        [to_epoch_millis(doc.get("@timestamp")) or np.nan for doc in documents],
+        dtype=np.float64,
+    )
+    if end is None:
+        end = int(np.nanmax(timestamps)) if not np.all(np.isnan(timestamps)) else 0
+    start, end = get_time_range(rule.timeframe, end)
+    if not isinstance(start, int):
+        raise OfflineError(f"Unsupported timeframe: {rule.timeframe}")
+    with np.errstate(invalid="ignore"):
+        in_range = np.flatnonzero((timestamps >= start) & (timestamps <= end))
+
+    matched = [
+        documents[i]
+        for i in in_range
+        if all(predicate(documents[i]) for predicate in predicates)
+    ]
+    aggregations = aggregate(rule, matched)
+
+    preview_alerts = {"alert": [], "alarm": []}
+    drive(
+        rule.process(None, aggregations, None, None, None, preview_alerts, True), None
+    )
+    stats = {
+        "documents": len(documents),
+        "in_range": len(in_range),
+        "matched": len(matched),
+        "start": start,
+        "end": end,
+        "took": (time.perf_counter() - started) * 1000,
+    }
+    return aggregations, preview_alerts, stats
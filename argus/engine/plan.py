@@ -0,0 +1,117 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from threading import Lock
+import orjson
+
+from engine.registry import DATASOURCES, RuleRegistry
+from models.rule import EQLRule, Rule
+
+# Attributes that don't change the searches of a rule
+volatile_attrs = ["last_execution", "checkpoint", "created_at", "updated_at"]
+
+
+def get_time_range(timeframe: str, end: int | None = None) -> tuple:
+    """
+    Returns the time range of a timeframe, relative to now or, when an
+    end (epoch ms) is supplied, as absolute timestamps.
+    """
+    from utils.time import get_timeframe_seconds
+
+    if end is None:
+        return (f"now-{timeframe}" if timeframe != "always" else "0", "now")
+    if timeframe == "always":
+        return (0, end)
+
+    seconds = get_timeframe_seconds(timeframe)
+    if seconds is None:
+        # Let elasticsearch date math resolve units like months or years
+        anchor = datetime.fromtimestamp(end / 1000, tz=timezone.utc).isoformat()
+        return (f"{anchor}||-{timeframe}", anchor)
+    return (end - seconds * 1000, end)
+
+
+def rule_signature(rule: Rule) -> str:
+    data = rule.to_mongo().to_dict()
+    for attr in volatile_attrs:
+        data.pop(attr, None)
+    return repr(data)
+
+
+@dataclass(frozen=True)
+class QueryPlan:
+    """
+    Compiled searches of a rule: the resolved indices and a serialized
+    request body, which only gets the time range stamped in on each run.
+    """
+
+    signature: str
+    # version of the datasources collection the indices were resolved at
+    datasources: int
+    index: str
+    template: bytes
+    eql: bool = False
+
+    def stamp(self, start, end) -> dict:
+        body = orjson.loads(self.template)
+        time_range = {"@timestamp": {"gte": start, "lte": end}}
+        if isinstance(start, int) and isinstance(end, int):
+            time_range["@timestamp"]["format"] = "epoch_millis"
+
+        if self.eql:
+            body["filter"] = {"range": time_range}
+        else:
+            body["query"]["bool"]["must"].append({"range": time_range})
+        return body
+
+
+def compile_plan(
+    rule: Rule, datasources: int = 0, signature: str | None = None
+) -> QueryPlan:
+    return QueryPlan(
+        signature=rule_signature(rule) if signature is None else signature,
+        datasources=datasources,
+        index=rule.get_indices(),
+        template=orjson.dumps(rule.build_query_template()),
+        eql=isinstance(rule, EQLRule),
+    )
+
+
+class QueryPlanCache:
+    """
+    Query plans by rule uuid. A plan is compiled again once the rule
+    searches change or the datasources collection version, bumped by every
+    datasource write, changes. The registry swaps its rule documents on
+    each rules version, so a rule signature is only computed the first time
+    a new document is seen.
+    """
+
+    def __init__(self, registry: RuleRegistry):
+        self._registry = registry
+        # rule uuid -> (plan, rule document the plan was last checked against)
+        self._plans: dict[str, tuple[QueryPlan, Rule]] = {}
+        self._lock = Lock()
+
+    def get(self, rule: Rule) -> QueryPlan:
+        key = str(rule.uuid)
+        datasources = self._registry.get_version(DATASOURCES)
+        plan, checked = self._plans.get(key, (None, None))
+        if plan and plan.datasources == datasources:
+            if checked is rule:
+                return plan
+            signature = rule_signature(rule)
+            if plan.signature == signature:
+                with self._lock:
+                    self._plans[key] = (plan, rule)
+                return plan
+        else:
+            signature = None
+
+        plan = compile_plan(rule, datasources, signature)
+        with self._lock:
+            self._plans[key] = (plan, rule)
+        return plan
+
+    def discard(self, rule_uuid: str):
+        with self._lock:
+            self._plans.pop(rule_uuid, None)
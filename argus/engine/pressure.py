@@ -0,0 +1,195 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from threading import Condition
+from typing import Callable
+import time
+
+from elasticsearch.exceptions import ApiError, ConnectionTimeout
+
+REJECTION_TYPES = ("circuit_breaking_exception", "es_rejected_execution_exception")
+REJECTION_STATUS = (429, 503)
+
+
+def is_rejection(error) -> bool:
+    """Whether an error, or a multi search error entry, means the cluster is refusing work"""
+    if isinstance(error, dict) and error.get("status") in REJECTION_STATUS:
+        return True
+    if isinstance(error, ConnectionTimeout):
+        return True
+    if isinstance(error, ApiError) and error.meta.status in REJECTION_STATUS:
+        return True
+    return any(t in str(error) for t in REJECTION_TYPES)
+
+
+class PressureController:
+    """
+    Adapts the number of concurrent engine queries to the health of the
+    cluster (AIMD). The limit is halved on rejections and reduced while the
+    latency average is over target, then grows back one query at a time.
+    While under stress, low risk rules are deferred.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        target_latency: float = 2.0,
+        defer_risk: int = 5,
+        cooldown: float = 5.0,
+        alpha: float = 0.2,
+    ):
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.target_latency = target_latency
+        self.defer_risk = defer_risk
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.limit = float(self.max_limit)
+        self.latency: float | None = None
+        self.in_flight = 0
+        self.queries = 0
+        self.rejections = 0
+        self.deferred = 0
+        self._decreased_at = float("-inf")
+        self._rejected_at = float("-inf")
+        self._cond = Condition()
+        # called when a slot may have become free, for waiters off this thread
+        self._listeners: list[Callable[[], None]] = []
+
+    def acquire(self):
+        """Waits for a free query slot under the current limit"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """Takes a free query slot if there is one, without waiting"""
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._notify()
+
+    def subscribe(self, listener: Callable[[], None]):
+        """Calls listener whenever a slot may have become free"""
+        with self._cond:
+            self._listeners.append(listener)
+
+    def _notify(self):
+        self._cond.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    @contextmanager
+    def slot(self):
+        """Holds a query slot, and observes the query"""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.observe(time.monotonic() - start, e)
+            raise
+        else:
+            self.observe(time.monotonic() - start)
+        finally:
+            self.release()
+
+    def observe(self, latency: float, error=None):
+        now = time.monotonic()
+        with self._cond:
+            self.queries += 1
+            if error is not None and is_rejection(error):
+                self.reject(now)
+                return
+
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+
+            if self.latency > self.target_latency:
+                self._decrease(now, 0.8)
+            elif self.limit < self.max_limit:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+                self._notify()
+
+    def observe_rejection(self):
+        """Records a rejected entry of a multi search"""
+        with self._cond:
+            self.reject(time.monotonic())
+
+    def reject(self, now: float):
+        self.rejections += 1
+        self._rejected_at = now
+        self._decrease(now, 0.5)
+
+    def _decrease(self, now: float, factor: float):
+        if now - self._decreased_at < self.cooldown:
+            return
+        self._decreased_at = now
+        self.limit = max(self.limit * factor, self.min_limit)
+
+    def is_stressed(self) -> bool:
+        recently_rejected = time.monotonic() - self._rejected_at < self.cooldown * 6
+        return recently_rejected or self.limit <= self.max_limit / 2
+
+    def should_defer(self, risk: int) -> bool:
+        """Whether a run of the given risk should be skipped to shed load"""
+        if risk >= self.defer_risk or not self.is_stressed():
+            return False
+        self.deferred += 1
+        return True
+
+    def state(self) -> dict:
+        return {
+            "stressed": self.is_stressed(),
+            "limit": int(self.limit),
+            "max_limit": self.max_limit,
+            "min_limit": self.min_limit,
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "target_latency": self.target_latency,
+            "queries": self.queries,
+            "rejections": self.rejections,
+            "deferred": self.deferred,
+            "defer_risk": self.defer_risk,
+        }
+
+
+class ThrottledClient:
+    """
+    Elastic client wrapper holding a cluster query slot for each search sent
+    through it. The engine searches go through it, while the interactive
+    searches of the API use the client directly and never wait for a slot.
+    """
+
+    def __init__(self, elastic):
+        self._es = elastic
+        self.pressure: PressureController = elastic.pressure
+
+    def __getattr__(self, name: str):
+        return getattr(self._es, name)
+
+    def search(self, *args, **kwargs):
+        with self.pressure.slot():
+            return self._es.search(*args, **kwargs)
+
+    def msearch(self, searches: list) -> list[dict]:
+        with self.pressure.slot():
+            return self._es.msearch(searches)
+
+    def eql_search(self, *args, raise_errors: bool = False, **kwargs):
+        try:
+            with self.pressure.slot():
+                return self._es.eql_search(*args, raise_errors=True, **kwargs)
+        except Exception:
+            if raise_errors:
+                raise
+            return
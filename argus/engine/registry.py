@@ -0,0 +1,116 @@
+from __future__ import annotations
+from threading import Lock
+import time
+
+from engine.dag import build_graph
+from models.baseline import BaselineAnalytic
+from models.engine import CollectionVersion
+from models.rule import Rule, RuleTriggerType
+
+RULES = "rule"
+ANALYTICS = "baseline_analytic"
+DATASOURCES = "datasource"
+
+
+class RuleRegistry:
+    """
+    In-process copy of the rules and analytics run by the engine.
+    Executions read from memory; the registry only goes back to the
+    database when the version counter of a collection changes, which
+    every API write bumps.
+    """
+
+    def __init__(self, refresh_interval: int = 5):
+        self._refresh_interval = refresh_interval
+        self._rules: dict[str, Rule] = {}
+        self._analytics: dict[str, BaselineAnalytic] = {}
+        self._graph = build_graph([])
+        self._versions: dict[str, int] = {}
+        # execution state of the rules, kept off the shared rule documents
+        self._checkpoints: dict[str, int] = {}
+        self._checked_at = None
+        self._loaded = False
+        self._lock = Lock()
+
+    def bump(self, collection: str) -> None:
+        """Records a write to a collection, for this and other processes"""
+        CollectionVersion.bump(collection)
+        self._checked_at = None
+
+    def _changed(self, versions: dict[str, int], collection: str) -> bool:
+        if not self._loaded:
+            return True
+        return versions.get(collection) != self._versions.get(collection)
+
+    def refresh(self) -> None:
+        now = time.monotonic()
+        if self._checked_at and now - self._checked_at < self._refresh_interval:
+            return
+
+        with self._lock:
+            self._checked_at = now
+            versions = CollectionVersion.get_versions()
+
+            if self._changed(versions, RULES):
+                self._rules = {str(r.uuid): r for r in Rule.objects.all()}
+                self._graph = build_graph(self._rules.values())
+            if self._changed(versions, ANALYTICS):
+                self._analytics = {a.code: a for a in BaselineAnalytic.get_all()}
+            self._versions = versions
+            self._loaded = True
+
+    def get_version(self, collection: str) -> int:
+        """Last seen version of a collection"""
+        self.refresh()
+        return self._versions.get(collection, 0)
+
+    def get_rule(self, rule_uuid: str) -> Rule | None:
+        self.refresh()
+        return self._rules.get(rule_uuid)
+
+    def get_checkpoint(self, rule: Rule) -> int | None:
+        """
+        End (epoch ms) of the range searched by the last run of a rule, by
+        this process or, as stored in the database, by any other one
+        """
+        checkpoint = self._checkpoints.get(str(rule.uuid))
+        if checkpoint is None or (rule.checkpoint or 0) > checkpoint:
+            return rule.checkpoint
+        return checkpoint
+
+    def set_checkpoint(self, rule_uuid: str, checkpoint: int) -> None:
+        with self._lock:
+            current = self._checkpoints.get(rule_uuid, checkpoint)
+            self._checkpoints[rule_uuid] = max(current, checkpoint)
+
+    def get_rules(self) -> list[Rule]:
+        self.refresh()
+        return list(self._rules.values())
+
+    def get_periodic_rules(self) -> list[Rule]:
+        return [
+            r
+            for r in self.get_rules()
+            if r.active and r.trigger.type is RuleTriggerType.PERIODIC
+        ]
+
+    def get_graph(self):
+        """Dependency graph of the rules triggered by other rules"""
+        self.refresh()
+        return self._graph
+
+    def get_dependents(self, rule_uuid: str) -> list[Rule]:
+        """Rules triggered by the execution of the given rule"""
+        graph = self.get_graph()
+        if rule_uuid not in graph:
+            return []
+        rules = [self._rules.get(uuid) for uuid in graph.successors(rule_uuid)]
+        return [r for r in rules if r]
+
+    def get_analytic(self, code: str) -> BaselineAnalytic | None:
+        self.refresh()
+        return self._analytics.get(code)
+
+    def get_analytics(self) -> list[BaselineAnalytic]:
+        self.refresh()
+        return list(self._analytics.values())
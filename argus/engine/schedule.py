@@ -0,0 +1,39 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+import hashlib
+import numpy as np
+
+
+def phase_offset(key: str, interval: int) -> float:
+    """
+    Stable offset, in seconds, of a job within its interval. Derived from a
+    hash of the job id so that jobs sharing an interval spread evenly over it.
+    """
+    if interval <= 0:
+        return 0
+    digest = int(hashlib.sha1(key.encode()).hexdigest()[:12], 16)
+    return (digest % (interval * 1000)) / 1000
+
+
+def phase_start(key: str, interval: int) -> datetime:
+    """Start date aligning an interval job to its phase, on the epoch clock"""
+    return datetime.fromtimestamp(phase_offset(key, interval), tz=timezone.utc)
+
+
+def next_run(key: str, interval: int, now: float) -> float:
+    """Next timestamp after now at which a job with the given interval is due"""
+    phase = phase_offset(key, interval)
+    return now + interval - ((now - phase) % interval)
+
+
+def project_load(jobs: list[tuple[str, int]], start: int, window: int) -> np.ndarray:
+    """Number of jobs started in each second of the window, from start"""
+    load = np.zeros(window, dtype=np.int64)
+    for key, interval in jobs:
+        if interval <= 0:
+            continue
+        first = next_run(key, interval, start - 1e-9) - start
+        load += np.bincount(
+            np.arange(first, window, interval).astype(np.int64), minlength=window
+        )[:window]
+    return load
@@ -0,0 +1,69 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Generator
+
+
+class SearchError(Exception):
+    """Raised inside a rule execution when its search request failed"""
+
+    def __init__(self, error: Any, status: int | None = None):
+        super().__init__(error)
+        self.error = error
+        self.status = status
+
+
+@dataclass
+class SearchRequest:
+    """A single search a rule execution needs answered to make progress"""
+
+    index: list[str] | str
+    body: dict = field(default_factory=dict)
+    eql: bool = False
+
+
+# Executions yield either a request, answered with its response, or a list of
+# (non EQL) requests, answered with a list of responses or SearchErrors
+RuleExecution = Generator[SearchRequest | list[SearchRequest], Any, Any]
+
+
+def search(elastic, request: SearchRequest):
+    if request.eql:
+        return elastic.eql_search(index=request.index, **request.body)
+    return elastic.search(index=request.index, body=request.body)
+
+
+def multi_search(elastic, requests: list[SearchRequest]) -> list:
+    """Answers several requests with a single _msearch round trip"""
+    try:
+        responses = elastic.msearch([(r.index, r.body) for r in requests])
+    except Exception as e:
+        return [e] * len(requests)
+
+    result = []
+    for response in responses:
+        if "error" in response:
+            result.append(SearchError(response["error"], response.get("status")))
+        else:
+            result.append(response)
+    return result
+
+
+def drive(execution: RuleExecution, elastic):
+    """
+    Runs a rule execution to completion, answering each of its search
+    requests one at a time. Returns the execution result.
+    """
+    try:
+        request = next(execution)
+        while True:
+            if isinstance(request, list):
+                request = execution.send(multi_search(elastic, request))
+                continue
+            try:
+                response = search(elastic, request)
+            except Exception as e:
+                request = execution.throw(e)
+                continue
+            request = execution.send(response)
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,73 @@
+from __future__ import annotations
+import orjson
+
+from engine.search import SearchError, SearchRequest
+
+NAMESPACE = "shared{}__"
+
+
+def scan_key(request: SearchRequest) -> bytes | None:
+    """
+    Key of the documents scanned by an aggregation only search: its indices
+    and everything but its aggregations. None for searches that can't share.
+    """
+    body = request.body
+    if request.eql or body.get("size") != 0 or not body.get("aggs"):
+        return None
+    scan = {k: v for k, v in body.items() if k != "aggs"}
+    return orjson.dumps((request.index, scan), option=orjson.OPT_SORT_KEYS)
+
+
+def merge_requests(
+    requests: list[SearchRequest],
+) -> tuple[list[SearchRequest], list[tuple[int, int | None]]]:
+    """
+    Merges the searches scanning the same documents into one, with the
+    aggregations of each under its own namespace. Returns the searches to
+    send and, for each request, the search answering it and its namespace.
+    """
+    merged: list[SearchRequest] = []
+    members: list[list[int]] = []
+    by_key: dict[bytes, int] = {}
+    routes = []
+    for i, request in enumerate(requests):
+        key = scan_key(request)
+        if key is None or key not in by_key:
+            if key is not None:
+                by_key[key] = len(merged)
+            merged.append(request)
+            members.append([i])
+        else:
+            members[by_key[key]].append(i)
+
+    searches = []
+    for position, (request, indices) in enumerate(zip(merged, members)):
+        if len(indices) == 1:
+            routes.append((indices[0], position, None))
+            searches.append(request)
+            continue
+
+        body = {k: v for k, v in request.body.items() if k != "aggs"}
+        body["aggs"] = {}
+        for namespace, i in enumerate(indices):
+            for name, agg in requests[i].body["aggs"].items():
+                body["aggs"][NAMESPACE.format(namespace) + name] = agg
+            routes.append((i, position, namespace))
+        searches.append(SearchRequest(index=request.index, body=body))
+
+    routes.sort()
+    return searches, [(position, namespace) for _, position, namespace in routes]
+
+
+def split_response(response, namespace: int | None):
+    """Response of one of the searches merged into a shared one"""
+    if namespace is None or isinstance(response, (Exception, SearchError)):
+        return response
+    response = getattr(response, "body", response)
+    prefix = NAMESPACE.format(namespace)
+    aggregations = {
+        name[len(prefix) :]: agg
+        for name, agg in response.get("aggregations", {}).items()
+        if name.startswith(prefix)
+    }
+    return {**response, "aggregations": aggregations}
@@ -0,0 +1,187 @@
+from __future__ import annotations
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+import atexit
+import time
+
+from mongoengine import Document
+
+from engine.suppress import SuppressionUpdate
+from models.alert import Alert
+from models.engine import SuppressionEntry
+
+
+class AlertSink:
+    """
+    Queues alerts, and the suppression updates of repeated ones, in memory and
+    writes them to the database in batches from a background thread, so rule
+    and analytic executions don't wait on storage.
+    When the queue is full an emit waits up to queue_timeout seconds for the
+    writer to make room, counted as backpressure. Alerts still not queued by
+    then are dropped and counted, so a slow database delays executions by a
+    bounded time instead of stalling them on synchronous writes.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        flush_seconds: float,
+        queue_size: int,
+        queue_timeout: float,
+    ):
+        self.batch_size = max(batch_size, 1)
+        self.flush_seconds = flush_seconds
+        self.queue_timeout = queue_timeout
+        self._queue: Queue = Queue(maxsize=queue_size)
+        self._lock = Lock()
+        self._thread: Thread | None = None
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+        self.backpressure = 0
+        self.dropped = 0
+        atexit.register(self.close)
+
+    def _start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._run, name="alert-sink", daemon=True)
+            self._thread.start()
+
+    def emit(self, alert: Document | SuppressionUpdate) -> bool:
+        """
+        Queues an alert, returns False if it was written synchronously after
+        the sink closed or dropped because the queue stayed full
+        """
+        if self._closed:
+            self.write([alert])
+            return False
+
+        self._start()
+        try:
+            self._queue.put_nowait(alert)
+            return True
+        except Full:
+            self.backpressure += 1
+        try:
+            self._queue.put(alert, timeout=self.queue_timeout)
+            return True
+        except Full:
+            self.dropped += 1
+            print("[AlertSink] Queue full, dropping alert")
+            return False
+
+    def _run(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    alert = self._queue.get(timeout=timeout)
+                except Empty:
+                    break
+                if alert is None:
+                    self.write(batch)
+                    return
+                batch.append(alert)
+            self.write(batch)
+
+    def write(self, batch: list[Document | SuppressionUpdate]):
+        """
+        Inserts a batch of alerts, one insert_many per alert class, then
+        applies the suppression updates
+        """
+        by_class: dict[type, list[Document]] = {}
+        updates: dict[tuple[str, str, str], SuppressionUpdate] = {}
+        for alert in batch:
+            if isinstance(alert, SuppressionUpdate):
+                self.merge_update(updates, alert)
+                continue
+            try:
+                alert.validate()
+            except Exception as e:
+                self.failed += 1
+                print(f"[AlertSink] Dropping invalid alert: {e}")
+                continue
+            by_class.setdefault(type(alert), []).append(alert)
+
+        for cls, alerts in by_class.items():
+            try:
+                cls.objects.insert(alerts, load_bulk=False)
+                self.written += len(alerts)
+            except Exception as e:
+                print(f"[AlertSink] Batch insert failed, saving one by one: {e}")
+                for alert in alerts:
+                    try:
+                        alert.save()
+                        self.written += 1
+                    except Exception:
+                        self.failed += 1
+
+        for update in updates.values():
+            try:
+                self.apply_update(update)
+            except Exception as e:
+                print(f"[AlertSink] Suppression update failed: {e}")
+
+    def merge_update(self, updates: dict, update: SuppressionUpdate):
+        """Folds the repeats of an alert in a batch into a single update"""
+        key = (update.rule, update.key, update.alert)
+        current = updates.get(key)
+        if not current:
+            updates[key] = update
+            return
+        current.repeats += update.repeats
+        current.last_seen = max(current.last_seen, update.last_seen)
+
+    def apply_update(self, update: SuppressionUpdate):
+        entry = SuppressionEntry.objects(rule=update.rule, key=update.key)
+        if update.new:
+            # a new alert restarts the entry
+            entry.update_one(
+                upsert=True,
+                set__alert=update.alert,
+                set__hits=1 + update.repeats,
+                set__last_seen=update.last_seen,
+                set__expires_at=update.expires_at,
+            )
+        else:
+            entry.update_one(inc__hits=update.repeats, set__last_seen=update.last_seen)
+
+        if update.repeats == 0:
+            return
+        Alert.objects(uuid=update.alert).update_one(
+            inc__hits=update.repeats, set__last_seen=update.last_seen
+        )
+
+    def close(self):
+        """Stops the writer thread after flushing the queued alerts"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        # alerts queued after the writer stopped
+        remaining = []
+        while True:
+            try:
+                alert = self._queue.get_nowait()
+            except Empty:
+                break
+            if alert is not None:
+                remaining.append(alert)
+        self.write(remaining)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "backpressure": self.backpressure,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,477 @@
+from __future__ import annotations
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import product
+from threading import Lock
+import re
+import time
+import traceback
+
+from engine.plan import rule_signature
+from engine.schedule import next_run
+from engine.search import drive
+from models.rule import (
+    ConditionFunction,
+    ConditionOperator,
+    FilterType,
+    ThresholdRule,
+)
+from utils.time import get_timeframe_seconds
+
+# query_string syntax that exact value matching can't reproduce
+QUERY_SYNTAX = re.compile(r"[*?~\"()\[\]{}:\\/<>=^!+&|\s]")
+# mapped types whose query_string matches are the exact source values, floating
+# point numbers match other spellings of the same value
+EXACT_TYPES = frozenset(
+    ["keyword", "constant_keyword", "boolean", "long", "integer", "short", "byte"]
+)
+# how long a tail read keeps its point in time open between pages
+PIT_KEEP_ALIVE = "1m"
+
+
+def is_streamable(rule, field_types: dict[str, set[str]]) -> bool:
+    """
+    Whether a rule can be evaluated from the stream: a periodic threshold rule
+    over a relative timeframe, with only exact filters on fields mapped to
+    exact types (field_types, by field name) and count conditions
+    """
+    if not isinstance(rule, ThresholdRule):
+        return False
+    if rule.trigger.get_sleep_time() <= 0:
+        return False
+    if get_timeframe_seconds(rule.timeframe) is None:
+        return False
+    for f in rule.filters:
+        if f.type is not FilterType.SIMPLE:
+            return False
+        if f.operator not in (ConditionOperator.EQ, ConditionOperator.NE):
+            return False
+        # text fields are analyzed and field name patterns search several fields
+        if not f.field or QUERY_SYNTAX.search(f.field):
+            return False
+        types = field_types.get(f.field)
+        if not types or not types <= EXACT_TYPES:
+            return False
+        values = [v.strip() for v in f.value.split(",")]
+        if any(not v or v[0] == "-" or QUERY_SYNTAX.search(v) for v in values):
+            return False
+    return all(c.function is ConditionFunction.COUNT for c in rule.get_conditions())
+
+
+def get_values(doc: dict, field: str) -> list[str]:
+    """Values of a (dotted) field of a document, as strings"""
+    if field in doc:
+        value = doc[field]
+    else:
+        head, _, rest = field.partition(".")
+        node = doc.get(head)
+        if not rest or node is None:
+            return []
+        nodes = node if isinstance(node, list) else [node]
+        return [v for n in nodes if isinstance(n, dict) for v in get_values(n, rest)]
+
+    values = value if isinstance(value, list) else [value]
+    return [
+        str(v).lower() if isinstance(v, bool) else str(v)
+        for v in values
+        if v is not None and not isinstance(v, (dict, list))
+    ]
+
+
+@dataclass
+class StreamRule:
+    """Compiled predicates and windowed counters of a streamed rule"""
+
+    rule: ThresholdRule
+    signature: str
+    index: str
+    group_by: list[str]
+    equals: list[tuple[str, frozenset]]
+    excludes: list[tuple[str, frozenset]]
+    # condition metric name -> counted field, None counts every document
+    counts: dict[str, str | None]
+    bucket_size: int
+    window: int
+    evidence_size: int
+    next_time: float
+    # bucket start (epoch ms) -> group key -> metric name -> count
+    buckets: dict[int, dict] = field(default_factory=dict)
+    evidence: dict[tuple, deque] = field(default_factory=dict)
+    # tail position up to which the rule still has to read its history
+    backfill: int | None = None
+
+    @classmethod
+    def compile(cls, rule: ThresholdRule) -> StreamRule:
+        interval = rule.trigger.get_sleep_time()
+        equals, excludes = [], []
+        for f in rule.filters:
+            values = frozenset(v.strip() for v in f.value.split(","))
+            if f.operator is ConditionOperator.EQ:
+                equals.append((f.field, values))
+            else:
+                excludes.append((f.field, values))
+
+        counts = {}
+        for cond in rule.get_conditions():
+            counts[cond.get_key()] = None if cond.field == "@timestamp" else cond.field
+        return cls(
+            rule=rule,
+            signature=rule_signature(rule),
+            index=rule.get_indices(),
+            group_by=list(rule.group_by),
+            equals=equals,
+            excludes=excludes,
+            counts=counts,
+            bucket_size=interval * 1000,
+            window=get_timeframe_seconds(rule.timeframe) * 1000,
+            evidence_size=rule.get_evidence_size(),
+            next_time=next_run(str(rule.uuid), interval, time.time()),
+        )
+
+    def matches(self, doc: dict) -> bool:
+        for field_name, values in self.equals:
+            if not any(v in values for v in get_values(doc, field_name)):
+                return False
+        for field_name, values in self.excludes:
+            if any(v in values for v in get_values(doc, field_name)):
+                return False
+        return True
+
+    def add(self, doc: dict, timestamp: int):
+        """Counts a matching document in the groups it belongs to"""
+        groups = [get_values(doc, f) for f in self.group_by]
+        metrics = {
+            name: 1 if f is None else int(bool(get_values(doc, f)))
+            for name, f in self.counts.items()
+        }
+        bucket = self.buckets.setdefault(timestamp - timestamp % self.bucket_size, {})
+        # documents without a group by field aren't in any group, as with terms
+        for key in product(*groups):
+            bucket.setdefault(key, Counter()).update(metrics)
+            if self.evidence_size > 0:
+                if key not in self.evidence:
+                    self.evidence[key] = deque(maxlen=self.evidence_size)
+                self.evidence[key].append(doc)
+
+    def window_start(self, now: int) -> int:
+        """Start of the first bucket within the rule timeframe"""
+        start = now - self.window
+        return start - start % self.bucket_size
+
+    def aggregations(self, now: int) -> dict:
+        """Search-like aggregations of the counts within the rule timeframe"""
+        start = self.window_start(now)
+        for key in [k for k in self.buckets.keys() if k < start]:
+            del self.buckets[key]
+
+        totals: dict[tuple, Counter] = {}
+        for groups in self.buckets.values():
+            for key, metrics in groups.items():
+                totals.setdefault(key, Counter()).update(metrics)
+        for key in [k for k in self.evidence.keys() if k not in totals]:
+            del self.evidence[key]
+
+        def metric_values(metrics: Counter) -> dict:
+            return {name: {"value": metrics.get(name, 0)} for name in self.counts}
+
+        if len(self.group_by) == 0:
+            return metric_values(totals.get((), Counter()))
+
+        buckets = []
+        for key, metrics in totals.items():
+            bucket_key = key[0] if len(key) == 1 else list(key)
+            buckets.append({"key": bucket_key, **metric_values(metrics)})
+        return {"groupby": {"buckets": buckets}}
+
+
+@dataclass
+class Tail:
+    """Read position of a datasource, the time (epoch ms) it was fully read up to"""
+
+    index: str
+    position: int
+    documents: int = 0
+    # whether the last poll stopped before the end of the new documents
+    lagging: bool = False
+
+
+class PredicateIndex:
+    """
+    Streamed rules of a datasource by the values of one of their equality
+    filters, so a document is only checked against the rules it can match.
+    Rules without equality filters are checked against every document.
+    """
+
+    def __init__(self, rules: list[StreamRule]):
+        self._values: dict[str, dict[str, list[StreamRule]]] = {}
+        self._always: list[StreamRule] = []
+        for rule in rules:
+            if not rule.equals:
+                self._always.append(rule)
+                continue
+            field_name, values = rule.equals[0]
+            by_value = self._values.setdefault(field_name, {})
+            for value in values:
+                by_value.setdefault(value, []).append(rule)
+
+    def lookup(self, doc: dict) -> list[StreamRule]:
+        candidates = {id(r): r for r in self._always}
+        for field_name, by_value in self._values.items():
+            for value in get_values(doc, field_name):
+                for rule in by_value.get(value, ()):
+                    candidates[id(rule)] = rule
+        return [rule for rule in candidates.values() if rule.matches(doc)]
+
+
+class StreamEngine:
+    """
+    Evaluates simple filter rules from a single read of each datasource. New
+    documents are tailed from a point in time sorted on @timestamp and
+    _shard_doc, matched through a predicate index and counted into per rule,
+    per group time buckets; due rules are evaluated from the counters up to
+    the read position, without searches.
+    Documents indexed later than the lag, behind the read position, are missed.
+    """
+
+    def __init__(self, elastic, page_size: int, max_pages: int, lag: int):
+        self._es = elastic
+        self.page_size = page_size
+        self.max_pages = max(max_pages, 1)
+        self.lag = lag * 1000
+        self._rules: dict[str, StreamRule] = {}
+        self._tails: dict[str, Tail] = {}
+        self._indices: dict[str, PredicateIndex] = {}
+        self._lock = Lock()
+
+    def _rebuild(self):
+        by_index: dict[str, list[StreamRule]] = {}
+        for rule in self._rules.values():
+            by_index.setdefault(rule.index, []).append(rule)
+
+        now = int(time.time() * 1000)
+        for index, rules in by_index.items():
+            # warm the counters up with the longest timeframe
+            start = min(r.window_start(now) for r in rules)
+            if index not in self._tails:
+                self._tails[index] = Tail(index=index, position=start - 1)
+            elif not self._tails[index].documents:
+                tail = self._tails[index]
+                tail.position = min(tail.position, start - 1)
+        for index in [i for i in self._tails.keys() if i not in by_index]:
+            del self._tails[index]
+        self._indices = {i: PredicateIndex(rules) for i, rules in by_index.items()}
+
+    def _field_types(self, rule) -> dict[str, set[str]]:
+        """Mapped types of the filtered fields of a rule, in its datasource"""
+        if not isinstance(rule, ThresholdRule):
+            return {}
+        fields = [f.field for f in rule.filters if f.type is FilterType.SIMPLE]
+        if not fields:
+            return {}
+        try:
+            return self._es.get_field_types(rule.get_indices(), fields)
+        except Exception:
+            traceback.print_exc()
+            return {}
+
+    def add(self, rule) -> bool:
+        """Streams a rule, returns False if it isn't streamable"""
+        with self._lock:
+            current = self._rules.get(str(rule.uuid))
+        if current and current.signature == rule_signature(rule):
+            # the mapping was checked when the rule was added
+            current.rule = rule
+            return True
+        if not is_streamable(rule, self._field_types(rule)):
+            return False
+        compiled = StreamRule.compile(rule)
+        with self._lock:
+            tail = self._tails.get(compiled.index)
+            if tail and tail.documents:
+                # the tail is past the rule timeframe, its history is read apart
+                compiled.backfill = tail.position
+            self._rules[str(rule.uuid)] = compiled
+            self._rebuild()
+        return True
+
+    def discard(self, rule_uuid: str):
+        with self._lock:
+            if self._rules.pop(rule_uuid, None):
+                self._rebuild()
+
+    def refresh(self, registry) -> list[ThresholdRule]:
+        """
+        Follows changes of the streamed rules, returns the ones that changed
+        and can't be streamed anymore
+        """
+        removed = []
+        for rule_uuid in list(self._rules.keys()):
+            rule = registry.get_rule(rule_uuid)
+            if not rule or not rule.active:
+                self.discard(rule_uuid)
+            elif not self.add(rule):
+                self.discard(rule_uuid)
+                removed.append(rule)
+        return removed
+
+    def _read(self, index: str, after: int, end: int, pages) -> tuple[list, bool]:
+        """
+        Timestamps and sources of the documents after a time and up to end
+        (epoch ms), in order, and whether all of them were read
+        """
+        pit = self._es.open_point_in_time(index, PIT_KEEP_ALIVE)
+        documents, cursor, complete = [], None, False
+        try:
+            while pages is None or pages > 0:
+                body = {
+                    "size": self.page_size,
+                    "pit": {"id": pit, "keep_alive": PIT_KEEP_ALIVE},
+                    "sort": [
+                        {"@timestamp": {"order": "asc", "format": "epoch_millis"}},
+                        # unique within the point in time, documents of the same
+                        # millisecond aren't skipped between pages
+                        {"_shard_doc": "asc"},
+                    ],
+                    "query": {
+                        "range": {
+                            "@timestamp": {
+                                "gt": after,
+                                "lte": end,
+                                "format": "epoch_millis",
+                            }
+                        }
+                    },
+                }
+                if cursor:
+                    body["search_after"] = cursor
+
+                response = self._es.search(body=body)
+                pit = response.get("pit_id", pit)
+                hits = response["hits"]["hits"]
+                documents.extend(
+                    (int(float(hit["sort"][0])), hit["_source"]) for hit in hits
+                )
+                if len(hits) < self.page_size:
+                    complete = True
+                    break
+                cursor = hits[-1]["sort"]
+                if pages is not None:
+                    pages -= 1
+        finally:
+            self._es.close_point_in_time(pit)
+        return documents, complete
+
+    def _backfill(self, now: int):
+        """Reads the history of the rules added to a tail that was already running"""
+        with self._lock:
+            pending = [r for r in self._rules.values() if r.backfill is not None]
+        for rule in pending:
+            try:
+                documents, _ = self._read(
+                    rule.index, rule.window_start(now) - 1, rule.backfill, None
+                )
+            except Exception:
+                traceback.print_exc()
+                continue
+            with self._lock:
+                if self._rules.get(str(rule.rule.uuid)) is not rule:
+                    continue
+                for timestamp, doc in documents:
+                    if rule.matches(doc):
+                        rule.add(doc, timestamp)
+                rule.backfill = None
+
+    def poll(self) -> int:
+        """Reads the new documents of every streamed datasource, once"""
+        now = int(time.time() * 1000)
+        self._backfill(now)
+        with self._lock:
+            tails = list(self._tails.values())
+        read = 0
+        for tail in tails:
+            end = now - self.lag
+            try:
+                documents, complete = self._read(
+                    tail.index, tail.position, end, self.max_pages
+                )
+            except Exception:
+                traceback.print_exc()
+                continue
+            if not complete:
+                # the last millisecond may go on past the pages read, the next
+                # poll reads it again unless the pages held nothing else
+                end = documents[-1][0] - 1
+                split = [d for d in documents if d[0] <= end]
+                if split:
+                    documents = split
+                else:
+                    end = documents[-1][0]
+            with self._lock:
+                index = self._indices.get(tail.index)
+                if not index or self._tails.get(tail.index) is not tail:
+                    continue
+                for timestamp, doc in documents:
+                    for rule in index.lookup(doc):
+                        rule.add(doc, timestamp)
+                tail.position = end
+                tail.lagging = not complete
+                tail.documents += len(documents)
+            read += len(documents)
+        return read
+
+    def due(self, now: float) -> list[StreamRule]:
+        """Streamed rules whose interval elapsed, moved to their next run"""
+        due = []
+        with self._lock:
+            for rule in self._rules.values():
+                if rule.next_time > now:
+                    continue
+                rule.next_time = next_run(
+                    str(rule.rule.uuid), rule.bucket_size // 1000, now
+                )
+                due.append(rule)
+        return due
+
+    def evaluate(self, scheduler, stream_rule: StreamRule):
+        """Raises the alerts of a streamed rule from its counters"""
+        rule = stream_rule.rule
+        with self._lock:
+            tail = self._tails.get(stream_rule.index)
+            if tail is None or stream_rule.backfill is not None:
+                print(f"{datetime.now()} | Streamed rule history not read: {rule.name}")
+                return
+            if tail.lagging:
+                print(
+                    f"{datetime.now()} | Streamed rule datasource lagging: {rule.name}"
+                )
+            # the rule timeframe ends where its datasource was read up to
+            aggregations = stream_rule.aggregations(tail.position)
+            hits = {key: list(docs) for key, docs in stream_rule.evidence.items()}
+
+        preview_alerts = {"alert": [], "alarm": []}
+        drive(
+            rule.process(
+                scheduler, aggregations, hits, None, None, preview_alerts, False
+            ),
+            None,
+        )
+        rule.finish(scheduler, False, aggregations, preview_alerts)
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "rules": len(self._rules),
+                "datasources": [
+                    {
+                        "index": tail.index,
+                        "rules": sum(
+                            1 for r in self._rules.values() if r.index == tail.index
+                        ),
+                        "documents": tail.documents,
+                        "position": datetime.utcfromtimestamp(tail.position / 1000),
+                        "lagging": tail.lagging,
+                    }
+                    for tail in self._tails.values()
+                ],
+            }
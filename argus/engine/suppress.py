@@ -0,0 +1,107 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from threading import Lock
+import hashlib
+import orjson
+
+from models.engine import SuppressionEntry
+
+
+def fingerprint(*parts) -> str:
+    """Compact identity of an alert within its rule"""
+    return hashlib.sha1(orjson.dumps(parts)).hexdigest()
+
+
+@dataclass
+class SuppressionUpdate:
+    """Pending write of a suppression entry, and of the hits of its alert"""
+
+    rule: str
+    key: str
+    alert: str
+    repeats: int
+    last_seen: datetime
+    expires_at: datetime
+    # the update starts the window of a new alert
+    new: bool = False
+
+
+@dataclass
+class _Entry:
+    alert: str
+    hits: int
+    expires_at: datetime
+
+
+class SuppressionCache:
+    """
+    Remembers the alerts raised by each rule and key for a time window, so
+    repeats of a still open alert only increase its hit count.
+    Entries live in memory and are persisted through the alert sink.
+    """
+
+    def __init__(self, window: int):
+        self.window = timedelta(seconds=window)
+        self._entries: dict[tuple[str, str], _Entry] = {}
+        self._lock = Lock()
+        self._loaded = False
+        self._next_prune = datetime.utcnow()
+
+    def _load(self):
+        """Merges the persisted entries, keeping the newest window of each key"""
+        now = datetime.utcnow()
+        for entry in SuppressionEntry.objects(expires_at__gt=now):
+            current = self._entries.get((entry.rule, entry.key))
+            if current and current.expires_at >= entry.expires_at:
+                continue
+            self._entries[(entry.rule, entry.key)] = _Entry(
+                alert=entry.alert, hits=entry.hits, expires_at=entry.expires_at
+            )
+        self._loaded = True
+
+    def _prune(self, now: datetime):
+        if now < self._next_prune:
+            return
+        for key in [k for k, e in self._entries.items() if e.expires_at <= now]:
+            del self._entries[key]
+        self._next_prune = now + self.window
+
+    def hit(self, rule: str, key: str) -> SuppressionUpdate | None:
+        """Counts a repeat, returns None when no alert is being suppressed"""
+        now = datetime.utcnow()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._entries.get((rule, key))
+            if not entry or entry.expires_at <= now:
+                return None
+            entry.hits += 1
+            return SuppressionUpdate(rule, key, entry.alert, 1, now, entry.expires_at)
+
+    def record(self, rule: str, key: str, alert: str) -> SuppressionUpdate:
+        """Starts the suppression window of a new alert"""
+        now = datetime.utcnow()
+        expires_at = now + self.window
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._prune(now)
+            self._entries[(rule, key)] = _Entry(
+                alert=alert, hits=1, expires_at=expires_at
+            )
+        return SuppressionUpdate(rule, key, alert, 0, now, expires_at, new=True)
+
+    def discard(self, rule: str):
+        """Forgets the alerts of a rule, so its next matches raise new ones"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == rule]:
+                del self._entries[key]
+        SuppressionEntry.objects(rule=rule).delete()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "suppressed": sum(e.hits - 1 for e in self._entries.values()),
+            }
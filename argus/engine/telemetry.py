@@ -0,0 +1,222 @@
+from __future__ import annotations
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+import atexit
+import time
+import traceback
+
+from engine.search import RuleExecution
+from models.engine import RulePerformance
+from utils import to_dict
+
+# Run attributes summed by the hourly rollups
+ROLLUP_FIELDS = (
+    "duration",
+    "build",
+    "search",
+    "process",
+    "took",
+    "searches",
+    "hits",
+    "buckets",
+    "alerts",
+)
+
+
+def count_buckets(node) -> int:
+    """Number of buckets of all the (nested) aggregations of a response"""
+    if isinstance(node, list):
+        return sum(count_buckets(n) for n in node)
+    if not isinstance(node, dict):
+        return 0
+    count = len(node["buckets"]) if isinstance(node.get("buckets"), list) else 0
+    return count + sum(count_buckets(v) for v in node.values())
+
+
+@dataclass
+class RunStats:
+    """
+    Timings, in seconds, and counters of a single rule or analytic run. Search
+    is the time spent waiting on elasticsearch, of which took (ms) is spent
+    executing the searches; process is everything after the first search.
+    """
+
+    kind: str
+    key: str
+    started: float
+    duration: float = 0
+    build: float = 0
+    search: float = 0
+    process: float = 0
+    took: int = 0
+    searches: int = 0
+    hits: int = 0
+    buckets: int = 0
+    alerts: int = 0
+    error: str | None = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, name, getattr(self, name) + time.perf_counter() - start)
+
+    def observe(self, response):
+        """Counts a search response, or the list of responses of a multi search"""
+        responses = response if isinstance(response, list) else [response]
+        for r in responses:
+            self.searches += 1
+            r = getattr(r, "body", r)
+            if not isinstance(r, dict):
+                continue
+            self.took += r.get("took", 0)
+            total = r.get("hits", {}).get("total", {})
+            self.hits += total.get("value", 0) if isinstance(total, dict) else total
+            self.buckets += count_buckets(r.get("aggregations"))
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["started"] = datetime.fromtimestamp(self.started, tz=timezone.utc)
+        data["network"] = max(self.search - self.took / 1000, 0)
+        return data
+
+
+class Telemetry:
+    """
+    Records the runs of rules and analytics. The latest runs of each are
+    kept in a bounded ring buffer, and all of them are summed into hourly
+    RulePerformance rollups, written on each flush.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._runs: dict[str, deque[RunStats]] = {}
+        self._rollups: dict[tuple, dict] = {}
+        self._alerts: Counter = Counter()
+        self._lock = Lock()
+        atexit.register(self.flush)
+
+    def alert(self, key: str):
+        """Counts an alert emitted by the running rule"""
+        with self._lock:
+            self._alerts[key] += 1
+
+    def record(self, run: RunStats):
+        hour = int(run.started // 3600 * 3600)
+        with self._lock:
+            run.alerts += self._alerts.pop(run.key, 0)
+            if run.key not in self._runs:
+                self._runs[run.key] = deque(maxlen=self.size)
+            self._runs[run.key].append(run)
+
+            rollup = self._rollups.setdefault(
+                (run.kind, run.key, hour),
+                {"runs": 0, "errors": 0, "max_duration": 0.0},
+            )
+            rollup["runs"] += 1
+            rollup["errors"] += int(run.error is not None)
+            rollup["max_duration"] = max(rollup["max_duration"], run.duration)
+            for name in ROLLUP_FIELDS:
+                rollup[name] = rollup.get(name, 0) + getattr(run, name)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._runs.pop(key, None)
+            self._alerts.pop(key, None)
+
+    @contextmanager
+    def track(self, kind: str, key: str):
+        """Records the run of the enclosed block, whose stats it yields"""
+        run = RunStats(kind, key, time.time())
+        start = time.perf_counter()
+        try:
+            yield run
+        except Exception as e:
+            run.error = repr(e)
+            raise
+        finally:
+            run.duration = time.perf_counter() - start
+            self.record(run)
+
+    def measure(self, kind: str, key: str, execution: RuleExecution) -> RuleExecution:
+        """
+        Wraps a rule execution to record its run. Works with any driver, the
+        time before the first search is the query build and the time between
+        answers the processing of their results.
+        """
+        run = RunStats(kind, key, time.time())
+        start = mark = time.perf_counter()
+        phase = "build"
+        try:
+            request = execution.send(None)
+            while True:
+                now = time.perf_counter()
+                setattr(run, phase, getattr(run, phase) + now - mark)
+                mark, phase = now, "process"
+                try:
+                    response = yield request
+                except GeneratorExit:
+                    execution.close()
+                    raise
+                except Exception as e:
+                    run.search += time.perf_counter() - mark
+                    run.searches += 1
+                    mark = time.perf_counter()
+                    request = execution.throw(e)
+                    continue
+                run.search += time.perf_counter() - mark
+                run.observe(response)
+                mark = time.perf_counter()
+                request = execution.send(response)
+        except StopIteration as stop:
+            setattr(run, phase, getattr(run, phase) + time.perf_counter() - mark)
+            run.duration = time.perf_counter() - start
+            self.record(run)
+            return stop.value
+        except Exception as e:
+            run.error = repr(e)
+            run.duration = time.perf_counter() - start
+            self.record(run)
+            raise
+
+    def get_runs(self, key: str) -> list[dict]:
+        with self._lock:
+            return [run.to_dict() for run in self._runs.get(key, [])]
+
+    def flush(self):
+        """Adds the rollups gathered since the last flush to the database"""
+        with self._lock:
+            rollups, self._rollups = self._rollups, {}
+
+        for (kind, key, hour), rollup in rollups.items():
+            update = {f"inc__{name}": rollup[name] for name in ROLLUP_FIELDS}
+            try:
+                RulePerformance.objects(
+                    key=key,
+                    kind=kind,
+                    hour=datetime.utcfromtimestamp(hour),
+                ).update_one(
+                    upsert=True,
+                    inc__runs=rollup["runs"],
+                    inc__errors=rollup["errors"],
+                    max__max_duration=rollup["max_duration"],
+                    **update,
+                )
+            except Exception:
+                traceback.print_exc()
+
+    def get_performance(self, kind: str, key: str, hours: int) -> dict:
+        """Latest runs, hourly rollups and totals over the last hours of a rule"""
+        self.flush()
+        since = datetime.utcnow() - timedelta(hours=hours)
+        totals = RulePerformance.get_totals(since, limit=1, kind=kind, key=key)
+        return {
+            "runs": self.get_runs(key),
+            "hourly": to_dict(RulePerformance.get_hourly(kind, key, since)),
+            "total": totals[0] if totals else None,
+        }
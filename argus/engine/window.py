@@ -0,0 +1,279 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from operator import add
+from threading import Lock
+import time
+
+from models.rule import ConditionFunction, ThresholdRule
+from engine.search import SearchRequest
+from utils.time import get_timeframe_seconds
+
+# How the partial value of each metric aggregation is merged with another one
+merge_lookup = {"value_count": add, "sum": add, "min": min, "max": max}
+
+
+@dataclass
+class WindowState:
+    signature: str
+    bucket_size: int
+    window: int | None
+    # completed bucket start (epoch ms) -> group key -> partial aggregates
+    buckets: dict[int, dict] = field(default_factory=dict)
+    # cumulative partial aggregates, used by the "always" timeframe
+    accumulated: dict = field(default_factory=dict)
+    # start of the first bucket that was not complete on the last run
+    covered_until: int | None = None
+
+
+def _merge_value(func: str, current, value):
+    if current is None:
+        return value
+    if value is None:
+        return current
+    return merge_lookup[func](current, value)
+
+
+def merge_groups(target: dict, source: dict, metrics: dict[str, str]):
+    for key, partials in source.items():
+        current = target.setdefault(key, {})
+        for name, value in partials.items():
+            current[name] = _merge_value(metrics[name], current.get(name), value)
+
+
+class IncrementalWindows:
+    """
+    Keeps the partial aggregates of threshold rules in fixed time buckets,
+    one trigger interval wide. Each run only queries the data since the last
+    completed bucket, merges it locally and drops the buckets that left the
+    rule timeframe. The "always" timeframe keeps a cumulative accumulator.
+    """
+
+    def __init__(self):
+        self._states: dict[str, WindowState] = {}
+        self._lock = Lock()
+
+    def supports(self, rule: ThresholdRule) -> bool:
+        """Unique counts can't be merged from partial results"""
+        if any(c.function is ConditionFunction.UNIQ for c in rule.get_conditions()):
+            return False
+        if rule.trigger.get_sleep_time() <= 0:
+            return False
+        return (
+            rule.timeframe == "always"
+            or get_timeframe_seconds(rule.timeframe) is not None
+        )
+
+    def discard(self, rule_uuid: str):
+        with self._lock:
+            self._states.pop(rule_uuid, None)
+
+    def _signature(self, rule: ThresholdRule) -> str:
+        """Attributes that, once changed, invalidate the stored partials"""
+        return repr(
+            (
+                rule.datasources,
+                rule.timeframe,
+                rule.trigger.value,
+                rule.group_by,
+                [f.to_mongo().to_dict() for f in rule.filters],
+                [(c.function.value, c.field) for c in rule.get_conditions()],
+            )
+        )
+
+    def _get_state(self, rule: ThresholdRule) -> WindowState:
+        signature = self._signature(rule)
+        with self._lock:
+            state = self._states.get(str(rule.uuid))
+            if state and state.signature == signature:
+                return state
+
+            timeframe = get_timeframe_seconds(rule.timeframe)
+            state = WindowState(
+                signature=signature,
+                bucket_size=rule.trigger.get_sleep_time() * 1000,
+                window=timeframe * 1000 if timeframe else None,
+            )
+            self._states[str(rule.uuid)] = state
+            return state
+
+    def metric_aggs(self, rule: ThresholdRule) -> tuple[dict, dict[str, str]]:
+        from builder import operation_lookup
+
+        aggs = {}
+        for cond in rule.get_conditions():
+            key = cond.get_key()
+            if cond.function is ConditionFunction.AVG:
+                aggs[f"{key}|sum"] = {"sum": {"field": cond.field}}
+                aggs[f"{key}|count"] = {"value_count": {"field": cond.field}}
+            else:
+                aggs[key] = {operation_lookup[cond.function]: {"field": cond.field}}
+        metrics = {name: list(agg.keys())[0] for name, agg in aggs.items()}
+        return aggs, metrics
+
+    def get_group_key(self, rule: ThresholdRule, key: dict):
+        """Group of a composite bucket key, a tuple of values with several fields"""
+        if len(rule.group_by) == 0:
+            return ()
+        if len(rule.group_by) == 1:
+            return key[rule.group_by[0]]
+        return tuple(key[field] for field in rule.group_by)
+
+    def search_groups(
+        self,
+        rule: ThresholdRule,
+        index: list[str] | str,
+        start: int,
+        end: int,
+        size: int = 0,
+        interval=None,
+    ):
+        """
+        Yields the searches of the partial aggregates of each group between
+        start and end (inclusive) in the rule indices, paged through a
+        composite aggregation. With an interval (ms) they are split in buckets
+        of that width. Returns the groups by bucket start (None without
+        interval) and the hits of the first page.
+        """
+        from builder import set_composite_groupby
+        from config import config
+
+        metric_aggs, metrics = self.metric_aggs(rule)
+        query = rule.build_filter_query()
+        query["query"]["bool"]["must"].append(
+            {
+                "range": {
+                    "@timestamp": {"gte": start, "lte": end, "format": "epoch_millis"}
+                }
+            }
+        )
+        query["size"] = size
+
+        if interval is None and len(rule.group_by) == 0:
+            query["aggs"] = metric_aggs
+            result = yield SearchRequest(index=index, body=query)
+            groups = {
+                (): {name: result["aggregations"][name]["value"] for name in metrics}
+            }
+            return {None: groups}, result["hits"]
+
+        page_size = config.ENGINE_COMPOSITE_PAGE_SIZE
+        set_composite_groupby(query, rule.group_by, page_size, interval=interval)
+        query["aggs"]["groupby"]["aggs"] = metric_aggs
+        windows, hits = {}, None
+        while True:
+            result = yield SearchRequest(index=index, body=query)
+            if hits is None:
+                hits = result["hits"]
+                query["size"] = 0
+
+            groupby = result["aggregations"]["groupby"]
+            for bucket in groupby["buckets"]:
+                window = bucket["key"]["@timestamp"] if interval else None
+                groups = windows.setdefault(window, {})
+                groups[self.get_group_key(rule, bucket["key"])] = {
+                    name: bucket[name]["value"] for name in metrics
+                }
+            if "after_key" not in groupby or len(groupby["buckets"]) < page_size:
+                break
+            query["aggs"]["groupby"]["composite"]["after"] = groupby["after_key"]
+        return windows, hits
+
+    def to_aggregations(self, rule: ThresholdRule, groups: dict) -> dict:
+        def metric_values(partials: dict) -> dict:
+            values = {}
+            for cond in rule.get_conditions():
+                key = cond.get_key()
+                if cond.function is ConditionFunction.AVG:
+                    total = partials.get(f"{key}|sum")
+                    count = partials.get(f"{key}|count")
+                    value = total / count if count else None
+                elif cond.function in [ConditionFunction.COUNT, ConditionFunction.SUM]:
+                    value = partials.get(key) or 0
+                else:
+                    value = partials.get(key)
+                values[key] = {"value": value}
+            return values
+
+        if len(rule.group_by) == 0:
+            return metric_values(groups.get((), {}))
+
+        buckets = []
+        for key, partials in groups.items():
+            bucket_key = list(key) if isinstance(key, tuple) else key
+            buckets.append({"key": bucket_key, **metric_values(partials)})
+        return {"groupby": {"buckets": buckets}}
+
+    def execute(
+        self,
+        rule: ThresholdRule,
+        index: list[str] | str,
+        size: int = 0,
+        end: int | None = None,
+    ):
+        """
+        Yields the searches for the data not yet aggregated in the rule
+        indices, as its query plan resolved them, and returns a search-like
+        result with the aggregations of the timeframe ending at end (epoch
+        ms), now by default
+        """
+        state = self._get_state(rule)
+        end = end or int(time.time() * 1000)
+        current = end - end % state.bucket_size
+        with self._lock:
+            covered = state.covered_until
+
+        if covered is not None:
+            start = covered
+        elif state.window is None:
+            start = 0
+        else:
+            start = end - state.window
+            start -= start % state.bucket_size
+
+        metrics = self.metric_aggs(rule)[1]
+        try:
+            if state.window is None:
+                # the completed buckets are only accumulated once
+                complete, hits = {}, {"hits": []}
+                if start < current:
+                    searched, hits = yield from self.search_groups(
+                        rule, index, start, current - 1, size
+                    )
+                    complete = searched.get(None, {})
+                searched, partial_hits = yield from self.search_groups(
+                    rule, index, current, end, size
+                )
+                partial = searched.get(None, {})
+                hits = {**hits, "hits": hits["hits"] + partial_hits["hits"]}
+            else:
+                windows, hits = yield from self.search_groups(
+                    rule, index, start, end, size, interval=state.bucket_size
+                )
+                partial = windows.pop(current, {})
+        except Exception:
+            self.discard(str(rule.uuid))
+            raise
+
+        groups = {}
+        with self._lock:
+            if state.window is None:
+                # a concurrent run that already merged the range owns it
+                if state.covered_until == covered:
+                    merge_groups(state.accumulated, complete, metrics)
+                    state.covered_until = current
+                merge_groups(groups, state.accumulated, metrics)
+            else:
+                state.buckets.update(
+                    {key: g for key, g in windows.items() if key < current}
+                )
+                # Drop the buckets that left the rule timeframe
+                oldest = end - state.window
+                oldest -= oldest % state.bucket_size
+                for key in [k for k in state.buckets.keys() if k < oldest]:
+                    del state.buckets[key]
+                for bucket_groups in state.buckets.values():
+                    merge_groups(groups, bucket_groups, metrics)
+                state.covered_until = max(state.covered_until or 0, current)
+
+        merge_groups(groups, partial, metrics)
+        return {"aggregations": self.to_aggregations(rule, groups), "hits": hits}
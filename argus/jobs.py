@@ -63,7 +63,7 @@ def asset_discovery() -> None:
             alert = BaselineAlert(
                 type=AlertType.ALERT, custom_msg=alert_msg, related_ips=asset.ip
             )
-            alert.save()
+            app.scheduler.emit(alert)
 
         # agentless hosts - source and destination IP and MAC attributes
         fields = [("source.ip", "source.mac"), ("server.ip", "server.mac")]
@@ -96,7 +96,7 @@ def asset_discovery() -> None:
                     alert = BaselineAlert(
                         type=AlertType.ALERT, custom_msg=alert_msg, related_ips=at.ip
                     )
-                    alert.save()
+                    app.scheduler.emit(alert)
 
 
 @scheduler.task("interval", seconds=60 * 10)
@@ -131,4 +131,4 @@ def baseline_communication_channels() -> None:
                     custom_msg=alert_msg,
                     related_ips=channel["ips"],
                 )
-                alert.save()
+                app.scheduler.emit(alert)
@@ -1 +1 @@
-from . import core, alert, asset, baseline, rule, management
+from . import core, alert, asset, baseline, rule, management, engine
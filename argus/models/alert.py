@@ -6,6 +6,8 @@ from mongoengine import (
     ListField,
     DictField,
     StringField,
+    IntField,
+    DateTimeField,
     queryset_manager,
 )
 import uuid
@@ -57,6 +59,10 @@ class BaseAlert(TDocument):
 class Alert(BaseAlert):
     rule = DictField(required=True)
     logs = ListField(DictField(required=True))
+    # repeats of the alert within its suppression window
+    hits = IntField(default=1)
+    last_seen = DateTimeField()
+    fingerprint = StringField(max_length=64)
 
 
 class BaselineAlert(BaseAlert):
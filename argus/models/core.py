@@ -151,14 +151,9 @@ class Datasource(TDocument):
 
     @classmethod
     def get_datasources(cls, sources: list[str]) -> list[Datasource]:
-        result = []
         if "ALL" in sources:
             return Datasource.objects.all()
-        for source in sources:
-            ds = Datasource.by_name(name=source)
-            if ds:
-                result.append(ds)
-        return result
+        return list(Datasource.objects(name__in=sources))
 
     @classmethod
     def get_datasources_indices(cls, sources: list[str]) -> list[str]:
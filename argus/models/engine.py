@@ -0,0 +1,124 @@
+from __future__ import annotations
+from datetime import datetime
+from mongoengine import (
+    Document,
+    StringField,
+    IntField,
+    LongField,
+    FloatField,
+    DateTimeField,
+)
+
+
+class CollectionVersion(Document):
+    """Write counter of a collection, used by the engine to detect changes"""
+
+    name = StringField(max_length=64, required=True, unique=True)
+    version = IntField(default=0, required=True)
+
+    @classmethod
+    def bump(cls, name: str) -> None:
+        cls.objects(name=name).update_one(inc__version=1, upsert=True)
+
+    @classmethod
+    def get_versions(cls) -> dict[str, int]:
+        return {v.name: v.version for v in cls.objects.all()}
+
+
+class SuppressionEntry(Document):
+    """Alert of a rule key whose repeats are being counted instead of raised"""
+
+    rule = StringField(max_length=64, required=True)
+    key = StringField(max_length=64, required=True)
+    alert = StringField(max_length=64, required=True)
+    hits = IntField(default=1, required=True)
+    last_seen = DateTimeField(required=True)
+    expires_at = DateTimeField(required=True)
+    meta = {
+        "indexes": [
+            {"fields": ["rule", "key"], "unique": True},
+            {"fields": ["expires_at"], "expireAfterSeconds": 0},
+        ]
+    }
+
+
+class EngineNode(Document):
+    """Engine process taking part in the rule sharding, alive while it heartbeats"""
+
+    node = StringField(max_length=128, required=True, unique=True)
+    heartbeat = DateTimeField(required=True)
+    meta = {"indexes": [{"fields": ["heartbeat"], "expireAfterSeconds": 86400}]}
+
+    @classmethod
+    def beat(cls, node: str, now: datetime) -> None:
+        cls.objects(node=node).update_one(set__heartbeat=now, upsert=True)
+
+    @classmethod
+    def get_alive(cls, since: datetime) -> list[str]:
+        return [n.node for n in cls.objects(heartbeat__gte=since).only("node")]
+
+
+class JobLease(Document):
+    """
+    Ownership of a scheduled job by an engine node. The token is increased on
+    every change of owner and fences claims made by the previous one; the
+    last slot is the interval of the job that already ran.
+    """
+
+    job = StringField(max_length=128, required=True, unique=True)
+    owner = StringField(max_length=128, default="")
+    token = IntField(default=0, required=True)
+    last_slot = IntField(default=-1, required=True)
+    expires_at = DateTimeField(required=True)
+
+
+class RulePerformance(Document):
+    """Hourly rollup of the execution telemetry of a rule or analytic"""
+
+    key = StringField(max_length=128, required=True)
+    kind = StringField(max_length=16, required=True)
+    hour = DateTimeField(required=True)
+    runs = IntField(default=0, required=True)
+    errors = IntField(default=0, required=True)
+    # seconds spent in each part of the runs
+    duration = FloatField(default=0, required=True)
+    max_duration = FloatField(default=0, required=True)
+    build = FloatField(default=0, required=True)
+    search = FloatField(default=0, required=True)
+    process = FloatField(default=0, required=True)
+    # milliseconds reported by elasticsearch
+    took = LongField(default=0, required=True)
+    searches = LongField(default=0, required=True)
+    hits = LongField(default=0, required=True)
+    buckets = LongField(default=0, required=True)
+    alerts = LongField(default=0, required=True)
+    meta = {
+        "indexes": [
+            {"fields": ["key", "kind", "hour"], "unique": True},
+            {"fields": ["hour"], "expireAfterSeconds": 30 * 86400},
+        ]
+    }
+
+    @classmethod
+    def get_hourly(cls, kind: str, key: str, since: datetime):
+        return cls.objects(kind=kind, key=key, hour__gte=since).order_by("hour")
+
+    @classmethod
+    def get_totals(
+        cls, since: datetime, sort: str = "took", limit: int = 20, **filters
+    ) -> list[dict]:
+        """Summed rollups of each rule and analytic since a date, most costly first"""
+        fields = ["runs", "errors", "duration", "build", "search", "process"]
+        fields += ["took", "searches", "hits", "buckets", "alerts"]
+        group = {f: {"$sum": f"${f}"} for f in fields}
+        group["max_duration"] = {"$max": "$max_duration"}
+        pipeline = [
+            {"$group": {"_id": {"kind": "$kind", "key": "$key"}, **group}},
+            {"$sort": {sort: -1}},
+            {"$limit": limit},
+        ]
+        totals = []
+        for entry in cls.objects(hour__gte=since, **filters).aggregate(pipeline):
+            entry.update(entry.pop("_id"))
+            totals.append(entry)
+        return totals
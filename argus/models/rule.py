@@ -1,15 +1,15 @@
 from __future__ import annotations
 from enum import Enum
-from copy import copy
-from datetime import datetime
+from datetime import datetime, timezone
 from operator import lt, le, eq, ne, ge, gt
 from mongoengine import *
+import re
+import time
 import uuid
 
 from models.core import TDocument, MetaEnum, Datasource
 from models.alert import Alert, AlertType
-from utils.extractor import extract_ips_from_logs
-from utils.filter import filter_list_by_attr
+from utils.filter import index_list_by_attrs
 from constants import SEARCH_LIMIT
 
 
@@ -46,56 +46,34 @@ comparison_lookup = {
 }
 
 
-class Comparator:
-    def __init__(self, conditions, ctype):
-        self.type = ctype
-        self.conditions = conditions
-        self.result = None
-        self.run()
-
-    def run(self):
-        if self.type is ConditionLogic.ALL:
-            self.result = all([cond.result for cond in self.conditions])
-        else:
-            self.result = any([cond.result for cond in self.conditions])
-
-
 class Condition(EmbeddedDocument):
     field = StringField(max_length=128, required=True)
     function = EnumField(ConditionFunction, required=True)
     limit = FloatField(required=True)
     logic = EnumField(ConditionLogic, required=True)
     operator = EnumField(ConditionOperator, required=True)
-    result: bool = False
 
     def __str__(self):
         return (
             f"[{self.logic}] {self.function}({self.field}) {self.operator} {self.limit}"
         )
 
-    def set_result(self, result):
-        self.result = result
-
-    def check(self, value: int):
-        if comparison_lookup[self.operator](value, int(self.limit)):
-            print(
-                f"Condition Alert: {self.field} -> {value} {self.operator.value} {self.limit}"
-            )
-            self.set_result(True)
-            return
-        self.set_result(False)
-
-    @classmethod
-    def check_conditions(cls, cr: list[Condition]):
-        current_array = []
-        for index, cg in enumerate(cr):
-            if len(current_array) <= 1:
-                current_array.append(cg)
-            if len(current_array) == 2:
-                comparator = Comparator(copy(current_array), current_array[1].logic)
-                current_array[0] = comparator
-                del current_array[1]
-        return current_array[0].result
+    def get_key(self) -> str:
+        """Name of the metric aggregation of the condition"""
+        # dots would be read as a metric path by bucket selectors
+        return f"{self.function.value}-{self.field}".replace(".", "_")
+
+    def resolve(self) -> Condition:
+        """The condition, or a copy of it counting @timestamp for the "ALL" field"""
+        if self.field != "ALL":
+            return self
+        return Condition(
+            field="@timestamp",
+            function=self.function,
+            limit=self.limit,
+            logic=self.logic,
+            operator=self.operator,
+        )
 
 
 class FilterType(Enum, metaclass=MetaEnum):
@@ -233,6 +211,12 @@ class Rule(TDocument):
         datasources = Datasource.get_datasources(self.datasources)
         return [ds.get_indices() for ds in datasources]
 
+    def get_indices(self) -> str:
+        datasources = self.get_datasources()
+        if isinstance(datasources, str):
+            return datasources
+        return ",".join(datasources)
+
     def get_rule_dependencies(self):
         return Rule.by_trigger_rule(str(self.uuid))
 
@@ -269,16 +253,24 @@ class ThresholdRule(Rule):
     group_by = ListField(StringField(max_length=128))
     filters = EmbeddedDocumentListField(Filter)
     conditions = EmbeddedDocumentField(ConditionList, required=True)
+    evidence_size = IntField(min_value=0, max_value=SEARCH_LIMIT)
+
+    def get_condition_lists(self) -> dict[str, list[Condition]]:
+        """
+        Alert and alarm conditions, with the "ALL" field resolved to
+        @timestamp on copies: the engine shares the rule documents
+        """
+        return {
+            cond_type: [cond.resolve() for cond in cond_list]
+            for cond_type, cond_list in self.conditions.items()
+        }
 
-    def search(self, elastic):
-        from builder import (
-            build_search_query,
-            set_groupby,
-            set_filters,
-            set_timeframe,
-            set_painless_filter,
-            get_base_query,
-        )
+    def get_conditions(self) -> list[Condition]:
+        """Returns all conditions, with the "ALL" field resolved to @timestamp"""
+        return [cond.resolve() for cond in self.conditions.get_all_conditions()]
+
+    def build_filter_query(self) -> dict:
+        from builder import set_filters, set_painless_filter, get_base_query
 
         query = get_base_query()
 
@@ -288,138 +280,393 @@ class ThresholdRule(Rule):
             set_painless_filter(
                 query, [f for f in self.filters if f.type is FilterType.PAINLESS_SCRIPT]
             )
+        return query
+
+    def build_query_template(self) -> dict:
+        """Search body of the rule, without the time range"""
+        from builder import (
+            build_bucket_selector,
+            build_search_query,
+            set_composite_groupby,
+        )
+        from config import config
 
-        # Set group by aggregation
+        query = self.build_filter_query()
+        eager = config.ENGINE_EVIDENCE_MODE == "eager"
+
+        # Set group by aggregation, paged through by the rule execution
         if len(self.group_by) > 0:
-            set_groupby(query, self.group_by)
+            set_composite_groupby(
+                query, self.group_by, config.ENGINE_COMPOSITE_PAGE_SIZE
+            )
 
         # Set condition parameters
-        for cond in self.conditions.get_all_conditions():
-            if cond.field == "ALL":
-                cond.field = "@timestamp"
+        for cond in self.get_conditions():
             # if is_operation_valid(cond.function):
             build_search_query(query, cond)
 
-        # Query time-frame range
-        set_timeframe(query, self.timeframe)
-
-        return elastic.search(
-            index=self.get_datasources(), body=query, size=SEARCH_LIMIT
+        # Only return the buckets firing any of the conditions, along with
+        # a sample of their logs
+        if len(self.group_by) > 0 and config.ENGINE_CONDITION_PUSHDOWN:
+            selector = build_bucket_selector(list(self.get_condition_lists().values()))
+            if selector:
+                query["aggs"]["groupby"]["aggs"]["selector"] = selector
+                if not eager and self.get_evidence_size() > 0:
+                    query["aggs"]["groupby"]["aggs"]["evidence"] = {
+                        "top_hits": {"size": self.get_evidence_size()}
+                    }
+
+        query["size"] = SEARCH_LIMIT if eager else 0
+        return query
+
+    def get_evidence_size(self) -> int:
+        from config import config
+
+        if self.evidence_size is not None:
+            return self.evidence_size
+        return config.ENGINE_EVIDENCE_SIZE
+
+    def get_bucket_key(self, bucket: dict):
+        """Group by key of a composite bucket, as terms/multi_terms return it"""
+        if len(self.group_by) == 1:
+            return bucket["key"][self.group_by[0]]
+        return [bucket["key"][field] for field in self.group_by]
+
+    def get_index_key(self, key) -> tuple:
+        """Group by key of a bucket as a tuple of field values"""
+        if len(self.group_by) == 0:
+            return ()
+        if len(self.group_by) == 1:
+            return (key,)
+        return tuple(key)
+
+    def index_evidence(self, result: dict) -> dict:
+        """Groups the hits of a search by bucket key, in a single pass"""
+        return index_list_by_attrs(
+            result["hits"]["hits"], self.group_by, self.get_evidence_size()
         )
 
-    def run(self, elastic, scheduler, preview=False):
+    def get_context(self, key) -> dict:
+        """Group by field values of a bucket key"""
+        if len(self.group_by) == 0:
+            return {}
+        if len(self.group_by) == 1:
+            return {self.group_by[0]: key}
+        return dict(zip(self.group_by, key))
+
+    def execute(self, scheduler, preview=False, end=None):
+        """
+        Rule execution as a generator: yields the searches it needs and
+        receives their responses, so executions can be batched by the engine.
+        The time range ends at end (epoch ms), now by default.
+        """
+        from config import config
+        from engine.plan import compile_plan, get_time_range
+        from engine.search import SearchRequest
+
+        plan = scheduler.plans.get(self) if scheduler else compile_plan(self)
+        eager = config.ENGINE_EVIDENCE_MODE == "eager"
+        time_range = get_time_range(self.timeframe, end or int(time.time() * 1000))
         preview_alerts = {"alert": [], "alarm": []}
-        cond_res = {"alert": [], "alarm": []}
-        result = self.search(elastic)
 
-        # TODO - Simply this part, to much repetive code
-        # Only differs the metric value key ->
-        #   result['aggregations'][cond_key]['value']
-        #   r[cond_key]['value']
+        windows = scheduler.windows if scheduler and not preview else None
+        if windows and windows.supports(self):
+            result = yield from windows.execute(
+                self, plan.index, SEARCH_LIMIT if eager else 0, end
+            )
+            hits = self.index_evidence(result) if eager else None
+            aggregations = result["aggregations"]
+            yield from self.process(
+                scheduler, aggregations, hits, plan, time_range, preview_alerts, preview
+            )
+            return self.finish(scheduler, preview, aggregations, preview_alerts)
+
+        body = plan.stamp(*time_range)
         if len(self.group_by) == 0:
-            for cond_type, cond_list in self.conditions.items():
-                preview_result = ""
-                for cond in cond_list:
-                    cond_key = f"{cond.function.value}-{cond.field}"
-                    metric_value = result["aggregations"][cond_key]["value"]
-                    cond.check(metric_value)
-                    cond_res[cond_type].append(cond)
-                    if preview:
-                        preview_result += f"{cond.function.value}({cond.field}) => {metric_value} {cond.operator.value} {cond.limit}"
-
-                if len(cond_res[cond_type]) > 0 and Condition.check_conditions(
-                    cond_res[cond_type]
-                ):
-                    if preview:
-                        preview_alerts[cond_type].append(
-                            {"groupby": "none", "result": preview_result}
-                        )
-                        break
-                    log_sel = [log.get("_source") for log in result["hits"]["hits"]]
-                    ips = extract_ips_from_logs(log_sel)
-                    alert = Alert(
-                        type=AlertType(cond_type),
-                        rule=self.to_dict(),
-                        logs=log_sel,
-                        related_ips=ips,
-                    )
-                    alert.save()
+            result = yield SearchRequest(index=plan.index, body=body)
+            hits = self.index_evidence(result) if eager else None
+            aggregations = result["aggregations"]
+            yield from self.process(
+                scheduler, aggregations, hits, plan, time_range, preview_alerts, preview
+            )
+            return self.finish(scheduler, preview, aggregations, preview_alerts)
+
+        # Stream the group by buckets page by page, over a fixed time range,
+        # evaluating each page before the next one is fetched
+        groupby_aggs = body["aggs"]["groupby"].get("aggs", {})
+        page_size = body["aggs"]["groupby"]["composite"]["size"]
+        # Pages filtered by the condition selector may hold fewer buckets,
+        # only the absence of an after_key marks the last one
+        selector = "selector" in groupby_aggs
+        if preview:
+            # Preview shows every bucket and doesn't need evidence
+            groupby_aggs.pop("selector", None)
+            groupby_aggs.pop("evidence", None)
+            selector = False
+        preview_buckets = []
+        hits = None
+
+        while True:
+            result = yield SearchRequest(index=plan.index, body=body)
+            groupby = result["aggregations"]["groupby"]
+            if hits is None and eager:
+                hits = self.index_evidence(result)
+            body["size"] = 0
+
+            for bucket in groupby["buckets"]:
+                bucket["key"] = self.get_bucket_key(bucket)
+            yield from self.process(
+                scheduler,
+                result["aggregations"],
+                hits,
+                plan,
+                time_range,
+                preview_alerts,
+                preview,
+            )
+            if preview:
+                preview_buckets.extend(groupby["buckets"])
+
+            if "after_key" not in groupby:
+                break
+            if not selector and len(groupby["buckets"]) < page_size:
+                break
+            body["aggs"]["groupby"]["composite"]["after"] = groupby["after_key"]
+
+        aggregations = {"groupby": {"buckets": preview_buckets}}
+        return self.finish(scheduler, preview, aggregations, preview_alerts)
+
+    def run(self, elastic, scheduler, preview=False, end=None):
+        from engine.search import drive
+
+        return drive(self.execute(scheduler, preview, end), elastic)
+
+    def describe_metrics(self, conditions: list[Condition], metrics: dict) -> str:
+        """Preview text of the condition values of a bucket"""
+        result = ""
+        for cond in conditions:
+            metric_value = metrics[cond.get_key()]["value"]
+            result += f"{cond.function.value}({cond.field}) => {metric_value} {cond.operator.value} {cond.limit}"
+        return result
+
+    def process(
+        self, scheduler, aggregations, hits, plan, time_range, preview_alerts, preview
+    ):
+        """Evaluates a page of results and raises the alerts of its firing buckets"""
+        from engine.evaluate import evaluate_conditions
+        from engine.suppress import fingerprint
+
+        if len(self.group_by) == 0:
+            keys, buckets = [None], [aggregations]
         else:
-            buckets = result["aggregations"]["groupby"]["buckets"]
-            for r in buckets:
-                for cond_type, cond_list in self.conditions.items():
-                    preview_result = ""
-                    for cond in cond_list:
-                        cond_key = f"{cond.function.value}-{cond.field}"
-                        metric_value = r[cond_key]["value"]
-                        cond.check(metric_value)
-                        cond_res[cond_type].append(cond)
-                        if preview:
-                            preview_result += f"{cond.function.value}({cond.field}) => {metric_value} {cond.operator.value} {cond.limit}"
-
-                    if len(cond_res[cond_type]) > 0 and Condition.check_conditions(
-                        cond_res[cond_type]
-                    ):
-                        if preview:
-                            preview_alerts[cond_type].append(
-                                {"groupby": r["key"], "result": preview_result}
-                            )
-                            break
-
-                        f = {}
-                        if len(self.group_by) == 1:
-                            f[self.group_by[0]] = r["key"]
-                        elif len(self.group_by) > 1:
-                            for attr, value in zip(self.group_by, r["key"]):
-                                f[attr] = value
-
-                        log_sel = filter_list_by_attr(result["hits"]["hits"], f)
-                        ips = extract_ips_from_logs(log_sel)
-                        alert = Alert(
-                            type=AlertType(cond_type),
-                            rule=self.to_dict(),
-                            logs=log_sel,
-                            context=f,
-                            related_ips=ips,
-                        )
-                        alert.save()
+            buckets = aggregations["groupby"]["buckets"]
+            keys = [b["key"] for b in buckets]
+
+        firing = []
+        for cond_type, cond_list in self.get_condition_lists().items():
+            for i in evaluate_conditions(cond_list, buckets):
+                key, bucket = keys[i], buckets[i]
+                if preview:
+                    preview_alerts[cond_type].append(
+                        {
+                            "groupby": "none" if key is None else key,
+                            "result": self.describe_metrics(cond_list, bucket),
+                        }
+                    )
+                    continue
+                # repeats of an open alert don't need their evidence
+                key_print = fingerprint(cond_type, self.get_index_key(key))
+                if scheduler.suppress(str(self.uuid), key_print):
+                    continue
+                firing.append((cond_type, key, bucket, key_print))
+
+        if not firing:
+            return
 
+        evidence = yield from self.collect_evidence(firing, hits, plan, time_range)
+        related_ips = scheduler.cpu.run(
+            "extract_ips", evidence, sum(len(logs) for logs in evidence)
+        )
+        rule_data = self.to_dict()
+        for (cond_type, key, _, key_print), log_sel, ips in zip(
+            firing, evidence, related_ips
+        ):
+            alert = Alert(
+                type=AlertType(cond_type),
+                rule=rule_data,
+                logs=log_sel,
+                context=self.get_context(key),
+                related_ips=ips,
+                fingerprint=key_print,
+            )
+            scheduler.emit(alert, str(self.uuid))
+
+    def collect_evidence(self, firing, hits, plan, time_range):
+        """
+        Returns the sample logs of each firing bucket: taken from its top_hits,
+        from the index of eagerly fetched hits or from a search scoped to its key
+        """
+        from engine.search import SearchRequest
+
+        size = self.get_evidence_size()
+        evidence = [[] for _ in firing]
+        requests = []
+
+        for i, (_, key, bucket, _) in enumerate(firing):
+            if "evidence" in bucket:
+                evidence[i] = [h["_source"] for h in bucket["evidence"]["hits"]["hits"]]
+            elif hits is not None:
+                evidence[i] = hits.get(self.get_index_key(key), [])
+            elif size > 0:
+                body = plan.stamp(*time_range)
+                body.pop("aggs", None)
+                body["size"] = size
+                for field, value in self.get_context(key).items():
+                    body["query"]["bool"]["must"].append({"term": {field: value}})
+                requests.append((i, SearchRequest(index=plan.index, body=body)))
+
+        if requests:
+            responses = yield [request for _, request in requests]
+            for (i, _), response in zip(requests, responses):
+                if isinstance(response, Exception):
+                    continue
+                evidence[i] = [h["_source"] for h in response["hits"]["hits"]]
+        return evidence
+
+    def finish(self, scheduler, preview, aggregations, preview_alerts):
         if preview:
-            return result["aggregations"], preview_alerts
+            return aggregations, preview_alerts
 
         self.update(last_execution=datetime.utcnow())
-        rules = self.get_rule_dependencies()
-        if not rules:
-            return
-        for rule in rules:
-            scheduler.handle_rule_task(rule)
+        scheduler.trigger_dependents(self)
 
 
 class EQLRule(Rule):
     type = EnumField(RuleType, default=RuleType.EQL_QUERY, required=True)
     query = StringField(max_length=24576, required=True)
     alert_type = EnumField(AlertType, required=True)
+    # end (epoch ms) of the time range searched by the last execution
+    checkpoint = LongField()
+
+    def get_maxspan(self) -> int:
+        """Longest sequence maxspan of the query, in ms"""
+        units = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000}
+        spans = re.findall(r"maxspan\s*=\s*(\d+)\s*(ms|s|m|h|d)\b", self.query)
+        return max([int(value) * units[unit] for value, unit in spans], default=0)
+
+    def get_search_range(self, end: int, checkpoint: int | None = None) -> tuple:
+        """
+        Time range of a scheduled search: the data since the last execution,
+        overlapping it by the maxspan so sequences crossing it still match
+        """
+        from engine.plan import get_time_range
+
+        start, end = get_time_range(self.timeframe, end)
+        if not checkpoint or not isinstance(start, int):
+            return start, end
+        return max(start, checkpoint - self.get_maxspan()), end
+
+    def build_query_template(self) -> dict:
+        """Search parameters of the rule, without the time range"""
+        return {"query": self.query, "size": 10000}
+
+    def execute(self, scheduler, preview=False, lookup=False, end=None):
+        """
+        Rule execution as a generator: yields the searches it needs and
+        receives their responses, so executions can be batched by the engine.
+        The time range ends at end (epoch ms), now by default.
+        """
+        from engine.plan import compile_plan, get_time_range
+        from engine.search import SearchRequest
+
+        from config import config
+
+        plan = scheduler.plans.get(self) if scheduler else compile_plan(self)
+        if preview or lookup or not scheduler:
+            result = yield SearchRequest(
+                index=plan.index,
+                body=plan.stamp(*get_time_range(self.timeframe, end)),
+                eql=True,
+            )
+            return self.evaluate(result, scheduler, preview, lookup)
+
+        # Scheduled runs only search new data, once it had time to be ingested
+        end = (end or int(time.time() * 1000)) - config.ENGINE_EQL_LAG_SECONDS * 1000
+        # the checkpoint lives in the registry, the cached document is shared
+        checkpoint = scheduler.registry.get_checkpoint(self)
+        start, end = self.get_search_range(end, checkpoint)
+        size = config.ENGINE_EQL_SIZE
+
+        # Only the first new match alerts, but old matches of the overlap may
+        # fill a page: page through the window until one is found
+        read: set[str] = set()
+        for _ in range(config.ENGINE_EQL_MAX_PAGES):
+            body = plan.stamp(start, end)
+            body["size"] = size
+            result = yield SearchRequest(index=plan.index, body=body, eql=True)
+            if not result:
+                # failed searches are retried by the next run
+                return None
+            matches = self.get_matches(result)
+            unread = [m for m in matches if self.get_fingerprint(m) not in read]
+            if self.raise_alert(unread, scheduler, checkpoint) or len(matches) < size:
+                return self.finish_run(scheduler, end)
+            read.update(self.get_fingerprint(m) for m in matches)
+            # matches come in start order, the next page starts again at the
+            # millisecond of the last one, which others may share. Only a page
+            # filled by that millisecond moves past it, EQL has no search_after
+            started = self.get_event_time(matches[-1][0])
+            if started is None:
+                break
+            if isinstance(start, int) and int(started) <= start:
+                start += 1
+            else:
+                start = int(started)
 
-    def search(self, elastic):
-        time_range = {
-            "range": {
-                "@timestamp": {
-                    "gte": (
-                        f"now-{self.timeframe}" if self.timeframe != "always" else "0"
-                    ),
-                    "lte": "now",
-                }
-            }
-        }
-        return elastic.eql_search(
-            index=self.get_datasources(),
-            query=self.query,
-            size=10000,
-            filter=time_range,
-        )
+        print(f"{datetime.now()} | EQL rule window not fully read: {self.name}")
+        if isinstance(start, int):
+            # the unread matches start, and so end, after the last page start
+            checkpoint = max(checkpoint or 0, min(start - 1, end))
+        return self.finish_run(scheduler, checkpoint)
+
+    def run(self, elastic, scheduler, preview=False, lookup=False, end=None):
+        from engine.search import drive
 
-    def run(self, elastic, scheduler, preview=False, lookup=False):
-        result = self.search(elastic)
+        return drive(self.execute(scheduler, preview, lookup, end), elastic)
+
+    def get_matches(self, result) -> list[list[dict]]:
+        """Events of each match of a result, an event or a sequence"""
+        if "sequences" in result["hits"].keys():
+            return [s["events"] for s in result["hits"]["sequences"]]
+        return [[e] for e in result["hits"].get("events", [])]
+
+    def get_event_time(self, event: dict) -> float | None:
+        """Timestamp (epoch ms) of a matched event"""
+        timestamp = event.get("_source", {}).get("@timestamp")
+        if not timestamp:
+            return None
+        try:
+            at = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+        except (TypeError, ValueError):
+            return None
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        return at.timestamp() * 1000
+
+    def get_fingerprint(self, events: list[dict]) -> str:
+        """Identity of a match, by the documents of its events"""
+        from engine.suppress import fingerprint
+
+        return fingerprint(*[(e.get("_index"), e.get("_id")) for e in events])
+
+    def is_new_match(self, events: list[dict], checkpoint: int | None) -> bool:
+        """Whether a match ended after the previous checkpoint"""
+        if not checkpoint:
+            return True
+        ended = self.get_event_time(events[-1])
+        return ended is None or ended > checkpoint
+
+    def evaluate(self, result, scheduler, preview=False, lookup=False):
         if not result:
             return None
         result_number = result["hits"]["total"]["value"]
@@ -439,25 +686,44 @@ class EQLRule(Rule):
             return prev_alerts
 
         if result_number > 0:
-            if "events" in result["hits"].keys():
-                sel_log = result["hits"]["events"][0]["_source"]
-            if "sequences" in result["hits"].keys():
-                sel_log = result["hits"]["sequences"][0]["events"][0]["_source"]
-
             if preview:
                 preview_alerts[self.alert_type.value].append(
                     {"result": f"{str(self.alert_type)} Triggered"}
                 )
             else:
-                alert = Alert(type=AlertType.ALERT, rule=self.to_dict(), logs=[sel_log])
-                alert.save()
+                self.raise_alert(self.get_matches(result), scheduler)
 
         if preview:
             return result["hits"], preview_alerts
+        self.finish_run(scheduler)
 
-        self.update(last_execution=datetime.utcnow())
-        dependencies = self.get_rule_dependencies()
-        if not dependencies:
-            return
-        for rule in dependencies:
-            scheduler.handle_rule_task(rule)
+    def finish_run(self, scheduler, checkpoint=None):
+        """Records the run, and the end of the data it read"""
+        if checkpoint is None:
+            self.update(last_execution=datetime.utcnow())
+        else:
+            self.update(last_execution=datetime.utcnow(), checkpoint=checkpoint)
+            scheduler.registry.set_checkpoint(str(self.uuid), checkpoint)
+        scheduler.trigger_dependents(self)
+
+    def raise_alert(self, matches, scheduler, checkpoint=None) -> bool:
+        """
+        Raises an alert for the first match not seen by a previous execution,
+        returns whether it did
+        """
+        for events in matches:
+            if not self.is_new_match(events, checkpoint):
+                continue
+            # the overlap with the previous execution may return the same match
+            event_print = self.get_fingerprint(events)
+            if scheduler.suppress(str(self.uuid), event_print):
+                continue
+            alert = Alert(
+                type=AlertType.ALERT,
+                rule=self.to_dict(),
+                logs=[events[0]["_source"]],
+                fingerprint=event_print,
+            )
+            scheduler.emit(alert, str(self.uuid))
+            return True
+        return False
@@ -1,83 +1,391 @@
 from flask_apscheduler import APScheduler
 from datetime import datetime
+from threading import Lock
+import time
+import traceback
 
-from clients import ElasticClient
+from config import config
+from engine import (
+    AlertSink,
+    AsyncEngine,
+    Backtest,
+    BatchExecutor,
+    CostEstimator,
+    CPUPool,
+    DependencyExecutor,
+    EngineCluster,
+    EQLLookup,
+    IncrementalWindows,
+    QueryPlanCache,
+    ANALYTICS,
+    RULES,
+    RuleRegistry,
+    SuppressionCache,
+    RunStats,
+    StreamEngine,
+    Telemetry,
+    ThrottledClient,
+    drive,
+    next_run,
+    phase_offset,
+    phase_start,
+    project_load,
+)
 from utils import to_dict
 from models.rule import Rule
-from models.alert import AlertOrigin, AlertType, BaselineAlert
+from models.alert import AlertOrigin, AlertType, BaseAlert, BaselineAlert
 from models.asset import Asset
 from models.baseline import BaselineAnalytic, BaselineSingleEvent, AnalyticType
 
 
 class EngineScheduler:
     def __init__(self, es, baseline, scheduler):
-        self._es: ElasticClient = es
+        # engine searches hold a cluster query slot, interactive ones don't. The
+        # app still starts when elasticsearch can't be reached, without a client
+        self._es: ThrottledClient | None = (
+            ThrottledClient(es) if es is not None else None
+        )
         self._baseline: Baseline = baseline
         self._scheduler: APScheduler = scheduler
+        self._batch = BatchExecutor(
+            self._es,
+            config.ENGINE_MSEARCH_SIZE,
+            config.ENGINE_EQL_WORKERS,
+            config.ENGINE_SHARED_SCANS,
+        )
+        # rule uuid -> [interval, next run timestamp], used in batch mode
+        self._batch_rules: dict[str, list] = {}
+        self._batch_lock = Lock()
+        # rules and analytics collection versions the local jobs follow
+        self._reconciled: tuple[int, int] | None = None
+        self.aio = (
+            AsyncEngine(
+                config,
+                es.pressure,
+                config.ENGINE_ASYNC_DATASOURCE_CONCURRENCY,
+                config.ENGINE_ASYNC_MAX_IN_FLIGHT,
+            )
+            if config.ENGINE_EXECUTION_MODE == "async" and es is not None
+            else None
+        )
+        self.registry = RuleRegistry(config.ENGINE_REGISTRY_REFRESH_SECONDS)
+        self.plans = QueryPlanCache(self.registry)
+        self.cpu = CPUPool(
+            config.ENGINE_CPU_WORKERS,
+            config.ENGINE_CPU_SHM_BYTES,
+            config.ENGINE_CPU_MIN_ITEMS,
+        )
+        self.dependencies = DependencyExecutor(config.ENGINE_DEPENDENCY_WORKERS)
+        self.cluster = (
+            EngineCluster(config.ENGINE_HEARTBEAT_SECONDS, config.ENGINE_NODE_TIMEOUT)
+            if config.ENGINE_SHARDING
+            else None
+        )
+        self.lookups = EQLLookup(
+            self._es,
+            config.ENGINE_LOOKUP_WORKERS,
+            config.ENGINE_LOOKUP_SLICE_SECONDS * 1000,
+        )
+        self.telemetry = Telemetry(config.ENGINE_TELEMETRY_SIZE)
+        self.costs = CostEstimator(
+            es,
+            baseline.settings,
+            config.ENGINE_COST_SAMPLE_SECONDS,
+            config.ENGINE_COST_MAX_RUN_MS,
+            config.ENGINE_COST_MAX_LOAD,
+            config.ENGINE_COST_MODE,
+            config.ENGINE_COMPOSITE_PAGE_SIZE,
+            config.ENGINE_INCREMENTAL_WINDOWS,
+        )
+        self.backtests = Backtest(
+            self._es, config.ENGINE_BACKTEST_WORKERS, config.ENGINE_BACKTEST_MAX_WINDOWS
+        )
+        self.stream = (
+            StreamEngine(
+                self._es,
+                config.ENGINE_STREAM_PAGE_SIZE,
+                config.ENGINE_STREAM_MAX_PAGES,
+                config.ENGINE_STREAM_LAG_SECONDS,
+            )
+            if config.ENGINE_STREAMING
+            else None
+        )
+        self.windows = (
+            IncrementalWindows() if config.ENGINE_INCREMENTAL_WINDOWS else None
+        )
+        self.alerts = AlertSink(
+            config.ENGINE_ALERT_BATCH_SIZE,
+            config.ENGINE_ALERT_FLUSH_SECONDS,
+            config.ENGINE_ALERT_QUEUE_SIZE,
+            config.ENGINE_ALERT_QUEUE_TIMEOUT,
+        )
+        self.suppression = (
+            SuppressionCache(config.ENGINE_SUPPRESSION_WINDOW)
+            if config.ENGINE_SUPPRESSION_WINDOW > 0
+            else None
+        )
 
     def _job_by_id(self, job_id: str):
         return self._scheduler.get_job(job_id)
 
+    def _is_batch_mode(self) -> bool:
+        """Whether rules run from the due table on every engine tick"""
+        return config.ENGINE_EXECUTION_MODE in ("batch", "async")
+
+    def emit(self, alert: BaseAlert, rule: str | None = None) -> None:
+        """
+        Queues an alert to be persisted by the alert sink. Alerts of a rule
+        with a fingerprint start its suppression window.
+        """
+        self.alerts.emit(alert)
+        if rule:
+            self.telemetry.alert(rule)
+        if self.suppression and rule and alert.fingerprint:
+            self.alerts.emit(
+                self.suppression.record(rule, alert.fingerprint, str(alert.uuid))
+            )
+
+    def trigger_dependents(self, rule: Rule) -> None:
+        """Runs the rules triggered by a finished rule"""
+        self.dependencies.trigger(self, rule)
+
+    def suppress(self, rule: str, key: str) -> bool:
+        """Counts a repeat of an alert still in its suppression window"""
+        if not self.suppression:
+            return False
+        update = self.suppression.hit(rule, key)
+        if not update:
+            return False
+        self.alerts.emit(update)
+        return True
+
+    def _unschedule(self, job_id: str) -> None:
+        with self._batch_lock:
+            self._batch_rules.pop(job_id, None)
+        if self._job_by_id(job_id):
+            self._scheduler.remove_job(job_id)
+
     def remove_job_by_id(self, job_id: str) -> None:
-        if not self._job_by_id(job_id):
-            return
-        self._scheduler.remove_job(job_id)
+        self._unschedule(job_id)
+        self.plans.discard(job_id)
+        if self.suppression:
+            self.suppression.discard(job_id)
+        if self.windows:
+            self.windows.discard(job_id)
+        self.telemetry.discard(job_id)
+        if self.stream:
+            self.stream.discard(job_id)
 
     def load_rules(self):
-        rules = Rule.periodic_rules().filter(active=True)
+        rules = self.registry.get_periodic_rules()
         print(f"[+] Loading {len(rules)} rules.")
+        if not self._job_by_id("engine-reconcile"):
+            self._scheduler.add_job(
+                id="engine-reconcile",
+                func=self.reconcile,
+                trigger="interval",
+                seconds=max(config.ENGINE_REGISTRY_REFRESH_SECONDS, 1),
+                coalesce=True,
+                misfire_grace_time=None,
+            )
+        if self.cluster and not self._job_by_id("engine-heartbeat"):
+            self.cluster.heartbeat()
+            self._scheduler.add_job(
+                id="engine-heartbeat",
+                func=self.cluster.heartbeat,
+                trigger="interval",
+                seconds=config.ENGINE_HEARTBEAT_SECONDS,
+                coalesce=True,
+                misfire_grace_time=None,
+            )
+        if not self._job_by_id("engine-telemetry"):
+            self._scheduler.add_job(
+                id="engine-telemetry",
+                func=self.telemetry.flush,
+                trigger="interval",
+                seconds=config.ENGINE_TELEMETRY_FLUSH_SECONDS,
+                coalesce=True,
+                misfire_grace_time=None,
+            )
+        if self.stream and not self._job_by_id("engine-stream"):
+            self._scheduler.add_job(
+                id="engine-stream",
+                func=self.handle_stream,
+                trigger="interval",
+                seconds=config.ENGINE_STREAM_POLL_SECONDS,
+                coalesce=True,
+                misfire_grace_time=None,
+            )
+        if self._is_batch_mode() and not self._job_by_id("engine-tick"):
+            self._scheduler.add_job(
+                id="engine-tick",
+                func=self.handle_tick,
+                trigger="interval",
+                seconds=config.ENGINE_TICK_SECONDS,
+                coalesce=True,
+                misfire_grace_time=None,
+            )
         for rule in rules:
             self.load_rule(rule)
 
     def load_rule(self, rule: Rule):
         job_id = str(rule.uuid)
+        if self.stream and self.stream.add(rule):
+            # streamed rules don't search on their own
+            with self._batch_lock:
+                self._batch_rules.pop(job_id, None)
+            if self._job_by_id(job_id):
+                self._scheduler.remove_job(job_id)
+            return
+
+        if self._is_batch_mode():
+            interval = rule.trigger.get_sleep_time()
+            with self._batch_lock:
+                if interval > 0 and job_id not in self._batch_rules:
+                    next_time = next_run(job_id, interval, time.time())
+                    self._batch_rules[job_id] = [interval, next_time]
+            return
+
         if self._job_by_id(job_id):
             return
 
+        # rules sharing an interval are spread over it by a stable phase
+        interval = rule.trigger.get_sleep_time()
         self._scheduler.add_job(
             id=job_id,
             func=self.handle_rule_task,
             trigger="interval",
-            args=[rule],
-            seconds=rule.trigger.get_sleep_time(),
+            args=[job_id],
+            seconds=interval,
+            start_date=phase_start(job_id, interval),
             misfire_grace_time=None,
         )
 
     def load_analytics(self):
-        analytics = BaselineAnalytic.get_all().filter(active=True)
+        analytics = [a for a in self.registry.get_analytics() if a.active]
         print(f"[+] Loading {len(analytics)} baseline analytics.")
         for analytic in analytics:
             self.load_analytic(analytic)
 
     def load_analytic(self, analytic: BaselineAnalytic):
+        if self._job_by_id(analytic.code):
+            return
+        interval = analytic.get_sleep_time()
         self._scheduler.add_job(
             id=analytic.code,
             func=self.handle_analytic_task,
             trigger="interval",
-            args=[analytic],
-            seconds=analytic.get_sleep_time(),
+            args=[analytic.code],
+            seconds=interval,
+            start_date=phase_start(analytic.code, interval),
             misfire_grace_time=None,
         )
 
-    def handle_analytic_task(self, analytic: BaselineAnalytic, force: bool = False):
+    def _job_interval(self, job_id: str) -> int | None:
+        """Interval (seconds) of the local job of a rule or analytic"""
+        with self._batch_lock:
+            entry = self._batch_rules.get(job_id)
+        if entry:
+            return entry[0]
+        job = self._job_by_id(job_id)
+        if not job:
+            return None
+        return int(job.trigger.interval.total_seconds())
+
+    def reconcile(self):
+        """
+        Follows the rules and analytics written through any process: adds the
+        jobs of new or reactivated ones, moves the ones whose interval changed
+        and removes the ones deleted or deactivated. With sharding each job
+        must exist in every process, the owner of its slots is chosen at run.
+        """
+        versions = (
+            self.registry.get_version(RULES),
+            self.registry.get_version(ANALYTICS),
+        )
+        if versions == self._reconciled:
+            return
+        self._reconciled = versions
+
+        rules = {str(r.uuid): r for r in self.registry.get_periodic_rules()}
+        jobs = self._scheduler.get_jobs()
+        with self._batch_lock:
+            local = set(self._batch_rules.keys())
+        local.update(j.id for j in jobs if j.func == self.handle_rule_task)
+        for job_id in local - rules.keys():
+            self.remove_job_by_id(job_id)
+        for job_id, rule in rules.items():
+            interval = self._job_interval(job_id)
+            if interval is not None and interval != rule.trigger.get_sleep_time():
+                self._unschedule(job_id)
+            self.load_rule(rule)
+
+        analytics = {a.code: a for a in self.registry.get_analytics() if a.active}
+        local = {j.id for j in jobs if j.func == self.handle_analytic_task}
+        for code in local - analytics.keys():
+            self.remove_job_by_id(code)
+        for code, analytic in analytics.items():
+            interval = self._job_interval(code)
+            if interval is not None and interval != analytic.get_sleep_time():
+                self._unschedule(code)
+            self.load_analytic(analytic)
+
+    def get_load(self, window: int) -> dict:
+        """Projected number of rule and analytic runs per second, from now"""
+        jobs = [
+            (str(rule.uuid), rule.trigger.get_sleep_time())
+            for rule in self.registry.get_periodic_rules()
+        ]
+        jobs += [
+            (analytic.code, analytic.get_sleep_time())
+            for analytic in self.registry.get_analytics()
+            if analytic.active
+        ]
+        start = int(time.time())
+        load = project_load(jobs, start, window)
+        return {
+            "start": start,
+            "jobs": len(jobs),
+            "peak": int(load.max()) if window > 0 else 0,
+            "mean": float(load.mean()) if window > 0 else 0,
+            "load": load.tolist(),
+            "max_concurrent_queries": config.ENGINE_MAX_CONCURRENT_QUERIES,
+        }
+
+    def handle_analytic_task(
+        self, analytic: BaselineAnalytic | str, force: bool = False
+    ):
         """Handle the execution of a baseline analytic"""
-        analytic.reload()
-        if not (force or analytic.active):
+        if isinstance(analytic, str):
+            analytic = self.registry.get_analytic(analytic)
+        if not analytic or not (force or analytic.active):
+            return
+        if not force and not self._claim(analytic.code, analytic.get_sleep_time()):
             return
 
         print(f"[Analytics] Running analytic: {analytic.name}")
+        with self.telemetry.track("analytic", analytic.code) as run:
+            self.run_analytic(analytic, run)
 
+    def run_analytic(self, analytic: BaselineAnalytic, run: RunStats):
         if analytic.category is AnalyticType.ASSET:
             assets = Asset.get_by_ids(analytic.asset_control)
             for asset in assets:
                 print(f"[{analytic.name}] Running against asset: {asset.name}")
-                base = self._baseline.get_base_analytic_data(
-                    analytic, latest=False, asset=asset
-                )
-                latest = self._baseline.get_base_analytic_data(
-                    analytic, latest=True, asset=asset
-                )
-                deviation = [e for e in latest if e not in base]
+                with run.phase("search"):
+                    base = self._baseline.get_base_analytic_data(
+                        analytic, latest=False, asset=asset
+                    )
+                    latest = self._baseline.get_base_analytic_data(
+                        analytic, latest=True, asset=asset
+                    )
+                with run.phase("process"):
+                    deviation = self.cpu.run(
+                        "deviations",
+                        {"latest": latest, "base": base},
+                        len(latest) + len(base),
+                    )
+                run.hits += len(latest) + len(base)
 
                 if len(deviation) == 0:
                     continue
@@ -97,12 +405,24 @@ class EngineScheduler:
                         origin=AlertOrigin.BASELINE,
                         related_ips=event.ips,
                     )
-                    alert.save()
+                    self.emit(alert)
+                run.alerts += len(events)
 
         elif analytic.category is AnalyticType.GENERAL:
-            base_data = self._baseline.get_base_analytic_data(analytic, latest=False)
-            latest_data = self._baseline.get_base_analytic_data(analytic, latest=True)
-            deviations = [e for e in latest_data if e not in base_data]
+            with run.phase("search"):
+                base_data = self._baseline.get_base_analytic_data(
+                    analytic, latest=False
+                )
+                latest_data = self._baseline.get_base_analytic_data(
+                    analytic, latest=True
+                )
+            with run.phase("process"):
+                deviations = self.cpu.run(
+                    "deviations",
+                    {"latest": latest_data, "base": base_data},
+                    len(latest_data) + len(base_data),
+                )
+            run.hits += len(latest_data) + len(base_data)
 
             if len(deviations) == 0:
                 return
@@ -120,14 +440,105 @@ class EngineScheduler:
                     deviation=event.deviation,
                     related_ips=event.ips,
                 )
-                alert.save()
+                self.emit(alert)
+            run.alerts += len(events)
 
-    def handle_rule_task(self, rule: Rule, force: bool = False):
+    def _claim(self, job_id: str, interval: int) -> bool:
+        """Whether this process runs the current interval of a job"""
+        if not self.cluster:
+            return True
+        return self.cluster.claim(job_id, interval, phase_offset(job_id, interval))
+
+    def _defer(self, rule: Rule) -> bool:
+        """Skips a low risk rule run while elasticsearch is under stress"""
+        if not self._es or not self._es.pressure.should_defer(rule.risk):
+            return False
+        print(f"{datetime.now()} | Deferring rule under cluster pressure: {rule.name}")
+        return True
+
+    def execute(self, rule: Rule, end: int | None = None):
+        """Execution of a scheduled rule run, recorded by the telemetry"""
+        execution = rule.execute(self, end=end)
+        return self.telemetry.measure("rule", str(rule.uuid), execution)
+
+    def handle_tick(self):
+        """Runs all the batch scheduled rules that are due, coalescing their searches"""
+        now = time.time()
+        with self._batch_lock:
+            due = []
+            for job_id, entry in self._batch_rules.items():
+                interval, next_time = entry
+                if next_time > now:
+                    continue
+                due.append(job_id)
+                entry[1] = next_time + interval
+                if entry[1] <= now:
+                    entry[1] = next_run(job_id, interval, now)
+
+        if not due:
+            return
+
+        rules = [self.registry.get_rule(rule_uuid) for rule_uuid in due]
+        rules = [rule for rule in rules if rule and rule.active]
+        rules = [rule for rule in rules if not self._defer(rule)]
+        rules = [
+            rule
+            for rule in rules
+            if self._claim(str(rule.uuid), rule.trigger.get_sleep_time())
+        ]
+        # rules of a tick search the same time range, so equal searches can be shared
+        end = int(now * 1000)
+        executions = {str(rule.uuid): self.execute(rule, end) for rule in rules}
+        if self.aio:
+            started = self.aio.submit(executions)
+            print(f"{datetime.now()} | Started {len(started)} async rules")
+            return
+
+        print(f"{datetime.now()} | Running {len(rules)} batched rules")
+        shared = self._batch.shared
+        with self.dependencies.tick():
+            self._batch.run(executions)
+        if self._batch.shared > shared:
+            print(f"{datetime.now()} | Shared {self._batch.shared - shared} searches")
+
+    def handle_rule_task(self, rule: Rule | str, force: bool = False):
         """Handle the continuous execution of a rule"""
-        rule.reload()
+        if isinstance(rule, str):
+            rule = self.registry.get_rule(rule)
 
-        if not (force or rule.active):
+        if not rule or not (force or rule.active):
+            return
+        if not force and self._defer(rule):
+            return
+        if not force and not self._claim(str(rule.uuid), rule.trigger.get_sleep_time()):
             return
 
         print(f"{datetime.now()} | Running {rule.trigger.type.value} rule: {rule.name}")
-        rule.run(self._es, self)
+        drive(self.execute(rule), self._es)
+
+    def handle_stream(self):
+        """Reads the streamed datasources and evaluates the streamed rules that are due"""
+        for rule in self.stream.refresh(self.registry):
+            self.load_rule(rule)
+        read = self.stream.poll()
+
+        due = self.stream.due(time.time())
+        due = [
+            entry for entry in due if entry.rule.active and not self._defer(entry.rule)
+        ]
+        due = [
+            entry
+            for entry in due
+            if self._claim(str(entry.rule.uuid), entry.bucket_size // 1000)
+        ]
+        if due:
+            print(
+                f"{datetime.now()} | Evaluating {len(due)} streamed rules ({read} new events)"
+            )
+        for entry in due:
+            rule_uuid = str(entry.rule.uuid)
+            try:
+                with self.telemetry.track("rule", rule_uuid):
+                    self.stream.evaluate(self, entry)
+            except Exception:
+                traceback.print_exc()
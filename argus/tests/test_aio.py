@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+from engine.aio import AsyncEngine
+from engine.pressure import PressureController
+from engine.search import SearchRequest
+
+
+class AsyncElastic:
+    """Async client recording the query slots in use during its searches"""
+
+    def __init__(self, pressure):
+        self.pressure = pressure
+        self.in_flight = []
+        self.threads = []
+
+    async def search(self, index, body):
+        self.in_flight.append(self.pressure.in_flight)
+        self.threads.append(threading.active_count())
+        await asyncio.sleep(0.01)
+        return {"hits": {"hits": [body]}}
+
+
+def execution(i):
+    responses = yield [
+        SearchRequest(index="logs", body={"n": i, "r": r}) for r in range(3)
+    ]
+    return [r["hits"]["hits"][0]["r"] for r in responses]
+
+
+def test_async_searches_hold_a_query_slot_each():
+    pressure = PressureController(2)
+    engine = AsyncEngine(None, pressure, 8, 16)
+    engine._es = AsyncElastic(pressure)
+    engine._in_flight = asyncio.Semaphore(16)
+
+    async def run_all():
+        return await asyncio.gather(*[engine.drive(execution(i)) for i in range(4)])
+
+    results = asyncio.run_coroutine_threadsafe(run_all(), engine._loop).result(10)
+    assert results == [[0, 1, 2]] * 4
+    assert len(engine._es.in_flight) == 12
+    assert max(engine._es.in_flight) == 2
+    assert pressure.in_flight == 0 and pressure.queries == 12
+
+
+def test_searches_wait_for_slots_on_the_loop():
+    pressure = PressureController(1)
+    engine = AsyncEngine(None, pressure, 100, 100)
+    engine._es = AsyncElastic(pressure)
+    engine._in_flight = asyncio.Semaphore(100)
+    threads = threading.active_count()
+
+    async def run_all():
+        requests = [SearchRequest(index="logs", body={"n": i}) for i in range(50)]
+        return await engine._multi_search(requests)
+
+    responses = asyncio.run_coroutine_threadsafe(run_all(), engine._loop).result(10)
+    assert [r["hits"]["hits"][0]["n"] for r in responses] == list(range(50))
+    assert max(engine._es.in_flight) == 1
+    # no thread is blocked per search waiting for a slot
+    assert max(engine._es.threads) == threads
+    assert pressure.in_flight == 0
@@ -0,0 +1,98 @@
+import pytest
+
+from engine import backtest
+from engine.backtest import Backtest, get_evaluations
+from models.rule import (
+    Condition,
+    ConditionFunction,
+    ConditionList,
+    ConditionLogic,
+    ConditionOperator,
+    RuleTrigger,
+    RuleTriggerType,
+    ThresholdRule,
+)
+
+INTERVAL = 60_000
+
+
+class BucketElastic:
+    """Answers bucket searches over two logs of host a every minute"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def search(self, index, body):
+        time_range = next(
+            c["range"]["@timestamp"]
+            for c in body["query"]["bool"]["must"]
+            if "range" in c
+        )
+        self.ranges.append((time_range["gte"], time_range["lte"]))
+        start = time_range["gte"] - time_range["gte"] % INTERVAL
+        buckets = [
+            {"key": {"@timestamp": t, "host": "a"}, "count-@timestamp": {"value": 2}}
+            for t in range(start, time_range["lte"] + 1, INTERVAL)
+        ]
+        return {"hits": {"hits": []}, "aggregations": {"groupby": {"buckets": buckets}}}
+
+
+def make_rule():
+    rule = ThresholdRule(
+        name="rule",
+        description="rule",
+        timeframe="10m",
+        trigger=RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m"),
+        datasources=["logs"],
+        group_by=["host"],
+        filters=[],
+        conditions=ConditionList(
+            alert=[
+                Condition(
+                    function=ConditionFunction.COUNT,
+                    field="ALL",
+                    operator=ConditionOperator.GT,
+                    limit=1,
+                    logic=ConditionLogic.ALL,
+                )
+            ],
+            alarm=[],
+        ),
+    )
+    rule.get_datasources = lambda: "logs"
+    return rule
+
+
+def test_evaluations_are_aligned_to_the_interval():
+    assert get_evaluations(10, 3 * INTERVAL, INTERVAL) == [
+        INTERVAL,
+        2 * INTERVAL,
+        3 * INTERVAL,
+    ]
+    assert get_evaluations(INTERVAL, INTERVAL, INTERVAL) == [INTERVAL]
+    assert get_evaluations(10, 20, INTERVAL) == []
+
+
+@pytest.mark.parametrize("per_search", [4, 7, 100])
+def test_buckets_are_searched_once_over_the_whole_range(monkeypatch, per_search):
+    monkeypatch.setattr(backtest, "BUCKETS_PER_SEARCH", per_search)
+    elastic = BucketElastic()
+    runner = Backtest(elastic, workers=3, max_windows=100)
+
+    result = runner.run(make_rule(), 100 * INTERVAL - 10, 130 * INTERVAL - 10)
+    assert result["shared"]
+    assert len(result["windows"]) == 30
+
+    # chunks of whole buckets, from the first window start to the last end
+    ranges = sorted(elastic.ranges)
+    assert ranges[0][0] == 90 * INTERVAL and ranges[-1][1] == 129 * INTERVAL - 1
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert start == end + 1
+    assert all(end - start < per_search * INTERVAL for start, end in ranges)
+    assert len(ranges) == -(-39 // per_search)
+    assert result["cost"]["searches"] == len(ranges)
+
+    # every window adds up its ten buckets
+    for window in result["windows"]:
+        assert window["metrics"] == {"groups": 1, "count-@timestamp": 20}
+    assert result["firing"] == 30 and result["alerts"] == {"alert": 30, "alarm": 0}
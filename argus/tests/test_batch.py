@@ -0,0 +1,117 @@
+from engine.batch import BatchExecutor
+from engine.search import SearchError, SearchRequest
+
+
+class Elastic:
+    """Answers searches with their body, failing the ones asking for it"""
+
+    def __init__(self, down=False):
+        self.down = down
+        self.batches = []
+        self.eql = []
+
+    def msearch(self, searches):
+        if self.down:
+            raise ConnectionError("unreachable")
+        self.batches.append(len(searches))
+        return [
+            (
+                {"error": {"type": "search_phase_execution_exception"}, "status": 400}
+                if body.get("fail")
+                else {"hits": {"hits": [body]}}
+            )
+            for _, body in searches
+        ]
+
+    def eql_search(self, index, **body):
+        if body.get("fail"):
+            raise SearchError("verification_exception", 400)
+        self.eql.append(body)
+        return {"hits": {"events": [body]}}
+
+
+def rounds(name, count):
+    """Execution searching count rounds, one request each"""
+    found = []
+    for i in range(count):
+        response = yield SearchRequest(index="logs", body={"n": f"{name}{i}"})
+        found.append(response["hits"]["hits"][0]["n"])
+    return found
+
+
+def test_searches_of_a_round_share_msearch_calls():
+    elastic = Elastic()
+    executor = BatchExecutor(elastic, msearch_size=2)
+
+    results = executor.run({k: rounds(k, n) for k, n in [("a", 1), ("b", 3), ("c", 3)]})
+    assert results == {"a": ["a0"], "b": ["b0", "b1", "b2"], "c": ["c0", "c1", "c2"]}
+    # three searches in the first round, then two in each of the others
+    assert elastic.batches == [2, 1, 2, 2]
+
+
+def test_each_execution_gets_its_own_errors():
+    def failing():
+        try:
+            yield SearchRequest(index="logs", body={"fail": True})
+        except SearchError as e:
+            return e.status
+
+    def several():
+        responses = yield [
+            SearchRequest(index="logs", body={"n": 1}),
+            SearchRequest(index="logs", body={"fail": True}),
+        ]
+        return [type(r).__name__ for r in responses]
+
+    def eql():
+        try:
+            yield SearchRequest(index="logs", body={"fail": True}, eql=True)
+        except SearchError:
+            return "eql failed"
+
+    results = BatchExecutor(Elastic()).run(
+        {
+            "failing": failing(),
+            "several": several(),
+            "ok": rounds("ok", 1),
+            "eql": eql(),
+        }
+    )
+    assert results == {
+        "failing": 400,
+        "several": ["dict", "SearchError"],
+        "ok": ["ok0"],
+        "eql": "eql failed",
+    }
+
+
+def test_a_failed_msearch_fails_the_searches_of_the_round():
+    def execution():
+        try:
+            yield SearchRequest(index="logs", body={})
+        except ConnectionError:
+            return "retry"
+
+    def crashing():
+        yield SearchRequest(index="logs", body={})
+
+    results = BatchExecutor(Elastic(down=True)).run(
+        {"a": execution(), "b": execution(), "crashing": crashing()}
+    )
+    assert results["a"] == results["b"] == "retry"
+    # executions not handling it end with the error
+    assert isinstance(results["crashing"], ConnectionError)
+
+
+def test_eql_searches_are_sent_on_their_own():
+    def eql(n):
+        response = yield SearchRequest(index="logs", body={"query": n}, eql=True)
+        return response["hits"]["events"][0]["query"]
+
+    elastic = Elastic()
+    results = BatchExecutor(elastic, eql_workers=2).run(
+        {"x": eql("x"), "y": eql("y"), "z": rounds("z", 1)}
+    )
+    assert results == {"x": "x", "y": "y", "z": ["z0"]}
+    assert elastic.batches == [1]
+    assert sorted(b["query"] for b in elastic.eql) == ["x", "y"]
@@ -0,0 +1,141 @@
+from collections import Counter
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from engine.cluster import rendezvous_owner
+
+MONGO_HOST = os.environ.get("MONGO_TEST_HOST", "mongodb://localhost:27017")
+MONGO_DB = "argus_test_cluster"
+
+
+def test_owner_is_one_of_the_nodes():
+    nodes = [f"node-{i}" for i in range(3)]
+    assert rendezvous_owner("job", []) is None
+    assert rendezvous_owner("job", nodes) in nodes
+    # the order the nodes are listed in doesn't matter
+    assert rendezvous_owner("job", nodes) == rendezvous_owner("job", nodes[::-1])
+
+
+def test_jobs_are_spread_between_the_nodes():
+    nodes = [f"node-{i}" for i in range(4)]
+    owners = Counter(rendezvous_owner(f"job-{i}", nodes) for i in range(4000))
+    assert set(owners) == set(nodes)
+    assert all(count > 800 for count in owners.values())
+
+
+def test_only_the_jobs_of_a_leaving_node_move():
+    nodes = [f"node-{i}" for i in range(4)]
+    jobs = [f"job-{i}" for i in range(1000)]
+    before = {job: rendezvous_owner(job, nodes) for job in jobs}
+    after = {job: rendezvous_owner(job, nodes[1:]) for job in jobs}
+
+    for job in jobs:
+        if before[job] != "node-0":
+            assert after[job] == before[job]
+        else:
+            assert after[job] != "node-0"
+
+
+def run_node(jobs, interval, nodes, duration, ready, results, timeout, crash=None):
+    """
+    Engine process claiming the slots of the jobs it owns. A crashing node
+    stops after crash seconds without leaving the cluster.
+    """
+    from mongoengine import connect
+
+    from engine.cluster import EngineCluster
+
+    connect(db=MONGO_DB, host=MONGO_HOST)
+    cluster = EngineCluster(heartbeat=1, timeout=timeout)
+    cluster.heartbeat()
+    # start claiming once every node sees the others
+    while len(cluster.get_nodes()) < nodes:
+        time.sleep(0.1)
+    ready.wait()
+
+    claimed = []
+    started = beat_at = time.time()
+    until = started + duration
+    while time.time() < until:
+        if crash is not None and time.time() - started >= crash:
+            results.put(claimed)
+            results.close()
+            results.join_thread()
+            os._exit(1)
+        if time.time() - beat_at >= 1:
+            cluster.heartbeat()
+            beat_at = time.time()
+        for job in jobs:
+            slot = cluster.claim_slot(job, interval)
+            if slot is not None:
+                claimed.append((job, slot))
+        time.sleep(0.02)
+    results.put(claimed)
+
+
+def run_cluster(jobs, interval, nodes, duration, timeout, crash=None):
+    """Slots claimed by each of the nodes, the first one crashing at crash"""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(nodes)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=run_node,
+            args=(jobs, interval, nodes, duration, ready, results, timeout),
+            kwargs={"crash": crash if i == 0 else None},
+        )
+        for i in range(nodes)
+    ]
+    for process in processes:
+        process.start()
+    claims = [claim for _ in processes for claim in results.get(timeout=60)]
+    for process in processes:
+        process.join(timeout=10)
+    return claims
+
+
+@pytest.fixture
+def database():
+    from mongoengine import connect, disconnect
+    from pymongo.errors import PyMongoError
+
+    client = connect(db=MONGO_DB, host=MONGO_HOST, serverSelectionTimeoutMS=500)
+    try:
+        client.server_info()
+    except PyMongoError:
+        disconnect()
+        pytest.skip(f"No MongoDB at {MONGO_HOST}")
+    client.drop_database(MONGO_DB)
+    yield
+    client.drop_database(MONGO_DB)
+    disconnect()
+
+
+def test_every_slot_runs_once_across_processes(database):
+    jobs = [f"rule-{i}" for i in range(12)]
+    claims = run_cluster(jobs, interval=1, nodes=4, duration=6, timeout=30)
+
+    runs = Counter(claims)
+    assert all(count == 1 for count in runs.values())
+    slots = sorted({slot for _, slot in claims})
+    # the first and last slots are only partly covered by the run
+    for job in jobs:
+        for slot in slots[1:-1]:
+            assert runs[(job, slot)] == 1, f"{job} didn't run in slot {slot}"
+
+
+def test_jobs_of_a_crashed_node_move_to_the_others(database):
+    jobs = [f"rule-{i}" for i in range(12)]
+    timeout, crash = 3, 3
+    claims = run_cluster(jobs, 1, nodes=3, duration=12, timeout=timeout, crash=crash)
+
+    runs = Counter(claims)
+    assert all(count == 1 for count in runs.values())
+    slots = sorted({slot for _, slot in claims})
+    # once the node timed out, its jobs run on the others
+    for job in jobs:
+        for slot in slots[crash + timeout + 2 : -1]:
+            assert runs[(job, slot)] == 1, f"{job} didn't run in slot {slot}"
@@ -0,0 +1,153 @@
+from uuid import UUID
+
+import pytest
+
+from engine.cost import CostEstimate, CostEstimator
+from models.rule import (
+    Condition,
+    ConditionFunction,
+    ConditionList,
+    ConditionLogic,
+    ConditionOperator,
+    RuleTrigger,
+    RuleTriggerType,
+    SimpleFilter,
+    ThresholdRule,
+)
+
+
+class Elastic:
+    """Cluster holding rate documents per second, whose searches take took ms"""
+
+    def __init__(self, rate=10, took=50, valid=True, error=None):
+        self.rate = rate
+        self.took = took
+        self.valid = valid
+        self.error = error
+        self.searches = []
+
+    def count_range(self, index, start, end):
+        return int((end - start) / 1000 * self.rate)
+
+    def validate_query(self, index, query):
+        if self.valid:
+            return {"valid": True}
+        return {"valid": False, "explanations": [{"error": "unknown field"}]}
+
+    def search(self, index, body):
+        if self.error:
+            raise self.error
+        self.searches.append(body)
+        return {"took": self.took, "aggregations": {"groupby": {"buckets": []}}}
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def make_rule(timeframe="10m", filters=()):
+    rule = ThresholdRule(
+        uuid=UUID(int=1),
+        name="rule",
+        description="rule",
+        timeframe=timeframe,
+        trigger=RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m"),
+        datasources=["logs"],
+        group_by=["host"],
+        filters=list(filters),
+        conditions=ConditionList(
+            alert=[
+                Condition(
+                    function=ConditionFunction.COUNT,
+                    field="ALL",
+                    operator=ConditionOperator.GT,
+                    limit=1,
+                    logic=ConditionLogic.ALL,
+                )
+            ],
+            alarm=[],
+        ),
+    )
+    rule.get_datasources = lambda: "logs"
+    return rule
+
+
+def make_estimator(elastic, mode="warn", max_run_ms=1000, max_load=50.0):
+    return CostEstimator(elastic, None, 60, max_run_ms, max_load, mode, 100, False)
+
+
+def test_sample_is_scaled_by_the_searched_documents():
+    estimator = make_estimator(Elastic(rate=10))
+    assert estimator._scale("logs", 40_000, 10_000, 100_000) == (600, 900, 1.5)
+
+    # without sample documents, by the searched time, never below the sample
+    estimator = make_estimator(Elastic(rate=0))
+    assert estimator._scale("logs", 40_000, 10_000, 100_000) == (0, 0, 1.5)
+    assert estimator._scale("logs", 40_000, 90_000, 100_000) == (0, 0, 1)
+
+
+def test_rule_cost_is_extrapolated_from_the_sample():
+    elastic = Elastic(rate=10, took=50)
+    estimate = make_estimator(elastic).estimate_rule(make_rule())
+
+    # ten minutes searched by each run, one in the sample
+    assert (estimate.sample_docs, estimate.searched_docs) == (600, 6000)
+    assert estimate.run_ms == pytest.approx(500)
+    assert estimate.load == pytest.approx(500 / 60)
+    assert estimate.verdict == "ok" and estimate.warnings == []
+    assert elastic.searches[0]["profile"] is True
+
+
+@pytest.mark.parametrize(
+    "mode,max_run_ms,max_load,verdict",
+    [
+        ("warn", 1000, 50, "ok"),
+        ("warn", 100, 50, "warn"),
+        ("reject", 100, 50, "reject"),
+        ("reject", 1000, 5, "reject"),
+    ],
+)
+def test_rules_over_budget_are_warned_or_rejected(mode, max_run_ms, max_load, verdict):
+    estimator = make_estimator(Elastic(), mode, max_run_ms, max_load)
+    estimate = estimator.estimate_rule(make_rule())
+    assert estimate.verdict == verdict
+    assert estimate.rejected is (verdict == "reject")
+    assert len(estimate.warnings) == (verdict != "ok")
+
+
+def test_lint_warnings_only_warn():
+    leading = SimpleFilter(field="user", operator=ConditionOperator.EQ, value="*admin")
+    estimate = make_estimator(Elastic(), "reject").estimate_rule(
+        make_rule(filters=[leading])
+    )
+    assert estimate.verdict == "warn"
+    assert estimate.warnings == ["Filter with a leading wildcard"]
+
+
+@pytest.mark.parametrize(
+    "elastic,mode,verdict",
+    [
+        (Elastic(valid=False), "warn", "warn"),
+        (Elastic(valid=False), "reject", "reject"),
+        (Elastic(error=BadRequest("parsing_exception")), "reject", "reject"),
+    ],
+)
+def test_invalid_queries(elastic, mode, verdict):
+    estimate = make_estimator(elastic, mode).estimate_rule(make_rule())
+    assert not estimate.valid and estimate.error
+    assert estimate.verdict == verdict
+    assert estimate.run_ms == 0
+
+
+def test_unreachable_cluster_leaves_the_cost_unknown():
+    elastic = Elastic(error=ConnectionError("unreachable"))
+    estimate = make_estimator(elastic, "reject").estimate_rule(make_rule())
+    assert estimate.verdict == "unknown" and estimate.valid
+    assert not estimate.rejected
+
+
+def test_finish_without_interval_has_no_load():
+    estimator = make_estimator(Elastic(), max_run_ms=100)
+    estimate = estimator._finish(CostEstimate(sample_took=30), 2, 3)
+    assert estimate.run_ms == 180 and estimate.load is None
+    assert estimate.verdict == "warn"
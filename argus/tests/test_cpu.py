@@ -0,0 +1,84 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+from engine import cpu
+from engine.cpu import CPUPool, deviations
+
+
+def test_deviations_compare_values_as_equality_does():
+    base = [{"host": "a", "port": 1}, {"host": "b", "tags": ["x", "y"]}, "c"]
+    latest = [
+        {"port": 1.0, "host": "a"},
+        {"tags": ["x", "y"], "host": "b"},
+        {"tags": ["y", "x"], "host": "b"},
+        "c",
+        {"host": "a", "port": 2},
+    ]
+    expected = [latest[2], latest[4]]
+    assert deviations({"base": base, "latest": latest}) == expected
+    assert [e for e in latest if e not in base] == expected
+
+
+def test_inline_pool_runs_the_task_in_process():
+    pool = CPUPool(0, 1 << 20, 1)
+    data = {"base": [1, 2], "latest": [3, 2.0, 1]}
+    assert pool.run("deviations", data, 5) == [3]
+
+
+class Segments(SharedMemory):
+    """Shared memory created by the pool, by name"""
+
+    created = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        Segments.created.append(self.name)
+
+
+def is_unlinked(name):
+    try:
+        SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return True
+    return False
+
+
+@pytest.fixture(scope="module")
+def workers():
+    # spawning the workers takes a while, the tests share them
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(cpu, "SharedMemory", Segments)
+        pool = CPUPool(2, 64, 1)
+        yield pool
+        pool.close()
+
+
+@pytest.fixture
+def pool(workers):
+    Segments.created = []
+    return workers
+
+
+def test_pool_round_trips_payloads_through_shared_memory(pool):
+    logs = [[{"source": {"ip": f"10.0.0.{i}"}}] for i in range(10)]
+    assert pool.run("extract_ips", logs, 10) == [[f"10.0.0.{i}"] for i in range(10)]
+    data = {"base": list(range(50)), "latest": list(range(40, 60))}
+    assert pool.run("deviations", data, 70) == list(range(50, 60))
+    # a segment per chunk of the list task, and one for the other
+    assert len(Segments.created) == 3
+    assert all(is_unlinked(name) for name in Segments.created)
+
+    # small payloads are passed inline
+    assert pool.run("deviations", {"base": [1], "latest": [1, 2]}, 3) == [2]
+    assert len(Segments.created) == 3
+
+
+def test_segments_are_released_when_a_task_fails(pool):
+    logs = [[{"source": {"ip": "not an ip address at all"}}] for _ in range(4)]
+    with pytest.raises(ValueError):
+        pool.run("extract_ips", logs, 4)
+    with pytest.raises(KeyError):
+        pool.run("deviations", {"latest": list(range(50))}, 50)
+    assert len(Segments.created) == 3
+    assert all(is_unlinked(name) for name in Segments.created)
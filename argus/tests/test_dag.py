@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+import threading
+import time
+
+from engine.dag import DependencyExecutor, build_graph, find_cycle
+from models.rule import RuleTriggerType
+
+
+def make_rule(uuid, triggered_by=None):
+    if triggered_by:
+        trigger = SimpleNamespace(type=RuleTriggerType.RULE, value=triggered_by)
+    else:
+        trigger = SimpleNamespace(type=RuleTriggerType.PERIODIC, value="1m")
+    return SimpleNamespace(uuid=uuid, name=uuid, trigger=trigger)
+
+
+class Scheduler:
+    """Runs rules triggering their dependents when they finish, as the engine does"""
+
+    def __init__(self, executor, dependents):
+        self.dependencies = executor
+        self.dependents = dependents
+        self.runs = []
+        self._lock = threading.Lock()
+        self.registry = self
+
+    def get_dependents(self, rule_uuid):
+        return [
+            make_rule(uuid, rule_uuid) for uuid in self.dependents.get(rule_uuid, [])
+        ]
+
+    def handle_rule_task(self, rule):
+        with self._lock:
+            self.runs.append(rule.uuid)
+        if rule.uuid == "failing":
+            raise RuntimeError("rule failed")
+        self.dependencies.trigger(self, rule)
+
+    def wait(self, runs):
+        deadline = time.monotonic() + 5
+        while len(self.runs) < runs and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # nothing else runs afterwards
+        time.sleep(0.05)
+        return sorted(self.runs)
+
+
+def test_cycles_closed_by_a_new_trigger_are_found():
+    graph = build_graph(
+        [make_rule("a"), make_rule("b", "a"), make_rule("c", "b"), make_rule("d")]
+    )
+    assert find_cycle(graph, "c", "a") == ["a", "b", "c", "a"]
+    assert find_cycle(graph, "b", "b") == ["b", "b"]
+    assert find_cycle(graph, "a", "d") is None
+    assert find_cycle(graph, "c", "d") is None
+    # rules not saved yet can't close a cycle
+    assert find_cycle(graph, "a", "new") is None
+
+
+def test_shared_dependents_run_once():
+    executor = DependencyExecutor(4)
+    scheduler = Scheduler(executor, {"a": ["b", "c"], "b": ["d"], "c": ["d"]})
+
+    scheduler.handle_rule_task(make_rule("a"))
+    assert scheduler.wait(4) == ["a", "b", "c", "d"]
+
+
+def test_cycles_stop_at_the_rules_already_run():
+    executor = DependencyExecutor(2)
+    scheduler = Scheduler(executor, {"a": ["b"], "b": ["c"], "c": ["a", "b"]})
+
+    scheduler.handle_rule_task(make_rule("a"))
+    assert scheduler.wait(3) == ["a", "b", "c"]
+
+
+def test_rules_run_by_the_tick_are_not_triggered_again():
+    executor = DependencyExecutor(2)
+    scheduler = Scheduler(executor, {"a": ["b", "c"]})
+
+    with executor.tick():
+        for uuid in ("b", "a"):
+            scheduler.handle_rule_task(make_rule(uuid))
+    assert scheduler.wait(3) == ["a", "b", "c"]
+
+    # the next tick triggers them again
+    with executor.tick():
+        scheduler.handle_rule_task(make_rule("a"))
+    assert scheduler.wait(6) == ["a", "a", "b", "b", "c", "c"]
+
+
+def test_failed_dependents_dont_stop_the_others():
+    executor = DependencyExecutor(1)
+    scheduler = Scheduler(executor, {"a": ["failing", "b"], "failing": ["c"]})
+
+    scheduler.handle_rule_task(make_rule("a"))
+    assert scheduler.wait(3) == ["a", "b", "failing"]
@@ -0,0 +1,114 @@
+import operator
+import random
+
+import pytest
+
+from engine.evaluate import evaluate_conditions, metric_column
+from models.rule import (
+    Condition,
+    ConditionFunction,
+    ConditionLogic,
+    ConditionOperator,
+)
+
+OPERATORS = {
+    ConditionOperator.LT: operator.lt,
+    ConditionOperator.LE: operator.le,
+    ConditionOperator.EQ: operator.eq,
+    ConditionOperator.NE: operator.ne,
+    ConditionOperator.GE: operator.ge,
+    ConditionOperator.GT: operator.gt,
+}
+
+
+def condition(field, op, limit, logic=ConditionLogic.ALL):
+    return Condition(
+        function=ConditionFunction.COUNT,
+        field=field,
+        operator=op,
+        limit=limit,
+        logic=logic,
+    )
+
+
+def bucket(**values):
+    return {f"count-{field}": {"value": value} for field, value in values.items()}
+
+
+def evaluate_bucket(conditions, bucket):
+    """Chain of a single bucket, evaluated one condition at a time"""
+    result = None
+    for cond in conditions:
+        value = bucket[cond.get_key()]["value"]
+        if value is None:
+            # as with None before, only != is met by a missing metric
+            met = cond.operator is ConditionOperator.NE
+        else:
+            met = OPERATORS[cond.operator](value, int(cond.limit))
+        if result is None:
+            result = met
+        elif cond.logic is ConditionLogic.ALL:
+            result = result and met
+        else:
+            result = result or met
+    return bool(result)
+
+
+def test_metric_column_reads_missing_values_as_nan():
+    column = metric_column([bucket(a=1), bucket(a=None), bucket(a=2.5)], "count-a")
+    assert column[0] == 1 and column[2] == 2.5
+    assert column[1] != column[1]
+
+
+def test_nothing_is_met_without_conditions_or_buckets():
+    assert len(evaluate_conditions([], [bucket(a=1)])) == 0
+    assert len(evaluate_conditions([condition("a", ConditionOperator.GT, 0)], [])) == 0
+
+
+def test_chain_is_evaluated_left_to_right():
+    # (a > 5 || b > 5) && c == 1
+    conditions = [
+        condition("a", ConditionOperator.GT, 5),
+        condition("b", ConditionOperator.GT, 5, ConditionLogic.ANY),
+        condition("c", ConditionOperator.EQ, 1, ConditionLogic.ALL),
+    ]
+    buckets = [
+        bucket(a=9, b=0, c=1),
+        bucket(a=0, b=9, c=1),
+        bucket(a=9, b=9, c=0),
+        bucket(a=0, b=0, c=1),
+    ]
+    assert evaluate_conditions(conditions, buckets).tolist() == [0, 1]
+
+
+def test_missing_metrics_only_meet_not_equal_conditions():
+    buckets = [bucket(a=None), bucket(a=4)]
+    for op in OPERATORS:
+        met = evaluate_conditions([condition("a", op, 3)], buckets).tolist()
+        assert (0 in met) is (op is ConditionOperator.NE)
+
+
+def test_limits_are_compared_as_integers():
+    conditions = [condition("a", ConditionOperator.GT, 2.9)]
+    buckets = [bucket(a=2.5), bucket(a=2)]
+    assert evaluate_conditions(conditions, buckets).tolist() == [0]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_the_per_bucket_evaluation(seed):
+    rng = random.Random(seed)
+    fields = ["a", "b", "c"]
+    conditions = [
+        condition(
+            rng.choice(fields),
+            rng.choice(list(OPERATORS)),
+            rng.randrange(5),
+            rng.choice(list(ConditionLogic)),
+        )
+        for _ in range(rng.randrange(1, 5))
+    ]
+    buckets = [
+        bucket(**{f: rng.choice([None, *range(6)]) for f in fields}) for _ in range(200)
+    ]
+    expected = [i for i, b in enumerate(buckets) if evaluate_bucket(conditions, b)]
+    assert evaluate_conditions(conditions, buckets).tolist() == expected
@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+import time
+
+from engine.lookup import EQLLookup
+from models.alert import AlertType
+from models.rule import EQLRule, RuleTrigger, RuleTriggerType
+
+
+class Elastic:
+    """Indexed sequences (start, end ms) of the looked up query"""
+
+    def __init__(self, sequences):
+        self.sequences = sorted(sequences)
+
+    def event(self, ms):
+        at = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+        return {"_source": {"@timestamp": at.isoformat()}}
+
+    def search(self, index, body):
+        start = self.sequences[0][0] if self.sequences else None
+        return {"aggregations": {"start": {"value": start}}}
+
+    def eql_search(self, index, query, filter, size):
+        time_range = filter["range"]["@timestamp"]
+        found = [
+            {"events": [self.event(start), self.event(end)]}
+            for start, end in self.sequences
+            if time_range["gte"] <= start and end <= time_range["lte"]
+        ][:size]
+        return {"hits": {"total": {"value": len(found)}, "sequences": found}}
+
+
+def make_rule():
+    rule = EQLRule(
+        name="rule",
+        description="rule",
+        timeframe="1h",
+        trigger=RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m"),
+        datasources=["logs"],
+        query="sequence with maxspan=30s [any where true] [any where true]",
+        alert_type=AlertType.ALERT,
+    )
+    rule.get_datasources = lambda: "logs"
+    return rule
+
+
+def test_sequences_crossing_a_slice_boundary_are_counted_once():
+    first = int(time.time() * 1000) - 300_000
+    sequences = [
+        (first, first + 10_000),
+        # across the boundary of the first two slices
+        (first + 50_000, first + 70_000),
+        (first + 61_000, first + 62_000),
+        (first + 119_000, first + 121_000),
+    ]
+    lookup = EQLLookup(Elastic(sequences), workers=2, slice_ms=60_000)
+
+    job = lookup.start(make_rule())
+    assert job.wait(5)
+    assert job.status == "done"
+    assert job.total == len(sequences)
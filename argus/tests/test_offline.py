@@ -0,0 +1,193 @@
+import pytest
+
+from engine.offline import (
+    OfflineError,
+    aggregate,
+    compile_filter,
+    compile_term,
+    evaluate_offline,
+    load_ndjson,
+)
+from models.rule import (
+    Condition,
+    ConditionFunction,
+    ConditionList,
+    ConditionLogic,
+    ConditionOperator,
+    RuleTrigger,
+    RuleTriggerType,
+    SimpleFilter,
+    ThresholdRule,
+)
+
+
+def condition(function, field):
+    return Condition(
+        function=function,
+        field=field,
+        operator=ConditionOperator.GT,
+        limit=0,
+        logic=ConditionLogic.ALL,
+    )
+
+
+def make_rule(group_by, conditions):
+    return ThresholdRule(
+        name="rule",
+        description="rule",
+        timeframe="5m",
+        trigger=RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m"),
+        datasources=["logs"],
+        group_by=group_by,
+        filters=[],
+        conditions=ConditionList(alert=conditions, alarm=[]),
+    )
+
+
+@pytest.mark.parametrize(
+    "term, values, matched",
+    [
+        ("login", ["login"], True),
+        ("login", ["Login"], False),
+        ('"user login"', ["user login"], True),
+        ("*", ["x"], True),
+        ("*", [], False),
+        ("log*", ["logout"], True),
+        ("l?gin", ["login"], True),
+        ("l?gin", ["logging"], False),
+        (">=10", ["10"], True),
+        (">10", ["10", "x"], False),
+        ("<2.5", ["2"], True),
+        ("[1 TO 5}", ["5"], False),
+        ("[1 TO 5]", ["5"], True),
+        ("{1 TO *]", ["1"], False),
+        ("{1 TO *]", ["1000"], True),
+        ("C\\:\\\\Windows", ["C:\\Windows"], True),
+    ],
+)
+def test_terms_match_as_query_string(term, values, matched):
+    assert compile_term(term)(values) is matched
+
+
+@pytest.mark.parametrize("term", ["a b", "(a)", "a:b", "-a", "", "[a TO 5]"])
+def test_unsupported_terms_are_rejected(term):
+    with pytest.raises(OfflineError):
+        compile_term(term)
+
+
+def test_filter_values_are_alternatives_and_not_equal_negates():
+    doc = {"event": {"action": "logout"}}
+    filter_eq = SimpleFilter(
+        field="event.action", operator=ConditionOperator.EQ, value="login,logout"
+    )
+    filter_ne = SimpleFilter(
+        field="event.action", operator=ConditionOperator.NE, value="login,logout"
+    )
+    assert compile_filter(filter_eq)(doc)
+    assert not compile_filter(filter_ne)(doc)
+    assert compile_filter(filter_ne)({"event": {}})
+
+
+def test_groups_and_metrics_of_the_documents():
+    rule = make_rule(
+        ["host"],
+        [
+            condition(ConditionFunction.COUNT, "ALL"),
+            condition(ConditionFunction.UNIQ, "user"),
+            condition(ConditionFunction.SUM, "bytes"),
+            condition(ConditionFunction.AVG, "bytes"),
+            condition(ConditionFunction.MIN, "bytes"),
+            condition(ConditionFunction.MAX, "bytes"),
+        ],
+    )
+    documents = [
+        {"host": "a", "user": "x", "bytes": 10},
+        {"host": "a", "user": "x", "bytes": 30},
+        {"host": ["a", "b"], "user": "y", "bytes": "n/a"},
+        # documents without the group by field aren't in any group
+        {"user": "z", "bytes": 5},
+    ]
+
+    buckets = {b["key"]: b for b in aggregate(rule, documents)["groupby"]["buckets"]}
+    assert set(buckets) == {"a", "b"}
+    a, b = buckets["a"], buckets["b"]
+    assert a["doc_count"] == 3 and b["doc_count"] == 1
+    assert a["count-@timestamp"]["value"] == 3
+    assert a["unique-user"]["value"] == 2
+    assert a["sum-bytes"]["value"] == 40
+    assert a["avg-bytes"]["value"] == 20
+    assert a["min-bytes"]["value"] == 10 and a["max-bytes"]["value"] == 30
+    # non numeric values have no metric, as with a search
+    assert b["sum-bytes"]["value"] == 0
+    assert b["avg-bytes"]["value"] is None
+    assert b["max-bytes"]["value"] is None
+
+
+def test_several_group_by_fields_key_their_buckets_with_lists():
+    rule = make_rule(["host", "user"], [condition(ConditionFunction.COUNT, "ALL")])
+    documents = [{"host": "a", "user": ["x", "y"]}, {"host": "a", "user": "x"}]
+
+    buckets = aggregate(rule, documents)["groupby"]["buckets"]
+    counts = {tuple(b["key"]): b["count-@timestamp"]["value"] for b in buckets}
+    assert counts == {("a", "x"): 2, ("a", "y"): 1}
+
+
+def test_metrics_without_group_by():
+    rule = make_rule([], [condition(ConditionFunction.COUNT, "ALL")])
+    assert aggregate(rule, []) == {"count-@timestamp": {"value": 0}}
+    assert aggregate(rule, [{}, {}]) == {"count-@timestamp": {"value": 2}}
+
+
+def test_samples_are_read_as_sources_or_hits():
+    data = b'{"a": 1}\n\n{"_id": "1", "_source": {"a": 2}}\n'
+    assert load_ndjson(data) == [{"a": 1}, {"a": 2}]
+    with pytest.raises(OfflineError, match="line 2"):
+        load_ndjson('{"a": 1}\n{a}')
+    with pytest.raises(OfflineError):
+        load_ndjson("[1]")
+
+
+def test_rules_are_evaluated_over_the_timeframe_of_the_sample():
+    rule = make_rule(["host"], [condition(ConditionFunction.COUNT, "ALL")])
+    rule.filters = [
+        SimpleFilter(field="event.action", operator=ConditionOperator.EQ, value="login")
+    ]
+    documents = [
+        # older than the 5 minutes before the latest log
+        {
+            "@timestamp": "2024-01-01T00:00:00Z",
+            "host": "old",
+            "event": {"action": "login"},
+        },
+        {
+            "@timestamp": "2024-01-01T00:08:00Z",
+            "host": "a",
+            "event": {"action": "login"},
+        },
+        {
+            "@timestamp": "2024-01-01T00:09:00Z",
+            "host": "b",
+            "event": {"action": "logout"},
+        },
+        {
+            "@timestamp": "2024-01-01T00:10:00Z",
+            "host": "a",
+            "event": {"action": "login"},
+        },
+        {"host": "c", "event": {"action": "login"}},
+    ]
+
+    aggregations, alerts, stats = evaluate_offline(rule, documents)
+    buckets = aggregations["groupby"]["buckets"]
+    assert [(b["key"], b["count-@timestamp"]["value"]) for b in buckets] == [("a", 2)]
+    assert [a["groupby"] for a in alerts["alert"]] == ["a"]
+    assert (stats["documents"], stats["in_range"], stats["matched"]) == (5, 3, 2)
+    assert stats["end"] - stats["start"] == 5 * 60_000
+
+    rule.timeframe = "always"
+    _, _, stats = evaluate_offline(rule, documents)
+    assert (stats["in_range"], stats["matched"]) == (4, 3)
+    # calendar units are left to the date math of elasticsearch
+    rule.timeframe = "1M"
+    with pytest.raises(OfflineError, match="timeframe"):
+        evaluate_offline(rule, documents)
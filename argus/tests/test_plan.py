@@ -0,0 +1,91 @@
+from uuid import UUID
+
+from engine import plan as plan_module
+from engine.plan import QueryPlanCache
+from engine.registry import DATASOURCES
+from models.rule import (
+    Condition,
+    ConditionList,
+    RuleTrigger,
+    RuleTriggerType,
+    ThresholdRule,
+)
+
+
+class Registry:
+    """Collection versions as seen by the engine registry"""
+
+    def __init__(self):
+        self.versions = {}
+
+    def get_version(self, collection):
+        return self.versions.get(collection, 0)
+
+
+def make_rule(indices="logs"):
+    rule = ThresholdRule(
+        name="rule",
+        description="rule",
+        timeframe="5m",
+        trigger=RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m"),
+        datasources=["logs"],
+        group_by=["host"],
+        filters=[],
+        conditions=ConditionList(
+            alert=[
+                Condition(
+                    function="count", field="ALL", operator=">", limit=1, logic="AND"
+                )
+            ],
+            alarm=[],
+        ),
+    )
+    # reloads of the same rule share its uuid
+    rule.uuid = UUID(int=1)
+    rule.get_datasources = lambda: indices
+    return rule
+
+
+def test_plan_is_reused_without_signing_the_same_document(monkeypatch):
+    signed = []
+    signature = plan_module.rule_signature
+    monkeypatch.setattr(
+        plan_module, "rule_signature", lambda r: signed.append(r) or signature(r)
+    )
+    cache = QueryPlanCache(Registry())
+    rule = make_rule()
+
+    first = cache.get(rule)
+    assert cache.get(rule) is first
+    assert cache.get(rule) is first
+    assert len(signed) == 1
+
+
+def test_plan_of_a_reloaded_document_is_reused_until_its_searches_change():
+    cache = QueryPlanCache(Registry())
+    first = cache.get(make_rule())
+
+    # the registry loads new documents on every rules version
+    assert cache.get(make_rule()) is first
+
+    changed = make_rule()
+    changed.group_by = ["user"]
+    plan = cache.get(changed)
+    assert plan is not first
+    assert b"user" in plan.template
+
+
+def test_plan_is_compiled_again_on_a_datasources_version():
+    registry = Registry()
+    cache = QueryPlanCache(registry)
+    rule = make_rule()
+    first = cache.get(rule)
+    assert first.index == "logs"
+
+    # a datasource write in any process bumps the collection version
+    rule.get_datasources = lambda: "logs,audit"
+    assert cache.get(rule) is first
+    registry.versions[DATASOURCES] = 1
+    plan = cache.get(rule)
+    assert plan.index == "logs,audit"
+    assert plan.datasources == 1
@@ -0,0 +1,65 @@
+import pytest
+from elasticsearch.exceptions import ApiError
+
+from engine.pressure import PressureController, ThrottledClient
+
+
+class Elastic:
+    """Client answering searches while recording the engine slots in use"""
+
+    def __init__(self, pressure, error=None):
+        self.pressure = pressure
+        self.error = error
+        self.in_flight = []
+
+    def search(self, index, body):
+        self.in_flight.append(self.pressure.in_flight)
+        if self.error:
+            raise self.error
+        return {"hits": {"hits": []}}
+
+    def eql_search(self, raise_errors=False, **kwargs):
+        try:
+            return self.search(None, None)
+        except Exception:
+            if raise_errors:
+                raise
+
+    def count_range(self, index, start, end):
+        return self.pressure.in_flight
+
+
+def rejection():
+    return ApiError("rejected", type("Meta", (), {"status": 429})(), {})
+
+
+def test_engine_searches_hold_a_slot():
+    pressure = PressureController(4)
+    elastic = Elastic(pressure)
+    client = ThrottledClient(elastic)
+
+    client.search(index="logs", body={})
+    elastic.search(index="logs", body={})
+    assert elastic.in_flight == [1, 0]
+    assert pressure.in_flight == 0 and pressure.queries == 1
+    # other calls go straight to the client
+    assert client.count_range("logs", 0, 1) == 0
+
+
+def test_rejected_searches_reduce_the_limit():
+    pressure = PressureController(4)
+    client = ThrottledClient(Elastic(pressure, rejection()))
+
+    with pytest.raises(ApiError):
+        client.search(index="logs", body={})
+    assert pressure.rejections == 1 and pressure.limit == 2
+
+
+def test_failed_eql_searches_are_observed_and_swallowed():
+    pressure = PressureController(4)
+    client = ThrottledClient(Elastic(pressure, rejection()))
+
+    assert client.eql_search(index="logs", query="any where true") is None
+    assert pressure.rejections == 1
+    with pytest.raises(ApiError):
+        client.eql_search(index="logs", query="any where true", raise_errors=True)
@@ -0,0 +1,442 @@
+from datetime import datetime, timezone
+from uuid import UUID
+import copy
+
+import pytest
+
+from builder import build_bucket_selector
+from config import config
+from constants import SEARCH_LIMIT
+from engine.cpu import CPUPool
+from engine.plan import compile_plan
+from engine.registry import RuleRegistry
+from engine.search import drive
+from engine.suppress import fingerprint
+from models.alert import AlertType
+from models.rule import (
+    Condition,
+    ConditionFunction,
+    ConditionList,
+    ConditionLogic,
+    ConditionOperator,
+    EQLRule,
+    RuleTrigger,
+    RuleTriggerType,
+    ThresholdRule,
+)
+from utils.filter import index_list_by_attrs
+
+TRIGGER = RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m")
+
+
+def make_threshold_rule():
+    rule = ThresholdRule(
+        uuid=UUID(int=2),
+        name="rule",
+        description="rule",
+        timeframe="5m",
+        trigger=TRIGGER,
+        datasources=["logs"],
+        group_by=["host"],
+        filters=[],
+        conditions=ConditionList(
+            alert=[
+                Condition(
+                    function=ConditionFunction.COUNT,
+                    field="ALL",
+                    operator=ConditionOperator.GT,
+                    limit=1,
+                    logic=ConditionLogic.ALL,
+                )
+            ],
+            alarm=[
+                Condition(
+                    function=ConditionFunction.UNIQ,
+                    field="user",
+                    operator=ConditionOperator.GT,
+                    limit=3,
+                    logic=ConditionLogic.ALL,
+                )
+            ],
+        ),
+    )
+    rule.get_datasources = lambda: "logs"
+    rule.update = lambda **kwargs: None
+    return rule
+
+
+def make_eql_rule(checkpoint=None):
+    rule = EQLRule(
+        uuid=UUID(int=1),
+        name="rule",
+        description="rule",
+        timeframe="1h",
+        trigger=TRIGGER,
+        datasources=["logs"],
+        query="sequence with maxspan=5m [any where true] [any where true]",
+        alert_type=AlertType.ALERT,
+        checkpoint=checkpoint,
+    )
+    rule.get_datasources = lambda: "logs"
+    # runs store their checkpoint in the database
+    rule.update = lambda **kwargs: None
+    return rule
+
+
+class Scheduler:
+    """Engine side of rule runs, recording their alerts"""
+
+    def __init__(self):
+        self.registry = RuleRegistry()
+        self.plans = self
+        self.windows = None
+        self.cpu = CPUPool(0, 0, 0)
+        self.alerts = []
+        self.suppressed = set()
+
+    def get(self, rule):
+        return compile_plan(rule)
+
+    def suppress(self, rule, key):
+        return key in self.suppressed
+
+    def emit(self, alert, rule):
+        self.alerts.append(alert)
+
+    def trigger_dependents(self, rule):
+        pass
+
+
+class SequenceElastic:
+    """Answers EQL searches with the sequences (start, end ms) within their range"""
+
+    def __init__(self, sequences):
+        self.sequences = sorted(sequences)
+        self.searches = 0
+
+    def event(self, ms):
+        at = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+        return {"_id": str(ms), "_source": {"@timestamp": at.isoformat()}}
+
+    def eql_search(self, index, query, filter, size):
+        self.searches += 1
+        time_range = filter["range"]["@timestamp"]
+        found = [
+            {"events": [self.event(start), self.event(end)]}
+            for start, end in self.sequences
+            if time_range["gte"] <= start and end <= time_range["lte"]
+        ][:size]
+        return {"hits": {"total": {"value": len(found)}, "sequences": found}}
+
+
+def test_conditions_are_resolved_on_copies():
+    rule = make_threshold_rule()
+
+    assert [c.field for c in rule.get_conditions()] == ["@timestamp", "user"]
+    lists = rule.get_condition_lists()
+    assert [c.get_key() for c in lists["alert"]] == ["count-@timestamp"]
+    assert [c.get_key() for c in lists["alarm"]] == ["unique-user"]
+    # the stored conditions are untouched
+    assert rule.conditions.alert[0].field == "ALL"
+    assert "ALL" in repr(rule.to_mongo().to_dict())
+
+
+def test_bucket_selector_of_resolved_conditions():
+    rule = make_threshold_rule()
+    selector = build_bucket_selector(list(rule.get_condition_lists().values()))
+    paths = selector["bucket_selector"]["buckets_path"]
+    assert sorted(paths.values()) == ["count-@timestamp", "unique-user"]
+
+
+def test_checkpoint_is_kept_off_the_shared_document():
+    registry = RuleRegistry()
+    rule = make_eql_rule(checkpoint=1_000)
+    assert registry.get_checkpoint(rule) == 1_000
+
+    registry.set_checkpoint(str(rule.uuid), 5_000)
+    assert registry.get_checkpoint(rule) == 5_000
+    assert rule.checkpoint == 1_000
+    # an older run finishing late doesn't move the checkpoint back
+    registry.set_checkpoint(str(rule.uuid), 4_000)
+    assert registry.get_checkpoint(rule) == 5_000
+    # a newer one stored by another process wins
+    assert registry.get_checkpoint(make_eql_rule(checkpoint=9_000)) == 9_000
+
+
+def test_search_range_overlaps_the_checkpoint_by_the_maxspan():
+    rule = make_eql_rule()
+    end = 10 * 3_600_000
+    assert rule.get_search_range(end) == (end - 3_600_000, end)
+    checkpoint = end - 60_000
+    assert rule.get_search_range(end, checkpoint) == (checkpoint - 300_000, end)
+
+
+@pytest.fixture
+def eql_config(monkeypatch):
+    monkeypatch.setattr(config, "ENGINE_EQL_SIZE", 10)
+    monkeypatch.setattr(config, "ENGINE_EQL_MAX_PAGES", 5)
+    monkeypatch.setattr(config, "ENGINE_EQL_LAG_SECONDS", 5)
+
+
+def run_eql(rule, scheduler, sequences, end):
+    elastic = SequenceElastic(sequences)
+    drive(rule.execute(scheduler, end=end), elastic)
+    return elastic
+
+
+def test_old_matches_of_the_overlap_dont_hide_new_ones(eql_config):
+    end = 10 * 3_600_000
+    checkpoint = end - 60_000
+    rule, scheduler = make_eql_rule(checkpoint), Scheduler()
+    # sequences of the overlap the previous run already saw, then a new one
+    old = [(checkpoint - 200_000 + i, checkpoint - 1_000 + i) for i in range(25)]
+    new = (checkpoint - 100_000, checkpoint + 10_000)
+
+    elastic = run_eql(rule, scheduler, old + [new], end)
+    assert elastic.searches == 3
+    assert len(scheduler.alerts) == 1
+    assert scheduler.alerts[0].fingerprint
+    assert scheduler.registry.get_checkpoint(rule) == end - 5_000
+
+
+def test_checkpoint_stays_behind_now_by_the_ingest_lag(eql_config):
+    end = 10 * 3_600_000
+    rule, scheduler = make_eql_rule(end - 60_000), Scheduler()
+    # a sequence ending within the lag is left to the next run
+    late = (end - 8_000, end - 2_000)
+
+    run_eql(rule, scheduler, [late], end)
+    assert scheduler.alerts == []
+    assert scheduler.registry.get_checkpoint(rule) == end - 5_000
+
+    run_eql(rule, scheduler, [late], end + 60_000)
+    assert len(scheduler.alerts) == 1
+
+
+def test_checkpoint_only_moves_past_the_pages_read(eql_config):
+    end = 10 * 3_600_000
+    checkpoint = end - 600_000
+    rule, scheduler = make_eql_rule(checkpoint), Scheduler()
+    # more suppressed repeats of new matches than the pages of a run can read
+    repeats = [
+        (checkpoint + i * 1_000, checkpoint + i * 1_000 + 500) for i in range(80)
+    ]
+    scheduler.suppressed = {
+        fingerprint((None, str(start)), (None, str(end))) for start, end in repeats
+    }
+
+    elastic = run_eql(rule, scheduler, repeats, end)
+    assert elastic.searches == 5
+    assert scheduler.alerts == []
+    # the next run reads again from the last match of the last page
+    assert scheduler.registry.get_checkpoint(rule) == repeats[45][0] - 1
+
+
+def test_pages_restart_at_the_millisecond_they_ended_in(eql_config):
+    end = 10 * 3_600_000
+    checkpoint = end - 600_000
+    rule, scheduler = make_eql_rule(checkpoint), Scheduler()
+    # the last match of the first page starts along with the new one
+    at = checkpoint + 1_000
+    old = [(at - 9 + i, at + i) for i in range(9)] + [
+        (at, at + 100 + i) for i in range(3)
+    ]
+    new = (at, at + 200)
+    scheduler.suppressed = {
+        fingerprint((None, str(start)), (None, str(end))) for start, end in old
+    }
+
+    elastic = run_eql(rule, scheduler, old + [new], end)
+    assert elastic.searches == 2
+    assert len(scheduler.alerts) == 1
+    assert scheduler.alerts[0].fingerprint == fingerprint(
+        (None, str(at)), (None, str(at + 200))
+    )
+
+
+def test_pages_filled_by_a_millisecond_move_past_it(eql_config):
+    end = 10 * 3_600_000
+    checkpoint = end - 600_000
+    rule, scheduler = make_eql_rule(checkpoint), Scheduler()
+    at = checkpoint + 1_000
+    old = [(at, at + 100 + i) for i in range(12)]
+    scheduler.suppressed = {
+        fingerprint((None, str(start)), (None, str(end))) for start, end in old
+    }
+
+    elastic = run_eql(rule, scheduler, old + [(at + 1, at + 200)], end)
+    assert elastic.searches == 3
+    assert len(scheduler.alerts) == 1
+
+
+class GroupElastic:
+    """
+    Answers threshold searches over in-memory logs with composite pages of
+    their hosts, filtered as the bucket selector of the rule conditions does
+    """
+
+    def __init__(self, logs):
+        self.logs = logs
+        self.bodies = []
+
+    def search(self, index, body):
+        self.bodies.append(copy.deepcopy(body))
+        terms = [c["term"] for c in body["query"]["bool"]["must"] if "term" in c]
+        logs = [
+            log
+            for log in self.logs
+            if all(log.get(f) == v for term in terms for f, v in term.items())
+        ]
+        hits = [{"_source": log} for log in logs][: body["size"]]
+        if "aggs" not in body:
+            return {"hits": {"hits": hits}}
+
+        composite = body["aggs"]["groupby"]["composite"]
+        aggs = body["aggs"]["groupby"].get("aggs", {})
+        hosts = sorted({log["host"] for log in logs if isinstance(log["host"], str)})
+        if "after" in composite:
+            hosts = [h for h in hosts if h > composite["after"]["host"]]
+        page = hosts[: composite["size"]]
+        buckets = []
+        for host in page:
+            group = [log for log in logs if log["host"] == host]
+            users = len({log["user"] for log in group})
+            if "selector" in aggs and len(group) <= 1 and users <= 3:
+                continue
+            bucket = {
+                "key": {"host": host},
+                "count-@timestamp": {"value": len(group)},
+                "unique-user": {"value": users},
+            }
+            if "evidence" in aggs:
+                size = aggs["evidence"]["top_hits"]["size"]
+                bucket["evidence"] = {
+                    "hits": {"hits": [{"_source": log} for log in group][:size]}
+                }
+            buckets.append(bucket)
+        groupby = {"buckets": buckets}
+        if page:
+            groupby["after_key"] = {"host": page[-1]}
+        return {"hits": {"hits": hits}, "aggregations": {"groupby": groupby}}
+
+    def msearch(self, searches):
+        return [self.search(index, body) for index, body in searches]
+
+
+def logs(*counts):
+    """Logs of the hosts h0, h1... with the given number of logs each"""
+    return [
+        {"host": f"h{i}", "user": f"u{n}"}
+        for i, count in enumerate(counts)
+        for n in range(count)
+    ]
+
+
+@pytest.fixture
+def threshold_config(monkeypatch):
+    monkeypatch.setattr(config, "ENGINE_COMPOSITE_PAGE_SIZE", 3)
+    monkeypatch.setattr(config, "ENGINE_EVIDENCE_MODE", "lazy")
+    monkeypatch.setattr(config, "ENGINE_EVIDENCE_SIZE", 2)
+    monkeypatch.setattr(config, "ENGINE_CONDITION_PUSHDOWN", True)
+
+
+def run_threshold(elastic, scheduler=None):
+    scheduler = scheduler or Scheduler()
+    drive(make_threshold_rule().execute(scheduler), elastic)
+    return scheduler
+
+
+def alerted_hosts(scheduler):
+    return sorted(a.context["host"] for a in scheduler.alerts)
+
+
+@pytest.mark.parametrize("hosts,searches", [(7, 3), (6, 3), (3, 2), (2, 1)])
+def test_groups_are_paged_until_a_short_page(
+    threshold_config, monkeypatch, hosts, searches
+):
+    monkeypatch.setattr(config, "ENGINE_CONDITION_PUSHDOWN", False)
+    elastic = GroupElastic(logs(*[2] * hosts))
+
+    scheduler = run_threshold(elastic)
+    pages = [b for b in elastic.bodies if "aggs" in b]
+    assert len(pages) == searches
+    afters = [b["aggs"]["groupby"]["composite"].get("after") for b in pages]
+    assert afters == [None] + [{"host": f"h{3 * i + 2}"} for i in range(searches - 1)]
+    assert alerted_hosts(scheduler) == [f"h{i}" for i in range(hosts)]
+
+
+def test_selected_pages_are_read_until_no_after_key(threshold_config):
+    # a single firing host per page, the last page selects none
+    elastic = GroupElastic(logs(1, 2, 1, 1, 1, 5, 1))
+
+    scheduler = run_threshold(elastic)
+    # pages of h0-h2, h3-h5, h6 and the empty one past it
+    assert len(elastic.bodies) == 4
+    assert alerted_hosts(scheduler) == ["h1", "h5", "h5"]
+
+
+def test_firing_buckets_take_their_evidence_from_top_hits(threshold_config):
+    elastic = GroupElastic(logs(1, 3, 1))
+
+    scheduler = run_threshold(elastic)
+    # no search besides the pages, and no hits fetched with them
+    assert len(elastic.bodies) == 2
+    assert all(b["size"] == 0 for b in elastic.bodies)
+    (alert,) = scheduler.alerts
+    assert alert.logs == [{"host": "h1", "user": "u0"}, {"host": "h1", "user": "u1"}]
+
+
+def test_evidence_is_searched_for_the_firing_buckets_only(
+    threshold_config, monkeypatch
+):
+    monkeypatch.setattr(config, "ENGINE_CONDITION_PUSHDOWN", False)
+    elastic = GroupElastic(logs(1, 3, 2, 2))
+    scheduler = Scheduler()
+    # an open alert of h3 doesn't need evidence
+    scheduler.suppressed = {fingerprint("alert", ("h3",))}
+
+    run_threshold(elastic, scheduler)
+    scoped = [b for b in elastic.bodies if "aggs" not in b]
+    assert [b["query"]["bool"]["must"][-1] for b in scoped] == [
+        {"term": {"host": "h1"}},
+        {"term": {"host": "h2"}},
+    ]
+    assert all(b["size"] == 2 for b in scoped)
+    assert alerted_hosts(scheduler) == ["h1", "h2"]
+    assert [len(a.logs) for a in scheduler.alerts] == [2, 2]
+    assert {log["host"] for log in scheduler.alerts[1].logs} == {"h2"}
+
+
+def test_eager_evidence_is_grouped_from_the_first_page_hits(
+    threshold_config, monkeypatch
+):
+    monkeypatch.setattr(config, "ENGINE_EVIDENCE_MODE", "eager")
+    elastic = GroupElastic(logs(3, 1, 1, 2))
+
+    scheduler = run_threshold(elastic)
+    assert [b["size"] for b in elastic.bodies] == [SEARCH_LIMIT, 0, 0]
+    assert alerted_hosts(scheduler) == ["h0", "h3"]
+    # capped at the evidence size
+    assert [a.logs for a in scheduler.alerts] == [
+        [{"host": "h0", "user": "u0"}, {"host": "h0", "user": "u1"}],
+        [{"host": "h3", "user": "u0"}, {"host": "h3", "user": "u1"}],
+    ]
+
+
+def test_hits_are_indexed_by_their_group_by_values():
+    hits = [
+        {"_source": {"host": {"name": "a"}, "user": "x"}},
+        {"_source": {"host.name": "a", "user": "x"}},
+        {"_source": {"host": {"name": "b"}, "user": "x"}},
+        # multi-valued fields can't be the key of a bucket
+        {"_source": {"host": {"name": ["a", "b"]}, "user": "x"}},
+        {"_source": {"user": "y"}},
+    ]
+
+    index = index_list_by_attrs(hits, ["host.name", "user"], limit=5)
+    assert {key: len(group) for key, group in index.items()} == {
+        ("a", "x"): 2,
+        ("b", "x"): 1,
+        (None, "y"): 1,
+    }
+    assert len(index_list_by_attrs(hits, ["user"], limit=3)[("x",)]) == 3
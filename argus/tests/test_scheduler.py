@@ -0,0 +1,136 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from config import config
+from engine.registry import ANALYTICS, RULES
+from scheduler import EngineScheduler
+
+
+@pytest.mark.parametrize("mode", ["default", "batch", "async"])
+def test_engine_starts_without_elasticsearch(monkeypatch, mode):
+    monkeypatch.setattr(config, "ENGINE_EXECUTION_MODE", mode)
+    engine = EngineScheduler(None, SimpleNamespace(settings=None), None)
+
+    assert engine.aio is None
+    rule = SimpleNamespace(risk=1, name="rule")
+    assert engine._defer(rule) is False
+
+
+class Jobs:
+    """Jobs of the APScheduler of one process"""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def add_job(self, id, func, seconds, **kwargs):
+        assert id not in self.jobs
+        trigger = SimpleNamespace(interval=timedelta(seconds=seconds))
+        self.jobs[id] = SimpleNamespace(id=id, func=func, trigger=trigger)
+
+    def get_job(self, id):
+        return self.jobs.get(id)
+
+    def get_jobs(self):
+        return list(self.jobs.values())
+
+    def remove_job(self, id):
+        del self.jobs[id]
+
+
+class Registry:
+    """Rules and analytics in the database, shared by every process"""
+
+    def __init__(self):
+        self.rules = {}
+        self.analytics = {}
+        self.versions = {RULES: 0, ANALYTICS: 0}
+
+    def get_version(self, collection):
+        return self.versions[collection]
+
+    def get_periodic_rules(self):
+        return [r for r in self.rules.values() if r.active]
+
+    def get_analytics(self):
+        return list(self.analytics.values())
+
+    def write_rule(self, uuid, interval=60, active=True):
+        trigger = SimpleNamespace(get_sleep_time=lambda: interval)
+        self.rules[uuid] = SimpleNamespace(uuid=uuid, trigger=trigger, active=active)
+        self.versions[RULES] += 1
+        return self.rules[uuid]
+
+    def write_analytic(self, code, interval=300, active=True):
+        analytic = SimpleNamespace(
+            code=code, active=active, get_sleep_time=lambda: interval
+        )
+        self.analytics[code] = analytic
+        self.versions[ANALYTICS] += 1
+        return analytic
+
+
+@pytest.fixture(autouse=True)
+def local_state(monkeypatch):
+    # suppression entries of removed rules are deleted from the database
+    monkeypatch.setattr(config, "ENGINE_SUPPRESSION_WINDOW", 0)
+
+
+def rule_jobs(engine):
+    """Rule uuid -> interval of the local rule jobs"""
+    jobs = {
+        j.id: int(j.trigger.interval.total_seconds())
+        for j in engine._scheduler.get_jobs()
+        if j.func == engine.handle_rule_task
+    }
+    jobs.update({uuid: entry[0] for uuid, entry in engine._batch_rules.items()})
+    return jobs
+
+
+@pytest.mark.parametrize("mode", ["default", "batch"])
+def test_processes_follow_rules_written_by_another(monkeypatch, mode):
+    monkeypatch.setattr(config, "ENGINE_EXECUTION_MODE", mode)
+    registry = Registry()
+    api, other = [
+        EngineScheduler(None, SimpleNamespace(settings=None), Jobs()) for _ in range(2)
+    ]
+    for engine in (api, other):
+        engine.registry = registry
+        engine.reconcile()
+
+    # the process serving the API call loads the rule right away
+    api.load_rule(registry.write_rule("rule"))
+    other.reconcile()
+    assert rule_jobs(other) == {"rule": 60}
+
+    registry.write_rule("rule", interval=120)
+    other.reconcile()
+    assert rule_jobs(other) == {"rule": 120}
+
+    registry.write_rule("rule", interval=120, active=False)
+    other.reconcile()
+    assert rule_jobs(other) == {}
+    api.reconcile()
+    assert rule_jobs(api) == {}
+
+
+def test_processes_follow_analytics_written_by_another():
+    registry = Registry()
+    engine = EngineScheduler(None, SimpleNamespace(settings=None), Jobs())
+    engine.registry = registry
+    analytic_jobs = lambda: {
+        j.id: int(j.trigger.interval.total_seconds())
+        for j in engine._scheduler.get_jobs()
+        if j.func == engine.handle_analytic_task
+    }
+
+    registry.write_analytic("dns")
+    engine.reconcile()
+    assert analytic_jobs() == {"dns": 300}
+    # loading an analytic twice keeps its single job
+    engine.load_analytic(registry.analytics["dns"])
+
+    registry.write_analytic("dns", active=False)
+    engine.reconcile()
+    assert analytic_jobs() == {}
@@ -0,0 +1,110 @@
+from engine.batch import BatchExecutor
+from engine.search import SearchError, SearchRequest
+from engine.shared import merge_requests, split_response
+
+FILTER = {"bool": {"filter": [{"term": {"event.action": "login"}}]}}
+
+
+def aggregation(name, field="host"):
+    return SearchRequest(
+        index="logs",
+        body={"size": 0, "query": FILTER, "aggs": {name: {"terms": {"field": field}}}},
+    )
+
+
+def test_searches_of_the_same_documents_are_merged():
+    requests = [aggregation("hosts"), aggregation("users", "user")]
+    searches, routes = merge_requests(requests)
+
+    assert len(searches) == 1
+    assert searches[0].body["query"] == FILTER
+    assert searches[0].body["aggs"] == {
+        "shared0__hosts": {"terms": {"field": "host"}},
+        "shared1__users": {"terms": {"field": "user"}},
+    }
+    assert routes == [(0, 0), (0, 1)]
+
+
+def test_searches_of_other_documents_are_sent_as_they_are():
+    other_index = aggregation("hosts")
+    other_index.index = "audit"
+    other_filter = aggregation("hosts")
+    other_filter.body["query"] = {"match_all": {}}
+    hits = SearchRequest(index="logs", body={"size": 10, "query": FILTER})
+    eql = SearchRequest(index="logs", body={"query": "any where true"}, eql=True)
+    requests = [aggregation("hosts"), other_index, other_filter, hits, eql]
+
+    searches, routes = merge_requests(requests)
+    assert searches == requests
+    assert routes == [(i, None) for i in range(len(requests))]
+
+
+def test_routes_follow_the_order_of_the_requests():
+    other = aggregation("hosts")
+    other.index = "audit"
+    requests = [aggregation("a"), other, aggregation("b"), aggregation("c")]
+    searches, routes = merge_requests(requests)
+
+    assert [s.index for s in searches] == ["logs", "audit"]
+    assert routes == [(0, 0), (1, None), (0, 1), (0, 2)]
+
+
+def test_responses_are_split_by_namespace():
+    response = {
+        "took": 3,
+        "hits": {"total": {"value": 12}},
+        "aggregations": {
+            "shared0__hosts": {"buckets": [{"key": "a"}]},
+            "shared1__hosts": {"buckets": [{"key": "b"}]},
+            "shared10__hosts": {"buckets": [{"key": "c"}]},
+        },
+    }
+
+    first = split_response(response, 0)
+    assert first["aggregations"] == {"hosts": {"buckets": [{"key": "a"}]}}
+    assert first["hits"] == response["hits"]
+    assert split_response(response, 1)["aggregations"] == {
+        "hosts": {"buckets": [{"key": "b"}]}
+    }
+    assert split_response(response, 10)["aggregations"] == {
+        "hosts": {"buckets": [{"key": "c"}]}
+    }
+
+
+def test_unmerged_and_failed_responses_are_unchanged():
+    response = {"aggregations": {"hosts": {}}}
+    assert split_response(response, None) is response
+    error = SearchError("rejected", 429)
+    assert split_response(error, 0) is error
+
+
+class Elastic:
+    """Answers each aggregation of a search with a bucket of its own name"""
+
+    def __init__(self):
+        self.searches = []
+
+    def msearch(self, searches):
+        self.searches.extend(searches)
+        return [
+            {"aggregations": {n: {"buckets": [{"key": n}]} for n in body["aggs"]}}
+            for _, body in searches
+        ]
+
+
+def test_batched_rules_share_a_scan_and_get_their_own_aggregations():
+    def execution(name, field):
+        response = yield aggregation(name, field)
+        return response["aggregations"]
+
+    elastic = Elastic()
+    executor = BatchExecutor(elastic, shared_scans=True)
+    results = executor.run(
+        {"hosts": execution("hosts", "host"), "users": execution("users", "user")}
+    )
+
+    assert len(elastic.searches) == 1 and executor.shared == 1
+    assert results == {
+        "hosts": {"hosts": {"buckets": [{"key": "shared0__hosts"}]}},
+        "users": {"users": {"buckets": [{"key": "shared1__users"}]}},
+    }
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+import threading
+import time
+
+from engine.sink import AlertSink
+from engine.suppress import SuppressionUpdate
+
+
+class Alert:
+    """Alert document inserted by the sink in a list shared by its class"""
+
+    stored = []
+    inserts = []
+    # inserts wait on it when cleared, as on a slow database
+    database = threading.Event()
+
+    def validate(self):
+        pass
+
+    class objects:
+        @staticmethod
+        def insert(alerts, load_bulk):
+            Alert.database.wait(5)
+            Alert.inserts.append(len(alerts))
+            Alert.stored.extend(alerts)
+
+
+def make_sink(batch_size=10, flush_seconds=0.05, queue_size=100, queue_timeout=1):
+    Alert.stored, Alert.inserts = [], []
+    Alert.database.set()
+    return AlertSink(batch_size, flush_seconds, queue_size, queue_timeout)
+
+
+def test_alerts_of_a_full_queue_are_dropped_after_the_timeout():
+    sink = make_sink(batch_size=1, queue_size=1, queue_timeout=0.05)
+    Alert.database.clear()
+    alerts = [Alert() for _ in range(3)]
+    assert sink.emit(alerts[0])
+    # the writer holds the first alert, the second fills the queue
+    while not sink._queue.empty():
+        time.sleep(0.001)
+    assert sink.emit(alerts[1])
+    assert not sink.emit(alerts[2])
+    stats = sink.stats()
+    assert stats["backpressure"] == 1 and stats["dropped"] == 1
+    # nothing is written by the emitting thread
+    assert Alert.stored == []
+
+    Alert.database.set()
+    sink.close()
+    assert Alert.stored == alerts[:2]
+
+
+def test_alerts_are_written_in_batches_and_flushed_on_time():
+    sink = make_sink(batch_size=3, flush_seconds=0.05)
+    Alert.database.clear()
+    alerts = [Alert() for _ in range(7)]
+    for alert in alerts:
+        assert sink.emit(alert)
+    Alert.database.set()
+
+    # the last alert doesn't fill a batch, it's written when the flush is due
+    deadline = time.monotonic() + 5
+    while len(Alert.stored) < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert Alert.stored == alerts
+    assert Alert.inserts == [3, 3, 1]
+    assert sink.stats()["written"] == 7
+    sink.close()
+
+
+def test_close_flushes_the_queue_and_later_alerts_are_written_directly():
+    sink = make_sink(flush_seconds=10)
+    alerts = [Alert() for _ in range(4)]
+    for alert in alerts[:3]:
+        sink.emit(alert)
+
+    sink.close()
+    assert not sink._thread.is_alive()
+    assert Alert.stored == alerts[:3]
+    assert not sink.emit(alerts[3])
+    assert Alert.stored == alerts
+    assert sink.stats() == {
+        "queued": 0,
+        "written": 4,
+        "failed": 0,
+        "backpressure": 0,
+        "dropped": 0,
+    }
+    # closing again is a no-op, as at exit
+    sink.close()
+
+
+def test_repeats_of_an_alert_in_a_batch_are_a_single_update():
+    sink = make_sink()
+    applied = []
+    sink.apply_update = applied.append
+    now = datetime.utcnow()
+    updates = [
+        SuppressionUpdate("rule", "key", "alert", 1, now + timedelta(seconds=s), now)
+        for s in (2, 1)
+    ]
+    sink.write(updates + [SuppressionUpdate("rule", "other", "alert", 1, now, now)])
+
+    assert [(u.key, u.repeats) for u in applied] == [("key", 2), ("other", 1)]
+    assert applied[0].last_seen == now + timedelta(seconds=2)
@@ -0,0 +1,186 @@
+import time
+from uuid import UUID
+
+from engine.stream import StreamEngine, StreamRule, is_streamable
+from models.rule import (
+    Condition,
+    ConditionFunction,
+    ConditionList,
+    ConditionLogic,
+    ConditionOperator,
+    RuleTrigger,
+    RuleTriggerType,
+    SimpleFilter,
+    ThresholdRule,
+)
+
+FIELD_TYPES = {
+    "event.action": {"keyword"},
+    "event.code": {"long", "keyword"},
+    "message": {"text"},
+    "duration": {"float"},
+}
+
+
+def make_rule(filters=None, group_by=("host",)):
+    rule = ThresholdRule(
+        uuid=UUID(int=1),
+        name="rule",
+        description="rule",
+        timeframe="5m",
+        trigger=RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m"),
+        datasources=["logs"],
+        group_by=list(group_by),
+        filters=filters if filters is not None else [action("login")],
+        conditions=ConditionList(
+            alert=[
+                Condition(
+                    function=ConditionFunction.COUNT,
+                    field="ALL",
+                    operator=ConditionOperator.GT,
+                    limit=1,
+                    logic=ConditionLogic.ALL,
+                )
+            ],
+            alarm=[],
+        ),
+    )
+    rule.get_indices = lambda: "logs"
+    return rule
+
+
+def action(value, field="event.action", operator=ConditionOperator.EQ):
+    return SimpleFilter(field=field, operator=operator, value=value)
+
+
+class Elastic:
+    """Indexed documents (epoch ms, source), answering point in time searches"""
+
+    def __init__(self, documents, field_types=FIELD_TYPES):
+        self.documents = documents
+        self.field_types = field_types
+        self.open = set()
+
+    def get_field_types(self, index, fields):
+        return {f: self.field_types[f] for f in fields if f in self.field_types}
+
+    def open_point_in_time(self, index, keep_alive):
+        pit = f"pit-{len(self.open)}"
+        self.open.add(pit)
+        return pit
+
+    def close_point_in_time(self, pit_id):
+        self.open.remove(pit_id)
+
+    def search(self, body):
+        assert body["pit"]["id"] in self.open
+        time_range = body["query"]["range"]["@timestamp"]
+        after = body.get("search_after", [time_range["gt"], -1])
+        hits = [
+            {"sort": [str(timestamp), shard_doc], "_source": source}
+            for shard_doc, (timestamp, source) in enumerate(self.documents)
+            if time_range["gt"] < timestamp <= time_range["lte"]
+            and (timestamp, shard_doc) > (int(after[0]), after[1])
+        ]
+        hits.sort(key=lambda hit: (int(hit["sort"][0]), hit["sort"][1]))
+        return {"hits": {"hits": hits[: body["size"]]}}
+
+
+def login(host="a"):
+    return {"event": {"action": "login"}, "host": host}
+
+
+def test_only_exact_filters_on_exact_fields_are_streamed():
+    assert is_streamable(make_rule(), FIELD_TYPES)
+    assert is_streamable(make_rule([action("4624", "event.code")]), FIELD_TYPES)
+    assert is_streamable(make_rule([]), {})
+
+    # analyzed, inexact and unmapped fields
+    assert not is_streamable(make_rule([action("failed", "message")]), FIELD_TYPES)
+    assert not is_streamable(make_rule([action("1.0", "duration")]), FIELD_TYPES)
+    assert not is_streamable(make_rule([action("a", "user.name")]), FIELD_TYPES)
+    # field name patterns and query syntax in values
+    assert not is_streamable(make_rule([action("login", "event.*")]), FIELD_TYPES)
+    assert not is_streamable(make_rule([action("log*")]), FIELD_TYPES)
+    assert not is_streamable(
+        make_rule([action("login", operator=ConditionOperator.GT)]), FIELD_TYPES
+    )
+
+
+def test_matching_documents_are_counted_per_group():
+    stream_rule = StreamRule.compile(
+        make_rule([action("login"), action("x", "host", ConditionOperator.NE)])
+    )
+    now = int(time.time() * 1000)
+    documents = [login("a"), login("a"), login("b"), login("x"), {"host": "a"}]
+    for doc in documents:
+        if stream_rule.matches(doc):
+            stream_rule.add(doc, now)
+
+    buckets = stream_rule.aggregations(now)["groupby"]["buckets"]
+    counts = {b["key"]: b["count-@timestamp"]["value"] for b in buckets}
+    assert counts == {"a": 2, "b": 1}
+    # counts leave the window with the timeframe
+    assert stream_rule.aggregations(now + 10 * 60_000)["groupby"]["buckets"] == []
+
+
+def test_documents_of_the_same_millisecond_are_all_read():
+    now = int(time.time() * 1000)
+    elastic = Elastic([(now - 20_000, login()) for _ in range(7)])
+    engine = StreamEngine(elastic, page_size=2, max_pages=10, lag=5)
+    assert engine.add(make_rule())
+
+    assert engine.poll() == 7
+    assert elastic.open == set()
+    state = engine.state()["datasources"][0]
+    assert state["documents"] == 7 and not state["lagging"]
+
+
+def test_lagging_tail_is_read_up_to_a_whole_millisecond():
+    now = int(time.time() * 1000)
+    times = [now - 60_000, now - 50_000, now - 50_000, now - 40_000, now - 30_000]
+    elastic = Elastic([(t, login()) for t in times])
+    engine = StreamEngine(elastic, page_size=2, max_pages=1, lag=5)
+    assert engine.add(make_rule())
+    tail = engine._tails["logs"]
+
+    # the second document's millisecond goes on past the page
+    assert engine.poll() == 1
+    assert tail.lagging and tail.position == now - 50_001
+    assert engine.state()["datasources"][0]["lagging"]
+    assert engine.poll() == 2
+    assert tail.position == now - 50_000
+    # a page ending the new documents is still full
+    assert engine.poll() == 1
+    assert engine.poll() == 1
+    assert not tail.lagging and tail.position > now - 30_000
+    assert tail.documents == len(times)
+
+
+def test_rules_added_to_a_running_tail_read_their_history():
+    now = int(time.time() * 1000)
+    elastic = Elastic([(now - 60_000, login()), (now - 50_000, login("b"))])
+    engine = StreamEngine(elastic, page_size=10, max_pages=10, lag=5)
+    assert engine.add(make_rule())
+    engine.poll()
+
+    other = make_rule(group_by=["host", "event.action"])
+    other.uuid = UUID(int=2)
+    assert engine.add(other)
+    stream_rule = engine._rules[str(other.uuid)]
+    assert stream_rule.backfill == engine._tails["logs"].position
+
+    # a document read by the tail is counted once
+    elastic.documents.append((engine._tails["logs"].position + 1, login()))
+    time.sleep(0.01)
+    engine.poll()
+    assert stream_rule.backfill is None
+    buckets = stream_rule.aggregations(now)["groupby"]["buckets"]
+    counts = {tuple(b["key"]): b["count-@timestamp"]["value"] for b in buckets}
+    assert counts == {("a", "login"): 2, ("b", "login"): 1}
+
+
+def test_rules_on_inexact_fields_are_not_streamed():
+    engine = StreamEngine(Elastic([]), page_size=10, max_pages=10, lag=5)
+    assert not engine.add(make_rule([action("failed", "message")]))
+    assert engine.state()["rules"] == 0
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from engine import suppress
+from engine.suppress import SuppressionCache
+
+
+class Entries:
+    """Persisted suppression entries, queried like the SuppressionEntry collection"""
+
+    def __init__(self):
+        self.entries = []
+        self.deleted = []
+
+    def objects(self, expires_at__gt=None, rule=None):
+        if rule is not None:
+            return SimpleNamespace(delete=lambda: self.deleted.append(rule))
+        return [e for e in self.entries if e.expires_at > expires_at__gt]
+
+    def add(self, rule, key, alert, hits, expires_in):
+        expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
+        entry = SimpleNamespace(rule=rule, key=key, alert=alert, hits=hits)
+        entry.expires_at = expires_at
+        self.entries.append(entry)
+
+
+@pytest.fixture
+def entries(monkeypatch):
+    entries = Entries()
+    monkeypatch.setattr(suppress, "SuppressionEntry", entries)
+    return entries
+
+
+def test_repeats_of_a_recorded_alert_are_counted(entries):
+    cache = SuppressionCache(60)
+    assert cache.hit("rule", "key") is None
+
+    new = cache.record("rule", "key", "alert")
+    assert new.new and new.repeats == 0
+    update = cache.hit("rule", "key")
+    assert update.alert == "alert" and update.repeats == 1
+    assert cache.stats() == {"entries": 1, "suppressed": 1}
+
+
+def test_persisted_entries_are_loaded(entries):
+    entries.add("rule", "key", "stored", 4, 30)
+    entries.add("rule", "expired", "old", 1, -30)
+    cache = SuppressionCache(60)
+
+    assert cache.hit("rule", "key").alert == "stored"
+    assert cache.hit("rule", "expired") is None
+
+
+def test_loading_keeps_alerts_recorded_before_it(entries):
+    entries.add("rule", "key", "stored", 4, 30)
+    cache = SuppressionCache(60)
+
+    # the first alert of the process comes before any repeat
+    cache.record("rule", "key", "recorded")
+    cache.record("rule", "other", "recorded")
+    assert cache.hit("rule", "key").alert == "recorded"
+    assert cache.hit("rule", "other").alert == "recorded"
+
+
+def test_discarded_rules_raise_new_alerts(entries):
+    cache = SuppressionCache(60)
+    cache.record("rule", "key", "alert")
+    cache.record("other", "key", "alert")
+
+    cache.discard("rule")
+    assert cache.hit("rule", "key") is None
+    assert cache.hit("other", "key") is not None
+    assert entries.deleted == ["rule"]
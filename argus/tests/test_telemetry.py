@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from engine.search import SearchRequest, drive
+from engine.telemetry import Telemetry
+
+
+class Elastic:
+    """Answers searches after a delay, failing the ones asking for it"""
+
+    def search(self, index, body):
+        time.sleep(0.02)
+        if body.get("fail"):
+            raise ConnectionError("unreachable")
+        return {
+            "took": 5,
+            "hits": {"total": {"value": 3}, "hits": []},
+            "aggregations": {"groupby": {"buckets": [{"key": "a"}, {"key": "b"}]}},
+        }
+
+
+@pytest.fixture
+def telemetry():
+    telemetry = Telemetry(10)
+    yield telemetry
+    # rollups left are written to the database at exit
+    telemetry._rollups.clear()
+
+
+def execution(*bodies):
+    """Builds, then searches each body, processing every response"""
+    time.sleep(0.02)
+    errors = []
+    for body in bodies:
+        try:
+            yield SearchRequest(index="logs", body=body)
+        except ConnectionError as e:
+            errors.append(e)
+        time.sleep(0.01)
+    return len(errors)
+
+
+def test_runs_are_split_in_build_search_and_process(telemetry):
+    telemetry.alert("rule")
+
+    result = drive(telemetry.measure("rule", "rule", execution({}, {})), Elastic())
+    assert result == 0
+    (run,) = telemetry.get_runs("rule")
+    assert run["build"] >= 0.02 and run["search"] >= 0.04 and run["process"] >= 0.02
+    assert run["duration"] >= run["build"] + run["search"] + run["process"]
+    assert (run["searches"], run["took"], run["hits"], run["buckets"]) == (2, 10, 6, 4)
+    assert run["alerts"] == 1 and run["error"] is None
+
+
+def test_search_errors_are_thrown_into_the_execution(telemetry):
+
+    measured = telemetry.measure("rule", "rule", execution({"fail": True}, {}))
+    assert drive(measured, Elastic()) == 1
+    (run,) = telemetry.get_runs("rule")
+    # the failed search is counted, its wait too
+    assert run["searches"] == 2 and run["took"] == 5
+    assert run["search"] >= 0.04 and run["error"] is None
+
+
+def test_failed_runs_are_recorded_with_their_error(telemetry):
+
+    def failing():
+        yield SearchRequest(index="logs", body={})
+        raise ValueError("bad response")
+
+    with pytest.raises(ValueError):
+        drive(telemetry.measure("rule", "rule", failing()), Elastic())
+    (run,) = telemetry.get_runs("rule")
+    assert run["error"] == "ValueError('bad response')"
+    (rollup,) = telemetry._rollups.values()
+    assert rollup["runs"] == 1 and rollup["errors"] == 1
+
+
+def test_closing_a_measured_run_closes_the_execution(telemetry):
+    closed = []
+
+    def pending():
+        try:
+            yield SearchRequest(index="logs", body={})
+        finally:
+            closed.append(True)
+
+    measured = telemetry.measure("rule", "rule", pending())
+    assert isinstance(next(measured), SearchRequest)
+    measured.close()
+    assert closed == [True]
+    # an abandoned run isn't recorded
+    assert telemetry.get_runs("rule") == []
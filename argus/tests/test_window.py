@@ -0,0 +1,238 @@
+import random
+
+import pytest
+
+from config import config
+from engine.search import drive
+from engine.window import IncrementalWindows, merge_groups
+from models.rule import (
+    Condition,
+    ConditionList,
+    RuleTrigger,
+    RuleTriggerType,
+    ThresholdRule,
+)
+
+INTERVAL = 60_000
+
+
+class CompositeElastic:
+    """Answers the searches of the incremental windows over in-memory documents"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.searches = 0
+
+    def search(self, index, body):
+        assert index == "logs"
+        self.searches += 1
+        time_range = next(
+            c["range"]["@timestamp"]
+            for c in body["query"]["bool"]["must"]
+            if "range" in c
+        )
+        docs = [
+            d
+            for d in self.docs
+            if time_range["gte"] <= d["@timestamp"] <= time_range["lte"]
+        ]
+        aggs = body["aggs"]
+        if "groupby" not in aggs:
+            return {"hits": {"hits": []}, "aggregations": self.metrics(aggs, docs)}
+
+        composite = aggs["groupby"]["composite"]
+        groups = {}
+        for doc in docs:
+            key = []
+            for source in composite["sources"]:
+                ((name, spec),) = source.items()
+                if "date_histogram" in spec:
+                    size = int(spec["date_histogram"]["fixed_interval"][:-2])
+                    key.append((name, doc["@timestamp"] - doc["@timestamp"] % size))
+                elif name in doc:
+                    key.append((name, doc[name]))
+                else:
+                    break
+            else:
+                groups.setdefault(tuple(key), []).append(doc)
+
+        keys = sorted(groups.keys(), key=lambda k: [v for _, v in k])
+        after = composite.get("after")
+        if after:
+            keys = [k for k in keys if [v for _, v in k] > list(after.values())]
+        keys = keys[: composite["size"]]
+        buckets = [
+            {"key": dict(k), **self.metrics(aggs["groupby"]["aggs"], groups[k])}
+            for k in keys
+        ]
+        groupby = {"buckets": buckets}
+        if buckets:
+            groupby["after_key"] = buckets[-1]["key"]
+        return {"hits": {"hits": []}, "aggregations": {"groupby": groupby}}
+
+    def metrics(self, aggs, docs):
+        result = {}
+        for name, agg in aggs.items():
+            ((func, spec),) = agg.items()
+            values = [d[spec["field"]] for d in docs if spec["field"] in d]
+            if func == "value_count":
+                value = len(values)
+            elif func == "sum":
+                value = float(sum(values))
+            else:
+                value = {"min": min, "max": max}[func](values) if values else None
+            result[name] = {"value": value}
+        return result
+
+
+def make_rule(timeframe, group_by, function="count", field="ALL"):
+    rule = ThresholdRule(
+        name="rule",
+        description="rule",
+        timeframe=timeframe,
+        trigger=RuleTrigger(type=RuleTriggerType.PERIODIC, value="1m"),
+        datasources=["logs"],
+        group_by=group_by,
+        filters=[],
+        conditions=ConditionList(
+            alert=[
+                Condition(
+                    function=function, field=field, operator=">", limit=1, logic="AND"
+                )
+            ],
+            alarm=[],
+        ),
+    )
+
+    def get_datasources():
+        # a run searches the indices its cached plan resolved
+        raise AssertionError("datasources resolved from the database")
+
+    rule.get_datasources = get_datasources
+    return rule
+
+
+def expected(docs, start, end, group_by, key, field):
+    groups = {}
+    for doc in docs:
+        if not start <= doc["@timestamp"] <= end:
+            continue
+        if any(f not in doc for f in group_by):
+            continue
+        group = tuple(doc[f] for f in group_by)
+        group = group[0] if len(group) == 1 else list(group) if group else None
+        values = groups.setdefault(repr(group), [])
+        if field in doc:
+            values.append(doc[field])
+    return groups
+
+
+@pytest.fixture
+def docs():
+    rng = random.Random(3)
+    return [
+        {
+            "@timestamp": 10 * INTERVAL + rng.randrange(30 * INTERVAL),
+            "host": rng.choice(["a", "b", "c", "d"]),
+            "user": rng.choice(["x", "y"]),
+            "bytes": rng.randrange(100),
+        }
+        for _ in range(600)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    monkeypatch.setattr(config, "ENGINE_COMPOSITE_PAGE_SIZE", 3)
+
+
+def test_merge_groups_combines_partials():
+    target = {("a",): {"c": 2, "m": 5, "s": 1.0}}
+    source = {("a",): {"c": 3, "m": None, "s": 2.5}, ("b",): {"c": 1, "m": 7, "s": 0}}
+    merge_groups(target, source, {"c": "value_count", "m": "min", "s": "sum"})
+    assert target == {
+        ("a",): {"c": 5, "m": 5, "s": 3.5},
+        ("b",): {"c": 1, "m": 7, "s": 0},
+    }
+
+
+def test_to_aggregations_averages_sum_and_count():
+    windows = IncrementalWindows()
+    rule = make_rule("10m", ["host"], "avg", "bytes")
+    aggs, metrics = windows.metric_aggs(rule)
+    assert metrics == {"avg-bytes|sum": "sum", "avg-bytes|count": "value_count"}
+    groups = {"a": {"avg-bytes|sum": 30.0, "avg-bytes|count": 4}, "b": {}}
+    result = windows.to_aggregations(rule, groups)
+    assert result == {
+        "groupby": {
+            "buckets": [
+                {"key": "a", "avg-bytes": {"value": 7.5}},
+                {"key": "b", "avg-bytes": {"value": None}},
+            ]
+        }
+    }
+
+
+@pytest.mark.parametrize(
+    "group_by,function,field",
+    [
+        ([], "count", "ALL"),
+        (["host"], "sum", "bytes"),
+        (["host", "user"], "max", "bytes"),
+        (["host"], "avg", "bytes"),
+    ],
+)
+def test_incremental_runs_match_a_full_search(docs, group_by, function, field):
+    windows = IncrementalWindows()
+    rule = make_rule("10m", group_by, function, field)
+    elastic = CompositeElastic(docs)
+    key = rule.get_conditions()[0].get_key()
+    field = rule.get_conditions()[0].field
+
+    for end in range(20 * INTERVAL + 123, 35 * INTERVAL, INTERVAL // 2):
+        result = drive(windows.execute(rule, "logs", 0, end), elastic)
+        start = end - 10 * INTERVAL
+        start -= start % INTERVAL
+        groups = expected(docs, start, end, group_by, key, field)
+
+        aggs = result["aggregations"]
+        buckets = aggs["groupby"]["buckets"] if group_by else [{"key": None, **aggs}]
+        assert {repr(b["key"]) for b in buckets} == set(groups.keys())
+        for bucket in buckets:
+            values = groups[repr(bucket["key"])]
+            value = bucket[key]["value"]
+            if function == "count":
+                assert value == len(values)
+            elif function == "sum":
+                assert value == sum(values)
+            elif function == "max":
+                assert value == max(values)
+            else:
+                assert value == pytest.approx(sum(values) / len(values))
+
+
+def test_always_timeframe_accumulates_completed_buckets(docs):
+    windows = IncrementalWindows()
+    rule = make_rule("always", ["host"])
+    elastic = CompositeElastic(docs)
+    for end in range(20 * INTERVAL, 40 * INTERVAL, INTERVAL):
+        result = drive(windows.execute(rule, "logs", 0, end), elastic)
+        counts = {
+            b["key"]: b["count-@timestamp"]["value"]
+            for b in result["aggregations"]["groupby"]["buckets"]
+        }
+        expect = {}
+        for doc in docs:
+            if doc["@timestamp"] <= end:
+                expect[doc["host"]] = expect.get(doc["host"], 0) + 1
+        assert counts == expect
+
+
+def test_changed_rule_resets_its_window(docs):
+    windows = IncrementalWindows()
+    rule = make_rule("10m", ["host"])
+    elastic = CompositeElastic(docs)
+    drive(windows.execute(rule, "logs", 0, 25 * INTERVAL), elastic)
+    state = windows._get_state(rule)
+    rule.group_by = ["user"]
+    assert windows._get_state(rule) is not state
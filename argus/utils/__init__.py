@@ -16,6 +16,11 @@ def get_analytics_path() -> str:
     return os.path.join(base_dir, "..", "data", "analytics")
 
 
+def get_samples_path() -> str:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_dir, "..", "data", "samples")
+
+
 def dict_same_attrs_class(c, data) -> bool:
     attrs = c.__annotations__
     return data.keys() == attrs.keys()
@@ -3,12 +3,9 @@ from sigma.pipelines.elasticsearch.zeek import ecs_zeek_beats
 from sigma.pipelines.elasticsearch.windows import ecs_windows
 from sigma.rule import SigmaRule
 from benedict import benedict
-from collections import Counter
 import ipaddress
 import yaml
 
-from utils.time import gen_day_from_date
-
 
 def extract_ips_from_logs(logs: list[dict]) -> list[str]:
     ip_attrs = ["source.ip", "destination.ip", "host.ip"]
@@ -86,19 +83,6 @@ def get_all_ipv4_mac(ips: list[str], macs: list[str]):
     return r_private_ips, r_macs
 
 
-def get_event_day_count(events: list):
-    day_occurrence = [e.split("T")[0] for e in events]
-    count_by_day = Counter(day_occurrence)
-
-    r = gen_day_from_date(day_occurrence[0])
-    for k, v in count_by_day.items():
-        for d in r:
-            if d["date"] == k:
-                d["value"] = v
-
-    return r
-
-
 def extract_sigma_rule_data(data):
     """
     Converts a Sigma rule to the expected EQL rule format
@@ -1,14 +1,45 @@
 from ipaddress import IPv4Address, IPv4Network
-from benedict import benedict
+from typing import Optional
 
 
-def filter_list_by_attr(data: list, filters: dict):
-    result = []
+def compile_getter(attr: str):
+    """
+    Returns a function reading a dotted attribute path from a log document,
+    either as nested objects or as a literal dotted key
+    """
+    path = attr.split(".")
+
+    def getter(doc: dict):
+        if attr in doc:
+            return doc[attr]
+        value = doc
+        for key in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
+    return getter
+
+
+def index_list_by_attrs(data: list, attrs: list[str], limit: Optional[int] = None):
+    """
+    Groups the sources of a list of hits by the values of the given attributes,
+    in a single pass. Returns a dict from value tuple to the group sources.
+    """
+    getters = [compile_getter(attr) for attr in attrs]
+    index = {}
     for log in data:
-        e = benedict(log["_source"])
-        if all([e.get(attr) == value for attr, value in filters.items()]):
-            result.append(e)
-    return result
+        source = log["_source"]
+        key = tuple(getter(source) for getter in getters)
+        try:
+            group = index.setdefault(key, [])
+        except TypeError:
+            # multi-valued fields never match a single bucket key
+            continue
+        if limit is None or len(group) < limit:
+            group.append(source)
+    return index
 
 
 def filter_ips_by_subnets(ips: list[str], macs: list[str], subnets: list[IPv4Network]):
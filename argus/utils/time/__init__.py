@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 
@@ -42,3 +42,29 @@ def gen_day_from_date(start, offset=5):
         day = start_date + timedelta(days=n)
         dates.append({"date": day.strftime("%Y-%m-%d"), "value": 0})
     return dates
+
+
+def get_timeframe_seconds(timeframe: str) -> Optional[int]:
+    """Converts a relative timeframe (e.g. 10m, 1d) to seconds"""
+    lookup = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    value, period = timeframe[:-1], timeframe[-1:]
+
+    if not (value.isnumeric() and period in lookup.keys()):
+        return None
+
+    return int(value) * lookup[period]
+
+
+def to_epoch_millis(value) -> Optional[int]:
+    """Converts an epoch ms number or an ISO 8601 date to epoch ms"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if not isinstance(value, str):
+        return None
+    try:
+        date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp() * 1000)